@@ -0,0 +1,175 @@
+# admission.py
+"""
+In-process admission control for the chat endpoints.
+
+- RateLimiter: token buckets keyed by session id or client IP. Each bucket holds
+  up to `burst` tokens and refills at `rate` tokens per second. Buckets live in an
+  LRU map capped at `max_keys`, so memory stays bounded however many keys show up
+  (an evicted key simply starts again with a full bucket).
+- ConcurrencyLimiter: a cap on requests doing model work at the same time;
+  requests wait up to `timeout` seconds for a free slot, and queued requests are
+  served shortest-job-first (with aging and priority classes) or FIFO.
+
+Both report how long the client should wait, for a 429 Retry-After header.
+"""
+
+import math
+import time
+import itertools
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Dict, Hashable, List, Optional, Tuple
+
+
+class Overloaded(Exception):
+    """Raised when a request can't be admitted; retry_after is in seconds."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class RateLimiter:
+    def __init__(self, rate: float, burst: float, max_keys: int = 100_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[Hashable, Tuple[float, float]]" = OrderedDict()  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def try_acquire(self, key: Hashable, cost: float = 1.0, now: Optional[float] = None) -> Tuple[bool, float]:
+        """Take cost tokens from key's bucket. Returns (allowed, seconds until it would be allowed)."""
+        if not self.enabled:
+            return True, 0.0
+        cost = min(cost, self.burst)  # one request never needs more than a full bucket
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+                self.allowed += 1
+            else:
+                self.rejected += 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)  # least recently seen key
+        return allowed, 0.0 if allowed else (cost - tokens) / self.rate
+
+    def check(self, key: Hashable, cost: float = 1.0, what: str = "requests"):
+        """try_acquire, raising Overloaded if the bucket is empty."""
+        allowed, retry_after = self.try_acquire(key, cost)
+        if not allowed:
+            raise Overloaded(f"Too many {what}", retry_after)
+
+    def stats(self) -> Dict:
+        return {"rate": self.rate, "burst": self.burst, "allowed": self.allowed,
+                "rejected": self.rejected, "tracked_keys": len(self._buckets)}
+
+
+SCHEDULING_POLICIES = ("sjf", "fifo")
+DEFAULT_CLASS_WEIGHTS = {"first_turn": 0.5, "returning": 1.0, "batch": 2.0}
+
+
+class _Waiter:
+    __slots__ = ("cost", "priority", "enqueued", "seq")
+
+    def __init__(self, cost: float, priority: str, enqueued: float, seq: int):
+        self.cost = cost
+        self.priority = priority
+        self.enqueued = enqueued
+        self.seq = seq
+
+
+class ConcurrencyLimiter:
+    """
+    Caps concurrent model work and decides who goes next when requests queue.
+
+    With policy "sjf", the waiter with the lowest score runs first:
+        score = cost * class_weight - aging * seconds_waited
+    so cheap jobs (short prompts) overtake expensive ones, but a waiting job's score
+    keeps falling until it runs, so nothing starves. Priority classes scale cost
+    (weight < 1 means sooner). Policy "fifo" serves waiters in arrival order.
+    """
+
+    def __init__(self, max_concurrent: int, timeout: float = 10.0, policy: str = "sjf",
+                 aging: float = 100.0, class_weights: Optional[Dict[str, float]] = None):
+        if policy not in SCHEDULING_POLICIES:
+            raise ValueError(f"Unknown scheduling policy: {policy} (expected one of {SCHEDULING_POLICIES})")
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self.policy = policy
+        self.aging = aging
+        self.class_weights = {**DEFAULT_CLASS_WEIGHTS, **(class_weights or {})}
+        self._cond = threading.Condition()
+        self._waiting: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._waits = deque(maxlen=1000)  # recent queue waits in seconds
+        self.active = 0
+        self.rejected = 0
+
+    def _score(self, waiter: _Waiter, now: float) -> float:
+        if self.policy == "fifo":
+            return waiter.seq
+        weight = self.class_weights.get(waiter.priority, 1.0)
+        return waiter.cost * weight - self.aging * (now - waiter.enqueued)
+
+    def _next(self) -> Optional[_Waiter]:
+        now = time.monotonic()
+        return min(self._waiting, key=lambda w: (self._score(w, now), w.seq), default=None)
+
+    @contextmanager
+    def slot(self, cost: float = 1.0, priority: str = "default"):
+        """
+        Hold one model-work slot for the duration of the block, or raise Overloaded.
+        cost estimates the work (e.g. prompt + new tokens); priority names a class.
+        """
+        if self.max_concurrent <= 0:
+            yield
+            return
+        now = time.monotonic()
+        waiter = _Waiter(cost, priority, now, next(self._seq))
+        deadline = now + self.timeout
+        with self._cond:
+            self._waiting.append(waiter)
+            while not (self.active < self.max_concurrent and self._next() is waiter):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(waiter)
+                    self.rejected += 1
+                    self._cond.notify_all()
+                    raise Overloaded("Server busy", self.timeout)
+                self._cond.wait(remaining)
+            self._waiting.remove(waiter)
+            self.active += 1
+            self._waits.append(time.monotonic() - waiter.enqueued)
+            # another slot may still be free for the next waiter in line
+            self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.active -= 1
+                self._cond.notify_all()
+
+    def stats(self) -> Dict:
+        with self._cond:
+            waits = sorted(self._waits)
+            queued = len(self._waiting)
+        pct = lambda q: round(1000 * waits[min(len(waits) - 1, int(q * len(waits)))], 1) if waits else 0.0
+        return {"max_concurrent": self.max_concurrent, "policy": self.policy, "active": self.active,
+                "queued": queued, "rejected": self.rejected,
+                "queue_wait_ms": {"p50": pct(0.5), "p95": pct(0.95), "p99": pct(0.99)}}
@@ -5,22 +5,46 @@ FastAPI server that:
 - keeps per-session short-term memory (last 3-5 exchanges)
 - does crisis detection and returns helpline text
 - generates emotion-conditioned replies (tone control instructions)
+- serves models from the versioned registry and hot-swaps new versions
+  (POST /admin/models/{kind}/activate) without dropping requests
+- runs the models through a pluggable inference backend (INFERENCE_BACKEND=torch | fake,
+  see inference_backend.py)
 Run:
     uvicorn app:app --host 0.0.0.0 --port 8000
 """
 
 import os
-from fastapi import FastAPI, HTTPException
+import json
+import time
+_IMPORT_START = time.perf_counter()  # startup benchmark: time spent importing dependencies
+import atexit
+import asyncio
+import threading
+from collections import Counter, OrderedDict
+from fastapi import FastAPI, HTTPException, Header, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional
-import torch
-from transformers import AutoTokenizer, AutoModelForSequenceClassification, AutoModelForCausalLM
-from crisis_detector import get_detector, CrisisLevel
+from typing import Optional, List, Dict
+from crisis_detector import get_detector, CrisisLevel, SessionCrisisState
+from autotune import load_profile, apply_profile
+import model_registry
+from model_registry import LoadedModel, ModelSlot
+from inference_backend import EMOTION_LABELS, backend_options, create_backend
+from single_flight import SingleFlight, normalize_text
+from admission import RateLimiter, ConcurrencyLimiter, Overloaded
+from session_store import SessionStore
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_START
 
 # Model paths - adjust if you saved to different locations
-EMOTION_MODEL_DIR = "./models/emotion_detector"   # from train_emotion.py
-RESPONSE_MODEL_DIR = "./models/response_model"    # from fine_tune_response.py
+EMOTION_MODEL_DIR = os.getenv("EMOTION_MODEL_DIR", "./models/emotion_detector")   # from train_emotion.py (--distill writes ./models/emotion_detector_small)
+RESPONSE_MODEL_DIR = os.getenv("RESPONSE_MODEL_DIR", "./models/response_model")    # from fine_tune_response.py
+MODEL_REGISTRY_DIR = model_registry.REGISTRY_DIR  # versioned models; see model_registry.py
+MODEL_REGISTRY_WATCH = float(os.getenv("MODEL_REGISTRY_WATCH", "0"))  # seconds between registry checks (0 = off)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")  # /admin endpoints require a matching X-Admin-Token header; off if unset
+# torch (transformers models) | fake (deterministic, no model files); backend settings are read from the
+# environment too: EMOTION_COMPILE, EMOTION_PRECISION, RESPONSE_PRECISION, MODEL_OFFLINE, FAKE_BACKEND_LATENCY_MS
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch")
 
 # Fallback to pre-trained if local fine-tuned not available
 DEFAULT_EMOTION_MODEL = "bert-base-uncased"
@@ -48,6 +72,20 @@ TONE_GUIDELINES = {
     "surprise": "Respond with curiosity and gentle questions."
 }
 
+# Reranking multi-candidate replies: how much each emotion the classifier finds in
+# a candidate reply is worth, given the user's emotion (e.g. calm replies to anger)
+REPLY_TONE_WEIGHTS = {
+    "sadness": {"love": 1.0, "joy": 0.5, "anger": -1.0},
+    "joy": {"joy": 1.0, "love": 0.5, "sadness": -0.5, "anger": -1.0},
+    "anger": {"love": 0.5, "joy": 0.5, "anger": -1.0, "fear": -0.5},
+    "fear": {"love": 1.0, "joy": 0.5, "fear": -0.5, "anger": -1.0},
+    "love": {"love": 1.0, "joy": 0.5, "anger": -1.0},
+    "surprise": {"joy": 0.5, "surprise": 0.5, "anger": -1.0},
+}
+DEFAULT_REPLY_TONE_WEIGHTS = {"anger": -1.0}
+REPETITION_WEIGHT = 1.0
+RESPONSE_CANDIDATES = int(os.getenv("RESPONSE_CANDIDATES", "1"))  # replies sampled per message; best one is returned
+
 app = FastAPI(title="MindMate — Emotion-conditioned Mental Health Chatbot API")
 
 # Add CORS middleware for frontend
@@ -63,6 +101,27 @@ app.add_middleware(
 CONVERSATION_MEMORY = {}
 MAX_MEMORY = 5  # keep last 3-5 exchanges
 
+# Durable memory (see session_store.py): set SESSION_STORE_DIR to keep conversations across restarts.
+# Turns are logged and fsynced in batches; the log is compacted into an mmap'd snapshot periodically.
+SESSION_STORE_DIR = os.getenv("SESSION_STORE_DIR", "")
+SESSION_STORE = None
+if SESSION_STORE_DIR:
+    _restore_start = time.perf_counter()
+    SESSION_STORE = SessionStore(SESSION_STORE_DIR, MAX_MEMORY,
+                                 fsync_interval=float(os.getenv("SESSION_FSYNC_INTERVAL", "0.1")))
+    CONVERSATION_MEMORY.update(SESSION_STORE.restore())
+    SESSION_STORE.start(compact_interval=float(os.getenv("SESSION_COMPACT_INTERVAL", "300")))
+    atexit.register(SESSION_STORE.close)
+    print(f"✅ Session store: {len(SESSION_STORE)} snapshot sessions, {len(CONVERSATION_MEMORY)} replayed from the log "
+          f"in {time.perf_counter() - _restore_start:.2f}s")
+
+# Rolling multi-turn crisis state per session_id (see crisis_detector.SessionCrisisState).
+# LRU map capped at CRISIS_STATE_MAX_SESSIONS, like the rate limiter buckets; the least
+# recently active session's state is dropped first.
+CRISIS_STATE: "OrderedDict[str, SessionCrisisState]" = OrderedDict()
+CRISIS_STATE_MAX_SESSIONS = int(os.getenv("CRISIS_STATE_MAX_SESSIONS", "100000"))
+CRISIS_STATE_LOCK = threading.Lock()
+
 # Initialize enhanced crisis detector
 crisis_detector = get_detector(region="india")
 
@@ -76,141 +135,688 @@ class ChatResponse(BaseModel):
     emotion: str
     response: str
     crisis: bool = False
+    model_versions: Optional[Dict[str, str]] = None
+    status: Optional[int] = None         # /chat/batch: 429 for an item refused by admission control
+    retry_after: Optional[float] = None
+
+class ModelSwapRequest(BaseModel):
+    version: Optional[str] = None  # default: the registry's active version
+
+MAX_BATCH_ITEMS = 64  # upper bound on items accepted by /chat/batch
+
+# Admission control (see admission.py); crisis replies are never limited. A rate of 0 disables a limiter.
+SESSION_LIMITER = RateLimiter(rate=float(os.getenv("SESSION_RATE_LIMIT", "1.0")),   # messages/sec per session
+                              burst=float(os.getenv("SESSION_BURST", "10")),
+                              max_keys=int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000")))
+IP_LIMITER = RateLimiter(rate=float(os.getenv("IP_RATE_LIMIT", "0")),               # messages/sec per client IP
+                         burst=float(os.getenv("IP_BURST", str(MAX_BATCH_ITEMS))),
+                         max_keys=int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000")))
+# Queued model work runs shortest-job-first by estimated tokens, with aging and priority classes
+MODEL_WORK = ConcurrencyLimiter(int(os.getenv("MAX_CONCURRENT_MODEL_CALLS", "4")),  # 0 = no cap
+                                timeout=float(os.getenv("MODEL_QUEUE_TIMEOUT", "10")),
+                                policy=os.getenv("SCHEDULER_POLICY", "sjf"),          # sjf | fifo
+                                aging=float(os.getenv("SCHEDULER_AGING", "100")),     # cost tokens forgiven per second waited
+                                class_weights=json.loads(os.getenv("PRIORITY_CLASS_WEIGHTS", "{}")))
+
+# Thread counts and batch sizes tuned for this host by autotune.py (defaults if not tuned)
+INFERENCE_PROFILE = apply_profile(load_profile()) if INFERENCE_BACKEND == "torch" else None
+EMOTION_BATCH_SIZE = INFERENCE_PROFILE["emotion_batch_size"] if INFERENCE_PROFILE else MAX_BATCH_ITEMS
+GENERATION_BATCH_SIZE = INFERENCE_PROFILE["generation_batch_size"] if INFERENCE_PROFILE else MAX_BATCH_ITEMS
+
+_backend_start = time.perf_counter()
+_backend_options = backend_options(INFERENCE_BACKEND)
+if INFERENCE_BACKEND == "torch":
+    _backend_options["emotion_batch_size"] = EMOTION_BATCH_SIZE  # compiled emotion graphs are warmed up to this
+BACKEND = create_backend(INFERENCE_BACKEND, **_backend_options)
+IMPORT_SECONDS += time.perf_counter() - _backend_start  # the backend's own imports (torch, transformers)
+
+def initial_model_source(kind: str, env_name: str, default_dir: str, default_name: str) -> tuple:
+    """(version, path) to serve at startup: an explicit env dir, else the registry's active version, else the defaults."""
+    return model_registry.resolve_source(kind, os.getenv(env_name), default_dir, default_name, MODEL_REGISTRY_DIR)
+
+def build_emotion_model(version: str, path: str) -> LoadedModel:
+    """Load (and compile, if enabled) and warm up one emotion model version."""
+    return BACKEND.load("emotion", version, path)
+
+def build_response_model(version: str, path: str) -> LoadedModel:
+    """Load and warm up one response model version."""
+    return BACKEND.load("response", version, path)
+
+# Each kind is served through a slot so a new version can be swapped in while requests run
+EMOTION = ModelSlot(build_emotion_model(*initial_model_source(
+    "emotion", "EMOTION_MODEL_DIR", EMOTION_MODEL_DIR, DEFAULT_EMOTION_MODEL)))
+RESPONSE = ModelSlot(build_response_model(*initial_model_source(
+    "response", "RESPONSE_MODEL_DIR", RESPONSE_MODEL_DIR, DEFAULT_RESPONSE_MODEL)))
+MODEL_SLOTS = {"emotion": (EMOTION, build_emotion_model), "response": (RESPONSE, build_response_model)}
+
+def publish_model_aliases():
+    """Point the module-level names used by tools (autotune, evaluate) at the serving versions."""
+    global EMO_TOKENIZER, EMO_MODEL, EMO_COMPILED, RESP_TOKENIZER, RESP_MODEL
+    emotion, response = EMOTION.current, RESPONSE.current
+    EMO_TOKENIZER, EMO_MODEL, EMO_COMPILED = emotion.tokenizer, emotion.model, emotion.compiled
+    RESP_TOKENIZER, RESP_MODEL = response.tokenizer, response.model
+
+publish_model_aliases()
+
+# Startup benchmark (python prepare_artifacts.py --bench-startup compares generic vs prepared loading)
+STARTUP_TIMINGS = {
+    "import": IMPORT_SECONDS,
+    "load": EMOTION.current.timings["load"] + RESPONSE.current.timings["load"],
+    "warmup": EMOTION.current.timings["warmup"] + RESPONSE.current.timings["warmup"],
+}
+print(f"Startup: import {STARTUP_TIMINGS['import']:.2f}s, load {STARTUP_TIMINGS['load']:.2f}s, "
+      f"warm-up {STARTUP_TIMINGS['warmup']:.2f}s")
+
+def active_model_versions() -> dict:
+    return {kind: slot.current.version for kind, (slot, _) in MODEL_SLOTS.items()}
+
+# Swap state per kind, shown by /admin/models and /metrics
+SWAP_STATUS = {kind: {"state": "idle", "version": slot.current.version, "swaps": 0, "error": None}
+               for kind, (slot, _) in MODEL_SLOTS.items()}
+_swap_lock = threading.Lock()
+# kind -> ((version, path), registry stamp) of the last version that failed to load; the watcher
+# doesn't retry it until the registry index changes
+FAILED_SWAPS = {}
+
+def registry_stamp() -> Optional[int]:
+    try:
+        return os.stat(model_registry.index_path(MODEL_REGISTRY_DIR)).st_mtime_ns
+    except OSError:
+        return None
+
+def swap_model(kind: str, version: str, path: str):
+    """Load and warm up a new version off the request path, swap it in, then drain and release the old one."""
+    slot, build = MODEL_SLOTS[kind]
+    status = SWAP_STATUS[kind]
+    try:
+        loaded = build(version, path)
+    except Exception as e:
+        status.update(state="failed", error=f"{type(e).__name__}: {e}")
+        FAILED_SWAPS[kind] = ((version, path), registry_stamp())
+        print(f"❌ Could not load {kind} model {version}: {e}")
+        return
+    FAILED_SWAPS.pop(kind, None)
+    old = slot.swap(loaded)
+    publish_model_aliases()
+    status.update(state="draining", version=version, swaps=status["swaps"] + 1, error=None)
+    print(f"✅ Serving {kind} model {version}; draining {old.version}")
+    slot.drain(old)
+    old.release()
+    status["state"] = "idle"
+
+def start_swap(kind: str, version: str, path: str) -> bool:
+    """Run swap_model in the background; False if a swap for this kind is already running."""
+    with _swap_lock:
+        if SWAP_STATUS[kind]["state"] in ("loading", "draining"):
+            return False
+        SWAP_STATUS[kind].update(state="loading", error=None)
+    threading.Thread(target=swap_model, args=(kind, version, path), name=f"swap-{kind}", daemon=True).start()
+    return True
+
+def check_registry() -> List[str]:
+    """
+    Start a swap for every kind whose registry-active version isn't serving; returns those kinds.
+    A version that failed to load is not retried until the registry changes.
+    """
+    started = []
+    for kind in MODEL_SLOTS:
+        try:
+            stamp = registry_stamp()
+            registered = model_registry.active(kind, MODEL_REGISTRY_DIR)
+        except (OSError, ValueError, KeyError):
+            continue
+        if not registered or registered[0] == SWAP_STATUS[kind]["version"]:
+            continue
+        if FAILED_SWAPS.get(kind) == (registered, stamp):
+            continue
+        if start_swap(kind, *registered):
+            started.append(kind)
+    return started
+
+def watch_registry(interval: float):
+    """Swap in whatever version the registry marks active, whenever that changes."""
+    while True:
+        time.sleep(interval)
+        check_registry()
 
-# Load models (try local fine-tuned; otherwise fallback)
-def load_emotion_model():
-    if os.path.isdir(EMOTION_MODEL_DIR):
-        model_name = EMOTION_MODEL_DIR
-    else:
-        model_name = DEFAULT_EMOTION_MODEL
-    print("Loading emotion model:", model_name)
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-    model = AutoModelForSequenceClassification.from_pretrained(model_name)
-    # if returned model outputs have different label order than expected, you'll need label mapping
-    return tokenizer, model
-
-def load_response_model():
-    if os.path.isdir(RESPONSE_MODEL_DIR):
-        model_name = RESPONSE_MODEL_DIR
-    else:
-        model_name = DEFAULT_RESPONSE_MODEL
-    print("Loading response model:", model_name)
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-    model = AutoModelForCausalLM.from_pretrained(model_name)
-    # make sure tokenizer.pad_token is set
-    if tokenizer.pad_token is None:
-        tokenizer.add_special_tokens({"pad_token": "[PAD]"})
-        model.resize_token_embeddings(len(tokenizer))
-    return tokenizer, model
-
-EMO_TOKENIZER, EMO_MODEL = load_emotion_model()
-RESP_TOKENIZER, RESP_MODEL = load_response_model()
-
-# If emotion model labels are unknown, use common order for dair-ai/emotion
-EMOTION_LABELS = ["anger", "fear", "joy", "love", "sadness", "surprise"]
-
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-EMO_MODEL.to(device)
-RESP_MODEL.to(device)
-
-def detect_crisis(text: str) -> tuple:
-    """Use enhanced crisis detector. Returns (is_crisis, level, message)"""
+if MODEL_REGISTRY_WATCH > 0:
+    threading.Thread(target=watch_registry, args=(MODEL_REGISTRY_WATCH,), name="registry-watcher", daemon=True).start()
+
+def assess_crisis(text: str, session_id: str, state: Optional[SessionCrisisState] = None) -> tuple:
+    """Session-aware crisis check that changes nothing. Returns (is_crisis, level, message, new_state)
+
+    new_state is the session's crisis state after this message (starting from
+    state, or the stored one); keep it with save_crisis_state once the message
+    is accepted, so a refused message that is retried isn't counted twice.
+    """
+    if state is None:
+        with CRISIS_STATE_LOCK:
+            state = CRISIS_STATE.get(session_id)
+    state = state.copy() if state is not None else SessionCrisisState()
+    is_crisis, level, explanation = crisis_detector.detect_in_session(text, state)
+    if is_crisis:
+        return True, level, crisis_detector.get_crisis_message(level), state
+    return False, None, None, state
+
+def save_crisis_state(session_id: str, state: SessionCrisisState):
+    with CRISIS_STATE_LOCK:
+        CRISIS_STATE[session_id] = state
+        CRISIS_STATE.move_to_end(session_id)
+        while len(CRISIS_STATE) > CRISIS_STATE_MAX_SESSIONS:
+            CRISIS_STATE.popitem(last=False)  # least recently active session
+
+def detect_crisis(text: str, session_id: Optional[str] = None) -> tuple:
+    """Use enhanced crisis detector. Returns (is_crisis, level, message)
+
+    With a session_id, the session's rolling crisis state is updated and may
+    escalate the level based on earlier turns.
+    """
+    if session_id is not None:
+        is_crisis, level, message, state = assess_crisis(text, session_id)
+        save_crisis_state(session_id, state)
+        return is_crisis, level, message
     is_crisis, level, explanation = crisis_detector.detect(text)
     if is_crisis:
         message = crisis_detector.get_crisis_message(level)
         return True, level, message
     return False, None, None
 
+def emotion_probabilities(texts: List[str]) -> List[List[float]]:
+    """Emotion class probabilities, in padded forward passes of up to EMOTION_BATCH_SIZE."""
+    if len(texts) > EMOTION_BATCH_SIZE:
+        return [p for start in range(0, len(texts), EMOTION_BATCH_SIZE)
+                for p in emotion_probabilities(texts[start:start + EMOTION_BATCH_SIZE])]
+    with EMOTION.use() as m:
+        return BACKEND.emotion_probabilities(m, texts)
+
+def detect_emotions(texts: List[str]) -> List[str]:
+    """Classify several messages in batched forward passes."""
+    probs = emotion_probabilities(texts)
+    labels = []
+    for p in probs:
+        label_id = max(range(len(p)), key=p.__getitem__)
+        if label_id < len(EMOTION_LABELS):
+            labels.append(EMOTION_LABELS[label_id])
+        else:
+            labels.append("neutral")
+    return labels
+
+# identical messages classified concurrently share one model call
+EMOTION_FLIGHTS = SingleFlight()
+
 def detect_emotion(text: str) -> str:
-    inputs = EMO_TOKENIZER(text, return_tensors="pt", truncation=True, padding=True).to(device)
-    with torch.no_grad():
-        logits = EMO_MODEL(**inputs).logits
-    probs = torch.nn.functional.softmax(logits, dim=-1)
-    label_id = int(torch.argmax(probs, dim=-1)[0])
-    if label_id < len(EMOTION_LABELS):
-        return EMOTION_LABELS[label_id]
-    else:
-        return "neutral"
+    return EMOTION_FLIGHTS.do(normalize_text(text), lambda: detect_emotions([text])[0])
+
+def session_turns(session_id: str) -> list:
+    """A session's remembered turns; sessions in the snapshot are loaded on first use."""
+    turns = CONVERSATION_MEMORY.get(session_id)
+    if turns is None and SESSION_STORE is not None:
+        turns = SESSION_STORE.load(session_id)
+        if turns is not None:
+            turns = CONVERSATION_MEMORY.setdefault(session_id, turns)
+    return turns or []
 
 def get_context(session_id: str) -> str:
-    items = CONVERSATION_MEMORY.get(session_id, [])
+    items = session_turns(session_id)
     lines = []
     for e in items[-MAX_MEMORY:]:
         lines.append(f"User: {e['user']}\nBot: {e['bot']}")
     return "\n".join(lines)
 
 def add_memory(session_id: str, user_text: str, bot_text: str):
+    session_turns(session_id)  # bring in the session's snapshot turns before appending
     lst = CONVERSATION_MEMORY.setdefault(session_id, [])
     lst.append({"user": user_text, "bot": bot_text})
     # trim
     if len(lst) > MAX_MEMORY:
         CONVERSATION_MEMORY[session_id] = lst[-MAX_MEMORY:]
+    if SESSION_STORE is not None:
+        SESSION_STORE.append(session_id, user_text, bot_text)
 
-def generate_response_with_tone(user_text: str, emotion: str, context: str) -> str:
-    # Build prompt for the response model
+FALLBACK_REPLY = "Thank you for telling me. I'm here to listen — would you like to tell me more?"
+ERROR_REPLY = "I'm sorry, I couldn't think of a good response right now. Tell me more about how you're feeling."
+
+def build_prompt(user_text: str, emotion: str, context: str) -> str:
     tone_instruction = TONE_GUIDELINES.get(emotion, "Respond empathetically.")
-    prompt = f"{tone_instruction}\nEmotion: {emotion}\nContext: {context}\nUser: {user_text}\nBot:"
-    input_ids = RESP_TOKENIZER.encode(prompt + RESP_TOKENIZER.eos_token, return_tensors="pt").to(device)
-    # generation params with repetition prevention
-    with torch.no_grad():
-        out = RESP_MODEL.generate(
-            input_ids,
-            max_length=input_ids.shape[-1] + 80,  # Reduced from 120 to prevent long repetitive outputs
-            do_sample=True,
-            top_p=0.92,
-            top_k=50,
-            temperature=0.85,
-            pad_token_id=RESP_TOKENIZER.pad_token_id,
-            eos_token_id=RESP_TOKENIZER.eos_token_id,
-            num_return_sequences=1,
-            no_repeat_ngram_size=3,  # Prevents repeating 3-word sequences
-            repetition_penalty=1.2,  # Penalizes repetition
-        )
-    # decode only the newly generated tokens
-    generated = out[0][input_ids.shape[-1]:]
-    reply = RESP_TOKENIZER.decode(generated, skip_special_tokens=True).strip()
+    return f"{tone_instruction}\nEmotion: {emotion}\nContext: {context}\nUser: {user_text}\nBot:"
+
+# sampling setup shared by the single and batched generation paths
+GENERATION_KWARGS = dict(
+    do_sample=True,
+    top_p=0.92,
+    top_k=50,
+    temperature=0.85,
+    no_repeat_ngram_size=3,  # Prevents repeating 3-word sequences
+    repetition_penalty=1.2,  # Penalizes repetition
+)
+MAX_NEW_TOKENS = 80  # Reduced from 120 to prevent long repetitive outputs
+
+def repetition_score(text: str) -> float:
+    """Fraction of repeated word trigrams (0 = no repetition)."""
+    words = text.lower().split()
+    trigrams = list(zip(words, words[1:], words[2:]))
+    if not trigrams:
+        return 0.0
+    return 1.0 - len(set(trigrams)) / len(trigrams)
+
+def pick_best_replies(candidates: List[List[str]], emotions: List[str]) -> List[str]:
+    """
+    Choose one reply per message from its sampled candidates.
+
+    All candidates are classified in one batched emotion pass; each is scored by
+    how well its emotion fits REPLY_TONE_WEIGHTS for the user's emotion, minus a
+    repetition penalty. Empty candidates are only chosen if all are empty.
+    """
+    flat = [c for group in candidates for c in group]
+    probs = emotion_probabilities([c or "." for c in flat])
+    best, pos = [], 0
+    for group, emotion in zip(candidates, emotions):
+        weights = REPLY_TONE_WEIGHTS.get(emotion, DEFAULT_REPLY_TONE_WEIGHTS)
+        scored = []
+        for reply in group:
+            p = probs[pos]
+            pos += 1
+            if not reply:
+                scored.append((float("-inf"), reply))
+                continue
+            tone = sum(weights.get(label, 0.0) * p[i] for i, label in enumerate(EMOTION_LABELS[:len(p)]))
+            scored.append((tone - REPETITION_WEIGHT * repetition_score(reply), reply))
+        best.append(max(scored, key=lambda x: x[0])[1] or FALLBACK_REPLY)
+    return best
+
+def generate_response_with_tone(user_text: str, emotion: str, context: str,
+                                candidates: Optional[int] = None) -> str:
+    candidates = candidates or RESPONSE_CANDIDATES
+    # Build prompt for the response model
+    prompt = build_prompt(user_text, emotion, context)
+    with RESPONSE.use() as m:
+        # generation params with repetition prevention
+        replies = BACKEND.generate(m, [prompt], candidates, MAX_NEW_TOKENS, **GENERATION_KWARGS)
+    reply = replies[0] if candidates == 1 else pick_best_replies([replies], [emotion])[0]
     # fallback in case model outputs nothing
     if not reply:
-        reply = "Thank you for telling me. I'm here to listen — would you like to tell me more?"
+        reply = FALLBACK_REPLY
     return reply
 
-@app.post("/chat", response_model=ChatResponse)
-def chat(req: ChatRequest):
-    session_id = req.session_id
-    user_text = req.message.strip()
-    if not user_text:
-        raise HTTPException(status_code=400, detail="Empty message")
+def generate_responses_with_tone(items: List[tuple], candidates: Optional[int] = None) -> List[str]:
+    """Batched generate_response_with_tone: items are (user_text, emotion, context) tuples."""
+    candidates = candidates or RESPONSE_CANDIDATES
+    if len(items) > GENERATION_BATCH_SIZE:
+        return [reply for start in range(0, len(items), GENERATION_BATCH_SIZE)
+                for reply in generate_responses_with_tone(items[start:start + GENERATION_BATCH_SIZE], candidates)]
+    with RESPONSE.use() as m:
+        # rows come back grouped per prompt: candidates for item 0, then item 1, ...
+        decoded = BACKEND.generate(m, [build_prompt(*item) for item in items], candidates, MAX_NEW_TOKENS,
+                                   **GENERATION_KWARGS)
+    if candidates == 1:
+        return [reply or FALLBACK_REPLY for reply in decoded]
+    groups = [decoded[i:i + candidates] for i in range(0, len(decoded), candidates)]
+    return pick_best_replies(groups, [emotion for _, emotion, _ in items])
+
+def generation_cost(user_text: str, context: str) -> int:
+    """Scheduling estimate for one reply: prompt tokens plus the new-token budget of every candidate."""
+    # hold the model in use: a concurrent swap must not release its tokenizer mid-count
+    with RESPONSE.use() as m:
+        prompt_tokens = BACKEND.count_tokens(m, build_prompt(user_text, "neutral", context))
+    return prompt_tokens + MAX_NEW_TOKENS * RESPONSE_CANDIDATES
+
+def priority_class(session_id: str) -> str:
+    return "returning" if session_turns(session_id) else "first_turn"
+
+def client_ip(request: Request) -> Optional[str]:
+    return request.client.host if request.client else None
 
-    # Crisis check with enhanced detector
-    is_crisis, crisis_level, crisis_msg = detect_crisis(user_text)
+def too_busy(e: Overloaded) -> HTTPException:
+    return HTTPException(status_code=429, detail=e.reason, headers={"Retry-After": e.retry_after_header})
+
+def chat_reply(session_id: str, user_text: str, ip: Optional[str]) -> ChatResponse:
+    """One chat turn, shared by POST /chat and /ws/chat; raises Overloaded if admission control refuses it."""
+    # Crisis check with enhanced detector (session-aware)
+    is_crisis, crisis_level, crisis_msg, crisis_state = assess_crisis(user_text, session_id)
+    if not is_crisis:
+        # Admission control: only model work is limited, never a crisis reply
+        SESSION_LIMITER.check(session_id, what="messages for this session")
+        IP_LIMITER.check(ip, what="requests from this address")
+    save_crisis_state(session_id, crisis_state)  # only now: a refused message leaves no trace
     if is_crisis:
         # Still save to memory for context
         add_memory(session_id, user_text, crisis_msg)
-        return ChatResponse(session_id=session_id, emotion="crisis", response=crisis_msg, crisis=True)
-
-    # Emotion detection
-    try:
-        emotion = detect_emotion(user_text)
-    except Exception as e:
-        # fallback if model errors
-        emotion = "neutral"
+        return ChatResponse(session_id=session_id, emotion="crisis", response=crisis_msg, crisis=True,
+                            model_versions=active_model_versions())
 
     # Get context from memory
     context = get_context(session_id)
+    with MODEL_WORK.slot(generation_cost(user_text, context), priority_class(session_id)):
+        # Emotion detection
+        try:
+            emotion = detect_emotion(user_text)
+        except Exception as e:
+            # fallback if model errors
+            emotion = "neutral"
 
-    # Generate response conditioned on emotion + tone
-    try:
-        reply = generate_response_with_tone(user_text, emotion, context)
-    except Exception as e:
-        # fallback simpler behavior
-        reply = "I'm sorry, I couldn't think of a good response right now. Tell me more about how you're feeling."
+        # Generate response conditioned on emotion + tone
+        try:
+            reply = generate_response_with_tone(user_text, emotion, context)
+        except Exception as e:
+            # fallback simpler behavior
+            reply = ERROR_REPLY
     
     # Save to memory
     add_memory(session_id, user_text, reply)
 
-    return ChatResponse(session_id=session_id, emotion=emotion, response=reply, crisis=False)
+    return ChatResponse(session_id=session_id, emotion=emotion, response=reply, crisis=False,
+                        model_versions=active_model_versions())
+
+
+@app.post("/chat", response_model=ChatResponse)
+def chat(req: ChatRequest, request: Request):
+    user_text = req.message.strip()
+    if not user_text:
+        raise HTTPException(status_code=400, detail="Empty message")
+    try:
+        return chat_reply(req.session_id, user_text, client_ip(request))
+    except Overloaded as e:
+        raise too_busy(e)
+
+
+# /ws/chat: one connection per session carrying messages and replies
+WS_MAX_PENDING = int(os.getenv("WS_MAX_PENDING", "8"))                    # queued messages per connection
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "20"))   # seconds between server pings
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "60"))               # close after this long without a frame
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))               # close if a client stops reading
+WS_MAX_MESSAGE_CHARS = int(os.getenv("WS_MAX_MESSAGE_CHARS", "4000"))     # longer messages get a 413 error frame
+WS_CONNECTIONS = {"open": 0, "total": 0}
+
+def ws_error(message_id, status: int, detail: str, retry_after: Optional[float] = None) -> dict:
+    return {"type": "error", "id": message_id, "status": status, "detail": detail, "retry_after": retry_after}
+
+@app.websocket("/ws/chat")
+async def ws_chat(websocket: WebSocket, session_id: str):
+    """
+    Chat over one WebSocket bound to session_id. Frames are JSON objects:
+
+        client: {"type": "message", "id": 1, "message": "..."}, {"type": "ping"}, {"type": "pong"}
+        server: {"type": "reply", "id": 1, ...ChatResponse fields}, {"type": "error", "id": 1, "status": 429, ...},
+                {"type": "ping"}, {"type": "pong"}
+
+    Messages are answered in order, at most WS_MAX_PENDING queued at a time; beyond
+    that they are refused with a 429 error frame (crisis messages are answered
+    straight away instead, outside the queue). A message that fails gets a 500
+    error frame and the connection stays open. The server pings every WS_HEARTBEAT_INTERVAL seconds and
+    closes connections that send nothing for WS_IDLE_TIMEOUT seconds or stop reading.
+    """
+    await websocket.accept()
+    ip = websocket.client.host if websocket.client else None
+    pending = asyncio.Queue(maxsize=WS_MAX_PENDING)
+    send_lock = asyncio.Lock()
+    last_seen = time.monotonic()
+    urgent = set()  # crisis replies answered outside the full queue
+
+    async def send(frame: dict):
+        async with send_lock:
+            await asyncio.wait_for(websocket.send_json(frame), WS_SEND_TIMEOUT)
+
+    async def answer(message_id, text: str):
+        try:
+            response = await run_in_threadpool(chat_reply, session_id, text, ip)
+            await send({"type": "reply", "id": message_id, **response.model_dump()})
+        except Overloaded as e:
+            await send(ws_error(message_id, 429, e.reason, e.retry_after))
+        except Exception as e:
+            print(f"⚠️  /ws/chat message {message_id!r} failed: {e!r}")
+            await send(ws_error(message_id, 500, "Could not answer this message"))
+
+    def answer_now(message_id, text: str):
+        task = asyncio.create_task(answer(message_id, text))
+        urgent.add(task)
+        # a send that fails here means the connection is going away; receive() will notice
+        task.add_done_callback(lambda t: urgent.discard(t) or t.cancelled() or t.exception())
+
+    async def receive():
+        nonlocal last_seen
+        while True:
+            raw = await websocket.receive_text()
+            last_seen = time.monotonic()
+            try:
+                frame = json.loads(raw)
+            except ValueError:
+                frame = None
+            if not isinstance(frame, dict):
+                await send(ws_error(None, 400, "Frames must be JSON objects"))
+                continue
+            kind, message_id = frame.get("type"), frame.get("id")
+            if kind == "ping":
+                await send({"type": "pong"})
+            elif kind == "message":
+                text = str(frame.get("message", "")).strip()
+                if not text:
+                    await send(ws_error(message_id, 400, "Empty message"))
+                    continue
+                if len(text) > WS_MAX_MESSAGE_CHARS:
+                    await send(ws_error(message_id, 413, f"Messages are limited to {WS_MAX_MESSAGE_CHARS} characters"))
+                    continue
+                try:
+                    pending.put_nowait((message_id, text))
+                except asyncio.QueueFull:
+                    # detection runs off the event loop: a slow regex must not stall other connections
+                    if (await run_in_threadpool(assess_crisis, text, session_id))[0]:
+                        answer_now(message_id, text)  # a crisis reply is never refused
+                    else:
+                        await send(ws_error(message_id, 429, "Too many pending messages", 1.0))
+            elif kind != "pong":
+                await send(ws_error(message_id, 400, f"Unknown frame type: {kind}"))
+
+    async def work():
+        while True:
+            message_id, text = await pending.get()
+            await answer(message_id, text)
+
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(WS_HEARTBEAT_INTERVAL)
+            if time.monotonic() - last_seen > WS_IDLE_TIMEOUT:
+                await websocket.close(code=1001, reason="Idle timeout")
+                return
+            await send({"type": "ping"})
+
+    WS_CONNECTIONS["open"] += 1
+    WS_CONNECTIONS["total"] += 1
+    tasks = [asyncio.create_task(coro()) for coro in (receive, work, heartbeat)]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            error = task.exception()
+            if isinstance(error, asyncio.TimeoutError):
+                try:
+                    await websocket.close(code=1008, reason="Client is not reading")
+                except RuntimeError:
+                    pass  # already closed underneath us
+            elif error is not None and not isinstance(error, WebSocketDisconnect):
+                raise error
+    finally:
+        for task in tasks + list(urgent):
+            task.cancel()
+        WS_CONNECTIONS["open"] -= 1
+
+
+@app.post("/chat/batch", response_model=List[ChatResponse])
+def chat_batch(reqs: List[ChatRequest], request: Request):
+    """
+    Handle messages for many sessions in one call.
+
+    Every item is crisis-screened; the rest share one batched emotion pass and one
+    batched generation pass. Items are processed in waves holding at most one
+    message per session, so a session's later messages see its earlier replies
+    as context, exactly as if they had been sent to /chat one by one.
+
+    Rate limits charge one token per non-crisis item, and those items run in a
+    model slot. Crisis items (judged with session history, as the reply is) are
+    never limited: if admission control refuses the rest of a batch that holds a
+    crisis item, the crisis items are still answered and every other item comes
+    back with status 429 and retry_after. A batch without crisis items is refused
+    as a whole with a 429.
+    """
+    if len(reqs) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_ITEMS} items per batch")
+    texts = [req.message.strip() for req in reqs]
+    for i, text in enumerate(texts):
+        if not text:
+            raise HTTPException(status_code=400, detail=f"Empty message at index {i}")
+
+    # wave k holds the k-th message of every session in the batch
+    waves = []
+    seen = {}
+    for i, req in enumerate(reqs):
+        k = seen.get(req.session_id, 0)
+        seen[req.session_id] = k + 1
+        if k == len(waves):
+            waves.append([])
+        waves[k].append(i)
+
+    screened = screen_batch(reqs, texts, range(len(reqs)))
+    work = [i for i in range(len(reqs)) if not screened[i][0]]
+    if not work:
+        return process_batch(reqs, texts, waves, screened)
+    try:
+        IP_LIMITER.check(client_ip(request), cost=len(work), what="requests from this address")
+        for session_id, count in Counter(reqs[i].session_id for i in work).items():
+            SESSION_LIMITER.check(session_id, cost=count, what="messages for this session")
+        cost = sum(generation_cost(texts[i], get_context(reqs[i].session_id)) for i in work)
+        with MODEL_WORK.slot(cost, "batch"):
+            return process_batch(reqs, texts, waves, screened)
+    except Overloaded as e:
+        if len(work) == len(reqs):
+            raise too_busy(e)
+        refused = e
+    # answer only the crisis items; screen them again so the refused items leave no trace in crisis state
+    crisis_items = [i for i in range(len(reqs)) if screened[i][0]]
+    return process_batch(reqs, texts, waves, screen_batch(reqs, texts, crisis_items), refused)
+
+
+def screen_batch(reqs: List[ChatRequest], texts: List[str], indices) -> Dict[int, tuple]:
+    """Session-aware crisis screening of some items, in request order, chaining each session's state."""
+    screened, states = {}, {}
+    for i in indices:
+        session_id = reqs[i].session_id
+        screened[i] = assess_crisis(texts[i], session_id, states.get(session_id))
+        states[session_id] = screened[i][3]
+    return screened
+
+
+def process_batch(reqs: List[ChatRequest], texts: List[str], waves: List[List[int]],
+                  screened: Dict[int, tuple], refused: Optional[Overloaded] = None) -> List[ChatResponse]:
+    """Answer a screened batch; with refused, items missing from screened get a 429 result instead."""
+    responses = [None] * len(reqs)
+    versions = active_model_versions()
+    for wave in waves:
+        pending = []
+        for i in wave:
+            if i not in screened:
+                responses[i] = ChatResponse(session_id=reqs[i].session_id, emotion="neutral",
+                                            response=refused.reason, status=429,
+                                            retry_after=refused.retry_after, model_versions=versions)
+                continue
+            is_crisis, crisis_level, crisis_msg, crisis_state = screened[i]
+            save_crisis_state(reqs[i].session_id, crisis_state)
+            if is_crisis:
+                responses[i] = ChatResponse(session_id=reqs[i].session_id, emotion="crisis",
+                                            response=crisis_msg, crisis=True, model_versions=versions)
+            else:
+                pending.append(i)
+
+        if pending:
+            try:
+                emotions = detect_emotions([texts[i] for i in pending])
+            except Exception as e:
+                emotions = ["neutral"] * len(pending)
+
+            try:
+                replies = generate_responses_with_tone([
+                    (texts[i], emotion, get_context(reqs[i].session_id))
+                    for i, emotion in zip(pending, emotions)
+                ])
+            except Exception as e:
+                replies = [ERROR_REPLY] * len(pending)
+
+            for i, emotion, reply in zip(pending, emotions, replies):
+                responses[i] = ChatResponse(session_id=reqs[i].session_id, emotion=emotion,
+                                            response=reply, crisis=False, model_versions=versions)
+
+        # Save to memory in request order (refused items were never answered)
+        for i in wave:
+            if i in screened:
+                add_memory(reqs[i].session_id, texts[i], responses[i].response)
+
+    return responses
 
 
 @app.get("/health")
 def health():
     return {"status": "ok"}
+
+
+@app.get("/metrics")
+def metrics():
+    """Serving model versions, swap counters, startup times and emotion request coalescing."""
+    return {
+        "backend": BACKEND.name,
+        "startup_seconds": STARTUP_TIMINGS,
+        "websocket": {**WS_CONNECTIONS, "max_pending": WS_MAX_PENDING},
+        "sessions": {"in_memory": len(CONVERSATION_MEMORY),
+                     "snapshot": len(SESSION_STORE) if SESSION_STORE is not None else None},
+        "emotion_coalescing": EMOTION_FLIGHTS.stats(),
+        "admission": {"session": SESSION_LIMITER.stats(), "ip": IP_LIMITER.stats(), "model_work": MODEL_WORK.stats()},
+        "models": {
+            kind: {"version": slot.current.version, "in_flight": slot.current.in_flight,
+                   "precision": slot.current.precision,
+                   "memory_mb": round(BACKEND.memory_mb(slot.current), 1),
+                   "swaps": SWAP_STATUS[kind]["swaps"], "swap_state": SWAP_STATUS[kind]["state"]}
+            for kind, (slot, _) in MODEL_SLOTS.items()
+        },
+    }
+
+
+def check_admin(token: Optional[str]):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled; set ADMIN_TOKEN to enable them")
+    if token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+@app.get("/admin/models")
+def list_models(x_admin_token: Optional[str] = Header(None)):
+    """Registered versions, the serving version and swap state of each model kind."""
+    check_admin(x_admin_token)
+    index = model_registry.load_index(MODEL_REGISTRY_DIR)
+    return {
+        kind: {
+            "serving": slot.current.version,
+            "in_flight": slot.current.in_flight,
+            "registry_active": index.get(kind, {}).get("active"),
+            "versions": sorted(index.get(kind, {}).get("versions", {})),
+            **{k: v for k, v in SWAP_STATUS[kind].items() if k != "version"},
+        }
+        for kind, (slot, _) in MODEL_SLOTS.items()
+    }
+
+
+@app.post("/admin/models/{kind}/activate", status_code=202)
+def activate_model(kind: str, req: ModelSwapRequest, x_admin_token: Optional[str] = Header(None)):
+    """
+    Load a registered version in the background and swap it in once warmed up.
+    Requests keep being served by the current version throughout.
+    """
+    check_admin(x_admin_token)
+    if kind not in MODEL_SLOTS:
+        raise HTTPException(status_code=404, detail=f"Unknown model kind: {kind}")
+    try:
+        if req.version is not None:
+            model_registry.activate(kind, req.version, MODEL_REGISTRY_DIR)
+        registered = model_registry.active(kind, MODEL_REGISTRY_DIR)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if registered is None:
+        raise HTTPException(status_code=404, detail=f"No registered {kind} models in {MODEL_REGISTRY_DIR}")
+    if not start_swap(kind, *registered):
+        raise HTTPException(status_code=409, detail=f"A {kind} model swap is already in progress")
+    return {"kind": kind, "version": registered[0], "status": "loading"}
@@ -0,0 +1,212 @@
+# autotune.py
+"""
+CPU inference autotuner for the API models.
+
+Benchmarks EMO_MODEL and RESP_MODEL on this host over a grid of
+torch.set_num_threads / set_num_interop_threads values and batch sizes, then
+writes the fastest configuration to a profile file. app.py applies the profile
+on startup (threads before the models load, batch sizes for the batched
+emotion and generation passes).
+
+- interop threads can only be set once per process, so each interop value is
+  measured in its own spawned process (intra-op threads are changed in place)
+- emotion and generation batch sizes are picked for the best items/sec, optionally
+  under a per-batch latency cap so /chat latency doesn't suffer
+- the thread setting is the one with the lowest cost per message (classify + reply)
+
+Run:
+    python autotune.py
+    python autotune.py --threads 1 2 4 8 --max-batch-latency-ms 500
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import multiprocessing as mp
+
+PROFILE_PATH = os.getenv("INFERENCE_PROFILE_PATH", "./models/inference_profile.json")
+
+BENCH_MESSAGES = [
+    "I've been feeling anxious about work lately.",
+    "I can't sleep and I keep overthinking everything.",
+    "My friend stopped talking to me and I don't know why.",
+    "I finally finished my thesis today!",
+]
+
+
+def load_profile(path=PROFILE_PATH):
+    """Return the saved profile, or None if there is none (or it was made on a different host)."""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        profile = json.load(f)
+    if profile.get("cpu_count") != os.cpu_count():
+        print(f"⚠️  Ignoring {path}: tuned for {profile.get('cpu_count')} CPUs, this host has {os.cpu_count()}")
+        return None
+    return profile
+
+
+def apply_profile(profile):
+    """Apply the thread settings of a profile. Call before any model work."""
+    import torch
+    if not profile:
+        return None
+    torch.set_num_threads(profile["num_threads"])
+    try:
+        torch.set_num_interop_threads(profile["num_interop_threads"])
+    except RuntimeError:
+        # already fixed for this process (parallel work has started)
+        pass
+    print(f"Inference profile: {profile['num_threads']} threads, {profile['num_interop_threads']} interop, "
+          f"emotion batch {profile['emotion_batch_size']}, generation batch {profile['generation_batch_size']}")
+    return profile
+
+
+def time_call(fn, repeats):
+    """Median wall time of fn() in seconds, after one warm-up call."""
+    fn()
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+
+def benchmark_interop(interop, thread_grid, emotion_batches, generation_batches, gen_tokens, repeats):
+    """Runs in a fresh process: measure every (threads, batch size) pair for one interop setting."""
+    os.environ["INFERENCE_PROFILE_PATH"] = ""  # measure from defaults, not a previous profile
+    os.environ["INFERENCE_BACKEND"] = "torch"  # tune the real models, whatever the shell has set
+    import torch
+    torch.set_num_interop_threads(interop)
+    import app
+    from torch_backend import left_pad
+
+    results = []
+    for threads in thread_grid:
+        torch.set_num_threads(threads)
+        for batch in emotion_batches:
+            texts = (BENCH_MESSAGES * batch)[:batch]
+            seconds = time_call(lambda: app.detect_emotions(texts), repeats)
+            results.append({"model": "emotion", "threads": threads, "interop": interop, "batch_size": batch,
+                            "latency_ms": 1000 * seconds, "items_per_sec": batch / seconds})
+        for batch in generation_batches:
+            prompts = [app.build_prompt(m, "neutral", "") + app.RESP_TOKENIZER.eos_token
+                       for m in (BENCH_MESSAGES * batch)[:batch]]
+            input_ids, attention_mask = left_pad([app.RESP_TOKENIZER.encode(p) for p in prompts],
+                                                 app.RESP_TOKENIZER.pad_token_id)
+            input_ids, attention_mask = input_ids.to(app.BACKEND.device), attention_mask.to(app.BACKEND.device)
+
+            def generate():
+                # fixed length and greedy, so every setting decodes the same number of tokens
+                with torch.no_grad():
+                    app.RESP_MODEL.generate(input_ids, attention_mask=attention_mask,
+                                            max_new_tokens=gen_tokens, min_new_tokens=gen_tokens,
+                                            do_sample=False, pad_token_id=app.RESP_TOKENIZER.pad_token_id)
+
+            seconds = time_call(generate, repeats)
+            results.append({"model": "generation", "threads": threads, "interop": interop, "batch_size": batch,
+                            "latency_ms": 1000 * seconds, "items_per_sec": batch / seconds})
+        print(f"  - interop {interop}, threads {threads}: done")
+    return results
+
+
+def best_batch(rows, max_latency_ms=None):
+    """Highest-throughput row, among those under the latency cap if any are."""
+    allowed = [r for r in rows if max_latency_ms is None or r["latency_ms"] <= max_latency_ms] or rows
+    return max(allowed, key=lambda r: r["items_per_sec"])
+
+
+def choose_profile(results, max_latency_ms=None):
+    """Pick the thread setting with the lowest per-message cost, and its best batch sizes."""
+    best = None
+    for key in sorted({(r["threads"], r["interop"]) for r in results}):
+        rows = [r for r in results if (r["threads"], r["interop"]) == key]
+        emotion = best_batch([r for r in rows if r["model"] == "emotion"], max_latency_ms)
+        generation = best_batch([r for r in rows if r["model"] == "generation"], max_latency_ms)
+        cost = 1 / emotion["items_per_sec"] + 1 / generation["items_per_sec"]
+        if best is None or cost < best[0]:
+            best = (cost, key, emotion, generation)
+    cost, (threads, interop), emotion, generation = best
+    return {
+        "num_threads": threads,
+        "num_interop_threads": interop,
+        "emotion_batch_size": emotion["batch_size"],
+        "generation_batch_size": generation["batch_size"],
+        "emotion_items_per_sec": round(emotion["items_per_sec"], 2),
+        "generation_items_per_sec": round(generation["items_per_sec"], 2),
+        "ms_per_message": round(1000 * cost, 2),
+    }
+
+
+def save_profile(profile, path=PROFILE_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2)
+    os.replace(tmp, path)
+
+
+def default_thread_grid():
+    cpus = os.cpu_count() or 1
+    grid = {1, cpus, max(1, cpus // 2)}
+    n = 2
+    while n < cpus:
+        grid.add(n)
+        n *= 2
+    return sorted(grid)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the fastest CPU thread and batch settings for app.py.")
+    parser.add_argument("--threads", type=int, nargs="+", default=default_thread_grid(),
+                        help="torch.set_num_threads values to try")
+    parser.add_argument("--interop", type=int, nargs="+", default=[1, 2],
+                        help="torch.set_num_interop_threads values to try")
+    parser.add_argument("--emotion-batches", type=int, nargs="+", default=[1, 8, 16, 32, 64])
+    parser.add_argument("--generation-batches", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--gen-tokens", type=int, default=32, help="tokens decoded per generation run")
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs per setting (median is kept)")
+    parser.add_argument("--max-batch-latency-ms", type=float, default=None,
+                        help="ignore batch sizes slower than this per batch")
+    parser.add_argument("--out", default=PROFILE_PATH)
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print(f"Autotuning on {os.cpu_count()} CPUs")
+    print(f"  - threads: {args.threads}, interop: {args.interop}")
+    print(f"  - emotion batches: {args.emotion_batches}, generation batches: {args.generation_batches}")
+    print("=" * 70)
+
+    ctx = mp.get_context("spawn")
+    results = []
+    for interop in args.interop:
+        with ctx.Pool(1) as pool:
+            results += pool.apply(benchmark_interop, (interop, args.threads, args.emotion_batches,
+                                                      args.generation_batches, args.gen_tokens, args.repeats))
+
+    print("\n" + "=" * 70)
+    print(f"{'model':<12}{'threads':>8}{'interop':>8}{'batch':>7}{'ms/batch':>11}{'items/sec':>11}")
+    for r in results:
+        print(f"{r['model']:<12}{r['threads']:>8}{r['interop']:>8}{r['batch_size']:>7}"
+              f"{r['latency_ms']:>11.1f}{r['items_per_sec']:>11.1f}")
+
+    import torch
+    profile = choose_profile(results, args.max_batch_latency_ms)
+    profile.update({"cpu_count": os.cpu_count(), "torch_version": torch.__version__,
+                    "tuned_at": time.strftime("%Y-%m-%dT%H:%M:%S")})
+    save_profile(profile, args.out)
+
+    print("=" * 70)
+    print(f"✅ Best: {profile['num_threads']} threads, {profile['num_interop_threads']} interop, "
+          f"emotion batch {profile['emotion_batch_size']}, generation batch {profile['generation_batch_size']} "
+          f"({profile['ms_per_message']} ms per message)")
+    print(f"Saved profile to {args.out}; app.py loads it on the next start")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
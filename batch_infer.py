@@ -0,0 +1,190 @@
+# batch_infer.py
+"""
+Offline batch inference over JSONL conversation files, without the HTTP server.
+
+Each input line is a JSON object with a "message" and optionally "session_id",
+"context" (previous turns as "User: ...\\nBot: ..." text) and any other fields,
+which are passed through. Each output line adds "emotion", "response", "crisis"
+and "crisis_level"; a line that isn't a JSON object is written as a record with
+the raw "line" and an "error", so a run (and a resume) moves past it.
+
+- the input is read as a stream, in chunks
+- chunks are scored by a pool of worker processes, each with its own copy of the
+  models, using batched emotion and generation calls
+- output order matches input order
+- results are appended chunk by chunk; a checkpoint file records progress so a
+  crashed run resumes where it stopped (just run the same command again)
+
+Run:
+    python batch_infer.py archive.jsonl replies.jsonl --workers 4 --chunk-size 32
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import multiprocessing as mp
+
+_app = None  # the app module, imported once per worker process
+
+
+def init_worker(threads):
+    global _app
+    import torch
+    # workers only need the models: no durable session store, registry polling or rule hot reload
+    os.environ["SESSION_STORE_DIR"] = ""
+    os.environ["MODEL_REGISTRY_WATCH"] = "0"
+    os.environ["CRISIS_RULES_RELOAD_INTERVAL"] = "0"
+    import app
+    # after the import: each worker gets its share of the cores, whatever the saved profile says
+    torch.set_num_threads(threads)
+    _app = app
+
+
+def parse_line(line):
+    """Parse one input line into (record, error); a line that isn't a JSON object gives an error, not an exception."""
+    try:
+        record = json.loads(line)
+    except json.JSONDecodeError as e:
+        return None, f"invalid JSON: {e}"
+    if not isinstance(record, dict):
+        return None, f"expected a JSON object, got {type(record).__name__}"
+    return record, None
+
+
+def process_chunk(lines):
+    """Score one chunk of raw JSONL lines. Runs in a worker process; returns (input lines consumed, output lines)."""
+    lines_kept = [line for line in lines if line.strip()]
+    records = []
+    results = [None] * len(lines_kept)
+    pending = []
+    for i, line in enumerate(lines_kept):
+        record, error = parse_line(line)
+        records.append(record)
+        if error:
+            # written as an error record so the run (and a resume) moves past the bad line
+            results[i] = {"line": line.rstrip("\n"), "emotion": None, "response": None, "crisis": False,
+                          "crisis_level": None, "error": error}
+            continue
+        text = str(record.get("message", "")).strip()
+        if not text:
+            results[i] = {**record, "emotion": None, "response": None, "crisis": False,
+                          "crisis_level": None, "error": "empty message"}
+            continue
+        is_crisis, level, crisis_msg = _app.detect_crisis(text)
+        if is_crisis:
+            results[i] = {**record, "emotion": "crisis", "response": crisis_msg, "crisis": True,
+                          "crisis_level": level.name}
+        else:
+            pending.append((i, text))
+
+    if pending:
+        texts = [text for _, text in pending]
+        try:
+            emotions = _app.detect_emotions(texts)
+        except Exception:
+            emotions = ["neutral"] * len(pending)
+        try:
+            replies = _app.generate_responses_with_tone([
+                (text, emotion, records[i].get("context", ""))
+                for (i, text), emotion in zip(pending, emotions)
+            ])
+        except Exception:
+            replies = [_app.ERROR_REPLY] * len(pending)
+        for (i, _), emotion, reply in zip(pending, emotions, replies):
+            results[i] = {**records[i], "emotion": emotion, "response": reply, "crisis": False,
+                          "crisis_level": None}
+
+    return len(lines), [json.dumps(r, ensure_ascii=False) + "\n" for r in results]
+
+
+def iter_chunks(path, chunk_size, skip_lines=0):
+    """Yield lists of raw lines from a JSONL file, starting after skip_lines input lines."""
+    with open(path, "r", encoding="utf-8") as f:
+        lines = itertools.islice(f, skip_lines, None)
+        while True:
+            chunk = list(itertools.islice(lines, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+
+def load_checkpoint(path):
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"input_lines": 0, "output_bytes": 0, "items": 0}
+
+
+def save_checkpoint(path, checkpoint):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def run(input_path, output_path, workers=2, chunk_size=32, restart=False):
+    ckpt_path = output_path + ".ckpt"
+    if restart:
+        for path in (output_path, ckpt_path):
+            if os.path.exists(path):
+                os.remove(path)
+    checkpoint = load_checkpoint(ckpt_path)
+    if checkpoint["input_lines"]:
+        print(f"Resuming after {checkpoint['input_lines']} input lines ({checkpoint['items']} items done)")
+
+    # drop anything written after the last checkpoint (a chunk cut short by a crash)
+    out = open(output_path, "a+b")
+    out.truncate(checkpoint["output_bytes"])
+    out.seek(0, os.SEEK_END)
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    ctx = mp.get_context("spawn")
+    start = time.perf_counter()
+    done = 0
+    try:
+        with ctx.Pool(workers, initializer=init_worker, initargs=(threads,)) as pool:
+            chunks = iter_chunks(input_path, chunk_size, checkpoint["input_lines"])
+            # imap keeps results in input order while workers run ahead
+            for consumed, lines in pool.imap(process_chunk, chunks):
+                out.write("".join(lines).encode("utf-8"))
+                out.flush()
+                os.fsync(out.fileno())
+                checkpoint["input_lines"] += consumed
+                checkpoint["output_bytes"] = out.tell()
+                checkpoint["items"] += len(lines)
+                save_checkpoint(ckpt_path, checkpoint)
+                done += len(lines)
+                elapsed = time.perf_counter() - start
+                print(f"\r{checkpoint['items']} items written, {done / elapsed:.1f} items/sec", end="")
+    finally:
+        out.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"\n✅ Done: {done} items in {elapsed:.1f}s ({done / elapsed if elapsed else 0:.1f} items/sec)")
+    print(f"Results: {output_path}")
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline crisis/emotion/response scoring for JSONL files.")
+    parser.add_argument("input", help="input JSONL file")
+    parser.add_argument("output", help="output JSONL file (appended to when resuming)")
+    parser.add_argument("--workers", type=int, default=2, help="worker processes, each loading the models")
+    parser.add_argument("--chunk-size", type=int, default=32, help="messages per batched model call")
+    parser.add_argument("--restart", action="store_true", help="ignore any checkpoint and start over")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input):
+        print(f"❌ Input file not found: {args.input}")
+        return 1
+    run(args.input, args.output, args.workers, args.chunk_size, args.restart)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
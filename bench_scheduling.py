@@ -0,0 +1,133 @@
+# bench_scheduling.py
+"""
+Latency under mixed load: shortest-job-first (with aging) vs FIFO for the
+model-work queue in admission.ConcurrencyLimiter.
+
+Jobs arrive as a Poisson stream; most are short first turns, some are long-context
+returning sessions. Each job waits for a slot and then "runs" for a time
+proportional to its estimated cost (or, with --real, calls the real
+generate_response_with_tone from app.py). End-to-end latency percentiles are
+printed per job type and overall for every policy.
+
+Run:
+    python bench_scheduling.py
+    python bench_scheduling.py --jobs 400 --load 0.9 --long-fraction 0.3
+    python bench_scheduling.py --real --jobs 60
+    INFERENCE_BACKEND=fake FAKE_BACKEND_PER_TOKEN_MS=0.5 python bench_scheduling.py --real   # serving layer only
+"""
+
+import random
+import argparse
+import threading
+import time
+
+import numpy as np
+
+from admission import ConcurrencyLimiter, Overloaded
+
+NEW_TOKENS = 80
+JOB_TYPES = {
+    # name: (priority class, prompt tokens)
+    "short": ("first_turn", 40),
+    "long": ("returning", 600),
+}
+LONG_CONTEXT = "User: I've been having a hard time at work and at home.\nBot: That sounds exhausting.\n" * 20
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    ms = 1000 * np.array(values)
+    return {"p50": float(np.percentile(ms, 50)), "p95": float(np.percentile(ms, 95)),
+            "p99": float(np.percentile(ms, 99)), "max": float(ms.max())}
+
+
+def make_workload(n, long_fraction, seed):
+    rng = random.Random(seed)
+    return ["long" if rng.random() < long_fraction else "short" for _ in range(n)]
+
+
+def run_policy(policy, workload, arrival_rate, concurrency, seconds_per_token, aging, run_job, seed):
+    limiter = ConcurrencyLimiter(concurrency, timeout=600, policy=policy, aging=aging)
+    rng = random.Random(seed)
+    latencies = {name: [] for name in JOB_TYPES}
+    lock = threading.Lock()
+
+    def job(kind):
+        priority, prompt_tokens = JOB_TYPES[kind]
+        cost = prompt_tokens + NEW_TOKENS
+        start = time.perf_counter()
+        try:
+            with limiter.slot(cost, priority):
+                run_job(kind, cost * seconds_per_token)
+        except Overloaded:
+            return
+        with lock:
+            latencies[kind].append(time.perf_counter() - start)
+
+    threads = []
+    for kind in workload:
+        t = threading.Thread(target=job, args=(kind,))
+        t.start()
+        threads.append(t)
+        time.sleep(rng.expovariate(arrival_rate))
+    for t in threads:
+        t.join()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare SJF and FIFO scheduling of model work under mixed load.")
+    parser.add_argument("--jobs", type=int, default=300)
+    parser.add_argument("--long-fraction", type=float, default=0.2, help="share of long-context jobs")
+    parser.add_argument("--load", type=float, default=0.85, help="offered load as a fraction of capacity")
+    parser.add_argument("--concurrency", type=int, default=2, help="model-work slots")
+    parser.add_argument("--ms-per-token", type=float, default=0.5, help="simulated service time per cost token")
+    parser.add_argument("--aging", type=float, default=100.0, help="SJF aging, cost tokens per second waited")
+    parser.add_argument("--real", action="store_true", help="run app.py's generation (with its INFERENCE_BACKEND) instead of sleeping")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    seconds_per_token = args.ms_per_token / 1000
+    if args.real:
+        import app
+        prompts = {"short": ("I had a rough day.", ""), "long": ("I had a rough day.", LONG_CONTEXT)}
+
+        def run_job(kind, _):
+            user_text, context = prompts[kind]
+            app.generate_response_with_tone(user_text, "sadness", context)
+
+        # calibrate: measure the real mean service time per job
+        t0 = time.perf_counter()
+        for kind in JOB_TYPES:
+            run_job(kind, 0)
+        mean_service = (time.perf_counter() - t0) / len(JOB_TYPES)
+    else:
+        def run_job(_, seconds):
+            time.sleep(seconds)
+
+        mean_cost = sum((1 - args.long_fraction if k == "short" else args.long_fraction) * (p + NEW_TOKENS)
+                        for k, (_, p) in JOB_TYPES.items())
+        mean_service = mean_cost * seconds_per_token
+    arrival_rate = args.load * args.concurrency / mean_service
+
+    workload = make_workload(args.jobs, args.long_fraction, args.seed)
+    print("=" * 70)
+    print(f"{args.jobs} jobs ({args.long_fraction:.0%} long), {args.concurrency} slots, "
+          f"load {args.load:.0%} ({arrival_rate:.1f} jobs/sec), {'real models' if args.real else 'simulated'}")
+    print("=" * 70)
+    print(f"{'policy':<8}{'jobs':<8}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for policy in ("fifo", "sjf"):
+        latencies = run_policy(policy, workload, arrival_rate, args.concurrency, seconds_per_token,
+                               args.aging, run_job, args.seed)
+        rows = dict(latencies)
+        rows["all"] = [v for values in latencies.values() for v in values]
+        for name, values in rows.items():
+            p = percentiles(values)
+            print(f"{policy:<8}{name:<8}{len(values):>7}{p['p50']:>10.0f}{p['p95']:>10.0f}"
+                  f"{p['p99']:>10.0f}{p['max']:>10.0f}")
+        print("-" * 70)
+
+
+if __name__ == "__main__":
+    main()
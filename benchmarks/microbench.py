@@ -0,0 +1,291 @@
+# benchmarks/microbench.py
+"""
+Micro-benchmarks for the per-message hot path, with stored baselines.
+
+Each benchmark runs one function on a short, long or adversarial input and
+records:
+- time_us: time per call, best of several repeats (each repeat loops for at
+  least --min-time seconds, with garbage collection paused, as timeit does;
+  the fastest repeat is the one least disturbed by other work on the machine)
+- relative_time: time_us divided by the time of a fixed reference workload
+  (string, dict, regex and json work) measured right before it; this cancels
+  out how fast or how loaded the machine is, so it is what gets compared
+- peak_kb: peak memory allocated during one call (tracemalloc)
+
+Results are compared with benchmarks/baseline.json; a benchmark regresses when
+relative_time or peak_kb grows by more than --tolerance (default 25%). An
+apparent regression is measured again (--retries) and only counts if it
+persists, since a real slowdown reproduces and a noisy neighbour doesn't.
+Baselines store the median of --baseline-runs measurements, a typical run
+rather than a lucky one. detect_emotion runs on the fake inference backend, so
+it measures the serving layer (coalescing, batching, model slot), not the model.
+
+Run:
+    python -m benchmarks.microbench                     # compare with the baseline
+    python -m benchmarks.microbench --filter crisis     # only matching benchmarks
+    python -m benchmarks.microbench --update-baseline   # record new baselines
+    python run_tests.py --bench --tolerance=0.3         # same comparison, from the test runner
+"""
+
+import gc
+import os
+import sys
+import re
+import json
+import time
+import argparse
+import platform
+import itertools
+import statistics
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+os.environ.setdefault("INFERENCE_BACKEND", "fake")  # before app is imported
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_TOLERANCE = 0.25
+PEAK_SLACK_KB = 1.0  # allocation noise below this is ignored
+
+SHORT_TEXT = "I feel a bit down today"
+LONG_TEXT = (
+    "Work has been really stressful lately and I keep thinking about the deadline next week. "
+    "My manager asked me to take on another project and I said yes even though I'm already behind. "
+    "At home things are fine, but I haven't been sleeping well and I skip meals when I'm busy. "
+) * 12
+# Inputs that make the detector's ".*" patterns backtrack: time grows roughly cubically with
+# length, so keep these at ~700 characters (a 14 KB message like this takes over a minute)
+ADVERSARIAL_TEXTS = {
+    "backtracking_want": "i want to not " * 50,
+    "backtracking_cant": "can't do this " * 50,
+    "no_spaces": "a" * 20000,
+    "unicode_noise": "k​ill my​self 😔 " * 200,
+}
+
+
+def reference_workload():
+    """Fixed work used to normalise timings (see relative_time)."""
+    counts = {}
+    for word in re.findall(r"[a-z']+", LONG_TEXT.lower()):
+        counts[word] = counts.get(word, 0) + 1
+    json.dumps(sorted(counts.items()))
+    return " ".join(LONG_TEXT.split())
+
+
+class Benchmark:
+    def __init__(self, name: str, setup: Callable[[], Callable[[], object]]):
+        self.name = name
+        self.setup = setup  # returns the function to time, so setup work isn't measured
+
+
+def crisis_benchmarks() -> List[Benchmark]:
+    from crisis_detector import get_detector
+    detector = get_detector("india")
+    inputs = {"short": SHORT_TEXT, "long": LONG_TEXT, **ADVERSARIAL_TEXTS}
+    return [Benchmark(f"crisis.detect[{name}]", lambda text=text: lambda: detector.detect(text))
+            for name, text in inputs.items()]
+
+
+def memory_benchmarks() -> List[Benchmark]:
+    import app
+    ids = itertools.count()
+
+    def full_session(text):
+        session_id = f"bench-full-{next(ids)}"
+        for _ in range(app.MAX_MEMORY):
+            app.add_memory(session_id, text, text)
+        return session_id
+
+    def context(text):
+        session_id = full_session(text)
+        return lambda: app.get_context(session_id)
+
+    def add_to_full(text):
+        session_id = full_session(text)  # every call appends and trims
+        return lambda: app.add_memory(session_id, text, text)
+
+    def add_new_session():
+        return lambda: app.add_memory(f"bench-new-{next(ids)}", SHORT_TEXT, SHORT_TEXT)
+
+    return [
+        Benchmark("get_context[short]", lambda: context(SHORT_TEXT)),
+        Benchmark("get_context[long]", lambda: context(LONG_TEXT)),
+        Benchmark("add_memory[full_session]", lambda: add_to_full(SHORT_TEXT)),
+        Benchmark("add_memory[full_session_long]", lambda: add_to_full(LONG_TEXT)),
+        Benchmark("add_memory[new_session]", add_new_session),
+    ]
+
+
+def emotion_benchmarks() -> List[Benchmark]:
+    import app
+    inputs = {"short": SHORT_TEXT, "long": LONG_TEXT, "whitespace": "  I   feel \n\n down  " * 100}
+    return [Benchmark(f"detect_emotion[{name}]", lambda text=text: lambda: app.detect_emotion(text))
+            for name, text in inputs.items()]
+
+
+def all_benchmarks() -> List[Benchmark]:
+    return crisis_benchmarks() + memory_benchmarks() + emotion_benchmarks()
+
+
+def time_per_call(fn: Callable, min_time: float, repeats: int) -> float:
+    """Best seconds per call over repeats; the loop count is doubled until one repeat takes min_time."""
+
+    def timed(loops):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        return time.perf_counter() - start
+
+    fn()  # warm-up
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        loops = 1
+        while (elapsed := timed(loops)) < min_time:
+            loops *= 2
+        return min([elapsed] + [timed(loops) for _ in range(repeats - 1)]) / loops
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def peak_allocation_kb(fn: Callable, calls: int = 5) -> float:
+    """Largest tracemalloc peak over a few calls, in KB above what was allocated before the call."""
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(calls):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            fn()
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+    finally:
+        tracemalloc.stop()
+    return max(peaks) / 1024
+
+
+def measure(bench: Benchmark, min_time: float, repeats: int) -> Dict[str, float]:
+    fn = bench.setup()
+    reference = time_per_call(reference_workload, min_time, repeats)
+    seconds = time_per_call(fn, min_time, repeats)
+    return {"time_us": round(1e6 * seconds, 3),
+            "relative_time": round(seconds / reference, 6),
+            "peak_kb": round(peak_allocation_kb(fn), 2)}
+
+
+def run(benchmarks: List[Benchmark], min_time: float, repeats: int) -> Dict[str, Dict[str, float]]:
+    return {bench.name: measure(bench, min_time, repeats) for bench in benchmarks}
+
+
+def best(a: Dict[str, float], b: Dict[str, float]) -> Dict[str, float]:
+    return {key: min(a[key], b[key]) for key in a}
+
+
+def typical(bench: Benchmark, min_time: float, repeats: int, runs: int) -> Dict[str, float]:
+    """Median of each number over several measurements, for baselines."""
+    samples = [measure(bench, min_time, repeats) for _ in range(runs)]
+    return {key: statistics.median(s[key] for s in samples) for key in samples[0]}
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> Dict[str, List[str]]:
+    """Regressions (name -> what got worse) and benchmarks without a baseline."""
+    regressions, missing = {}, []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if base is None:
+            missing.append(name)
+            continue
+        worse = []
+        if current["relative_time"] > base["relative_time"] * (1 + tolerance):
+            worse.append(f"relative time {base['relative_time']:.3f} -> {current['relative_time']:.3f} "
+                         f"({current['relative_time'] / base['relative_time'] - 1:+.0%})")
+        if current["peak_kb"] > base["peak_kb"] * (1 + tolerance) + PEAK_SLACK_KB:
+            worse.append(f"peak {base['peak_kb']:.1f} -> {current['peak_kb']:.1f} KB")
+        if worse:
+            regressions[name] = worse
+    return {"regressions": regressions, "missing": missing}
+
+
+def machine_info() -> Dict:
+    return {"python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count()}
+
+
+def load_baseline(path: str = BASELINE_PATH) -> Optional[Dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(results: Dict, path: str = BASELINE_PATH, merge: bool = True):
+    """Write results as the baseline (atomically); with merge, benchmarks not run keep their old entry."""
+    old = load_baseline(path) if merge else None
+    baseline = {"machine": machine_info(),
+                "results": {**(old["results"] if old else {}), **results}}
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run micro-benchmarks and compare them with stored baselines.")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=float(os.getenv("BENCH_TOLERANCE", DEFAULT_TOLERANCE)),
+                        help="allowed relative slowdown / allocation growth (0.25 = 25%%)")
+    parser.add_argument("--filter", default="", help="only benchmarks whose name contains this")
+    parser.add_argument("--min-time", type=float, default=0.05, help="seconds per timing repeat")
+    parser.add_argument("--repeats", type=int, default=7)
+    parser.add_argument("--retries", type=int, default=2, help="re-measure apparent regressions this many times")
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--baseline-runs", type=int, default=3, help="measurements per benchmark for a baseline")
+    args = parser.parse_args(argv)
+
+    benchmarks = [b for b in all_benchmarks() if args.filter in b.name]
+    print("=" * 70)
+    print(f"MICRO-BENCHMARKS ({len(benchmarks)}, tolerance {args.tolerance:.0%})")
+    print("=" * 70)
+    if args.update_baseline:
+        results = {b.name: typical(b, args.min_time, args.repeats, args.baseline_runs) for b in benchmarks}
+        save_baseline(results, args.baseline)
+        for name, r in results.items():
+            print(f"{name:<42}{r['time_us']:>12.1f} us{r['relative_time']:>10.3f} x ref{r['peak_kb']:>10.1f} KB")
+        print(f"\n✅ Baseline written to {args.baseline}")
+        return 0
+
+    results = run(benchmarks, args.min_time, args.repeats)
+    stored = load_baseline(args.baseline)
+    if stored is None:
+        print(f"❌ No baseline at {args.baseline}; run with --update-baseline first")
+        return 1
+    if stored.get("machine") != machine_info():
+        print(f"⚠️  Baseline was recorded on {stored.get('machine')}; relative times may still differ")
+    baseline = stored["results"]
+    verdict = compare(results, baseline, args.tolerance)
+    by_name = {b.name: b for b in benchmarks}
+    for _ in range(args.retries):
+        if not verdict["regressions"]:
+            break
+        for name in verdict["regressions"]:
+            results[name] = best(results[name], measure(by_name[name], args.min_time, args.repeats))
+        verdict = compare(results, baseline, args.tolerance)
+
+    print(f"{'benchmark':<38}{'now us':>10}{'base rel':>10}{'now rel':>9}{'base KB':>9}{'now KB':>8}")
+    for name, r in results.items():
+        base = baseline.get(name, {})
+        mark = "❌" if name in verdict["regressions"] else ("⚠️ " if name in verdict["missing"] else "✓")
+        print(f"{name:<38}{r['time_us']:>10.1f}{base.get('relative_time', float('nan')):>10.3f}"
+              f"{r['relative_time']:>9.3f}{base.get('peak_kb', float('nan')):>9.1f}{r['peak_kb']:>8.1f}  {mark}")
+    print("-" * 70)
+    for name in verdict["missing"]:
+        print(f"⚠️  {name}: no baseline (run with --update-baseline)")
+    for name, worse in verdict["regressions"].items():
+        print(f"❌ {name}: {', '.join(worse)}")
+    if verdict["regressions"]:
+        return 1
+    print("✅ No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,14 +3,22 @@
 Enhanced crisis detection module combining:
 1. Keyword-based detection (high recall)
 2. Pattern matching for indirect expressions
-3. Optional ML-based severity scoring
+3. Optional ML-based severity scoring (hashed n-grams + linear model, NumPy only)
+
+Lexicons, patterns and helplines can be overridden from an external JSON rule
+file (CRISIS_RULES_PATH) that is hot-reloaded without a restart.
 
 This ensures no crisis messages are missed (100% recall priority).
 """
 
+import os
 import re
-from typing import Tuple, Dict
+import json
+import zlib
+import threading
+from typing import Tuple, Dict, List, Optional, Union
 from enum import Enum
+import numpy as np
 
 class CrisisLevel(Enum):
     NONE = 0
@@ -67,35 +75,387 @@ HELPLINES = {
     }
 }
 
+# Optional ML severity model (train with: python train_crisis_scorer.py)
+SEVERITY_MODEL_PATH = "./models/crisis_severity.npz"
+SEVERITY_THRESHOLD = 0.8  # minimum probability before the model may escalate a level
+
+_WORD_RE = re.compile(r"[a-z']+")
+
+
+class SeverityScorer:
+    """
+    Tiny linear severity classifier over hashed n-gram features.
+
+    Features are word unigrams, word bigrams and character trigrams, hashed into
+    n_features buckets with CRC32 (stable across processes). Scoring is a NumPy
+    gather-and-sum over the weight rows followed by a softmax across the
+    CrisisLevel classes, so it runs in well under a millisecond without torch.
+    """
+
+    def __init__(self, weights: np.ndarray, bias: np.ndarray):
+        self.weights = weights.astype(np.float32)
+        self.bias = bias.astype(np.float32)
+        self.n_features = weights.shape[0]
+
+    @staticmethod
+    def ngrams(text: str) -> List[str]:
+        words = _WORD_RE.findall(text.lower())
+        grams = ["w:" + w for w in words]
+        grams += ["b:" + a + " " + b for a, b in zip(words, words[1:])]
+        for w in words:
+            padded = f"#{w}#"
+            grams += ["c:" + padded[i:i + 3] for i in range(len(padded) - 2)]
+        return grams
+
+    @classmethod
+    def hash_features(cls, text: str, n_features: int) -> np.ndarray:
+        return np.fromiter(
+            (zlib.crc32(g.encode("utf-8")) % n_features for g in cls.ngrams(text)),
+            dtype=np.int64,
+        )
+
+    def features(self, text: str) -> np.ndarray:
+        return self.hash_features(text, self.n_features)
+
+    def predict_proba_batch(self, texts: List[str]) -> np.ndarray:
+        """Class probabilities for several texts; shape (len(texts), len(CrisisLevel))."""
+        feats = [self.features(t) for t in texts]
+        lengths = np.array([len(f) for f in feats])
+        logits = np.tile(self.bias, (len(texts), 1))
+        if lengths.sum():
+            idx = np.concatenate(feats)
+            rows = np.repeat(np.arange(len(texts)), lengths)
+            np.add.at(logits, rows, self.weights[idx])
+        logits -= logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        return probs / probs.sum(axis=1, keepdims=True)
+
+    def predict_proba(self, text: str) -> np.ndarray:
+        idx = self.features(text)
+        logits = self.bias + self.weights[idx].sum(axis=0)
+        probs = np.exp(logits - logits.max())
+        return probs / probs.sum()
+
+    def predict(self, text: str) -> Tuple[CrisisLevel, float]:
+        probs = self.predict_proba(text)
+        label = int(np.argmax(probs))
+        return CrisisLevel(label), float(probs[label])
+
+    @classmethod
+    def fit(cls, texts: List[str], labels: List[int], n_features: int = 1 << 16,
+            epochs: int = 30, lr: float = 0.5, l2: float = 1e-5, batch_size: int = 32,
+            seed: int = 0) -> "SeverityScorer":
+        """Train multinomial logistic regression with class-balanced mini-batch SGD."""
+        n_classes = len(CrisisLevel)
+        rng = np.random.default_rng(seed)
+        feats = [cls.hash_features(t, n_features) for t in texts]
+        y = np.asarray(labels, dtype=np.int64)
+        counts = np.bincount(y, minlength=n_classes).astype(np.float32)
+        class_weight = np.where(counts > 0, len(y) / (n_classes * np.maximum(counts, 1)), 0.0)
+
+        scorer = cls(np.zeros((n_features, n_classes), dtype=np.float32),
+                     np.zeros(n_classes, dtype=np.float32))
+        for _ in range(epochs):
+            order = rng.permutation(len(y))
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                probs = scorer.predict_proba_batch([texts[i] for i in batch])
+                grad = probs
+                grad[np.arange(len(batch)), y[batch]] -= 1.0
+                grad *= class_weight[y[batch]][:, None] / len(batch)
+                scorer.bias -= lr * grad.sum(axis=0)
+                for row, i in enumerate(batch):
+                    np.add.at(scorer.weights, feats[i], -lr * grad[row])
+            scorer.weights *= (1.0 - lr * l2)
+        return scorer
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez_compressed(path, weights=self.weights, bias=self.bias)
+
+    @classmethod
+    def load(cls, path: str) -> "SeverityScorer":
+        with np.load(path) as data:
+            return cls(data["weights"], data["bias"])
+
+
+# Multi-turn tracking: each turn's rule level adds its weight to a per-session
+# risk score that decays geometrically, so concern building over several
+# messages can escalate the level of the current one.
+SESSION_DECAY = 0.6
+LEVEL_WEIGHTS = {
+    CrisisLevel.NONE: 0.0,
+    CrisisLevel.LOW: 1.0,
+    CrisisLevel.MEDIUM: 2.0,
+    CrisisLevel.HIGH: 3.0,
+    CrisisLevel.CRITICAL: 4.0,
+}
+SESSION_ESCALATION = [(3.0, CrisisLevel.HIGH), (1.5, CrisisLevel.MEDIUM)]  # (min score, level)
+MIN_SIGNAL_WEIGHT = 0.1
+
+
+class SessionCrisisState:
+    """
+    Rolling crisis state for one session: a decayed risk score plus the decayed
+    concerning keywords seen recently. Each update is O(1) in the history length.
+    """
+    __slots__ = ("score", "turns", "signals")
+
+    def __init__(self):
+        self.score = 0.0
+        self.turns = 0
+        self.signals = {}  # keyword -> decayed weight
+
+    def update(self, level: CrisisLevel, keywords: List[str]) -> float:
+        self.turns += 1
+        self.score = self.score * SESSION_DECAY + LEVEL_WEIGHTS[level]
+        self.signals = {
+            k: w * SESSION_DECAY for k, w in self.signals.items()
+            if w * SESSION_DECAY >= MIN_SIGNAL_WEIGHT
+        }
+        for keyword in keywords:
+            self.signals[keyword] = self.signals.get(keyword, 0.0) + 1.0
+        return self.score
+
+    def copy(self) -> "SessionCrisisState":
+        state = SessionCrisisState()
+        state.score, state.turns, state.signals = self.score, self.turns, dict(self.signals)
+        return state
+
+    def escalation_level(self) -> CrisisLevel:
+        for min_score, level in SESSION_ESCALATION:
+            if self.score >= min_score:
+                return level
+        return CrisisLevel.NONE
+
+
+def render_crisis_message(helpline: Dict, level: CrisisLevel) -> str:
+    """Build the crisis response for one helpline entry and severity level."""
+    base_message = "I'm really sorry you're feeling this way. "
+    
+    if level == CrisisLevel.CRITICAL or level == CrisisLevel.HIGH:
+        message = (
+            f"{base_message}Your safety is the top priority. "
+            f"Please reach out for immediate help:\n\n"
+        )
+        if "number" in helpline:
+            message += f"📞 {helpline['name']}: {helpline['number']} ({helpline['hours']})\n"
+        if "url" in helpline:
+            message += f"🌐 {helpline['url']}\n"
+        message += (
+            f"\n🚨 If you're in immediate danger, please call emergency services (112 in India, 911 in US).\n\n"
+            f"Would you like me to provide additional resources or help you connect with someone?"
+        )
+    
+    elif level == CrisisLevel.MEDIUM:
+        message = (
+            f"{base_message}It sounds like you're going through a really difficult time. "
+            f"You don't have to face this alone. Consider reaching out:\n\n"
+        )
+        if "number" in helpline:
+            message += f"📞 {helpline['name']}: {helpline['number']}\n\n"
+        message += "Would you like to talk about what's troubling you?"
+    
+    else:  # LOW
+        message = (
+            f"{base_message}I'm here to listen. If things feel overwhelming, "
+            f"remember that support is available:\n\n"
+        )
+        if "number" in helpline:
+            message += f"📞 {helpline['name']}: {helpline['number']}\n\n"
+        message += "What's been on your mind?"
+    
+    return message
+
+
+# Optional external rule file; keys override the module-level defaults above.
+# See crisis_rules.example.json for the format.
+CRISIS_RULES_PATH = os.getenv("CRISIS_RULES_PATH", "./crisis_rules.json")
+RULES_RELOAD_INTERVAL = float(os.getenv("CRISIS_RULES_RELOAD_INTERVAL", "2.0"))  # seconds between rule file checks (0 = off)
+
+
+class CrisisRulesError(ValueError):
+    """A rule file that is not valid JSON or doesn't have the expected shape."""
+
+
+def validate_rules(data) -> Dict:
+    """Check the shape of a parsed rule file, so a bad edit fails here rather than mid-request."""
+    if not isinstance(data, dict):
+        raise CrisisRulesError(f"expected a JSON object, got {type(data).__name__}")
+    for key in ("critical_keywords", "concerning_keywords", "patterns"):
+        if key in data and not (isinstance(data[key], list) and all(isinstance(v, str) for v in data[key])):
+            raise CrisisRulesError(f"'{key}' must be a list of strings")
+    helplines = data.get("helplines", {})
+    if not isinstance(helplines, dict):
+        raise CrisisRulesError("'helplines' must be an object of region -> helpline")
+    for region, helpline in helplines.items():
+        if not isinstance(helpline, dict):
+            raise CrisisRulesError(f"helpline '{region}' must be an object")
+        required = ("name", "number", "hours") if "number" in helpline else ()
+        missing = [field for field in required if field not in helpline]
+        if missing:
+            raise CrisisRulesError(f"helpline '{region}' is missing {', '.join(missing)}")
+    return data
+
+
+class CrisisRules:
+    """
+    Immutable, fully compiled snapshot of the lexicons, patterns and helplines,
+    with every region/level crisis message prerendered. Detectors swap whole
+    snapshots, so a detect() call never sees a half-built matcher.
+    """
+
+    def __init__(self, critical_keywords, concerning_keywords, patterns, helplines, source="defaults"):
+        self.critical_keywords = tuple(k.lower() for k in critical_keywords)
+        self.concerning_keywords = tuple(k.lower() for k in concerning_keywords)
+        self.compiled_patterns = tuple(re.compile(p, re.IGNORECASE) for p in patterns)
+        if "international" not in helplines:
+            helplines = {**helplines, "international": HELPLINES["international"]}
+        self.helplines = helplines
+        self.messages = {
+            region: {level: render_crisis_message(helpline, level) for level in CrisisLevel}
+            for region, helpline in helplines.items()
+        }
+        self.source = source
+
+    @classmethod
+    def defaults(cls) -> "CrisisRules":
+        return cls(CRITICAL_KEYWORDS, CONCERNING_KEYWORDS, CRISIS_PATTERNS, HELPLINES)
+
+    @classmethod
+    def from_file(cls, path: str) -> "CrisisRules":
+        with open(path, "r", encoding="utf-8") as f:
+            try:
+                data = validate_rules(json.load(f))
+            except json.JSONDecodeError as e:
+                raise CrisisRulesError(f"invalid JSON: {e}") from e
+        try:
+            return cls(
+                data.get("critical_keywords", CRITICAL_KEYWORDS),
+                data.get("concerning_keywords", CONCERNING_KEYWORDS),
+                data.get("patterns", CRISIS_PATTERNS),
+                {**HELPLINES, **data.get("helplines", {})},  # regions left out keep their default helpline
+                source=path,
+            )
+        except re.error as e:
+            raise CrisisRulesError(f"invalid pattern: {e}") from e
+
+    def helpline(self, region: str) -> Dict:
+        return self.helplines.get(region, self.helplines["international"])
+
+    def message(self, region: str, level: CrisisLevel) -> str:
+        return self.messages.get(region, self.messages["international"])[level]
+
+
 class CrisisDetector:
-    def __init__(self, region: str = "india"):
+    def __init__(self, region: str = "india",
+                 severity_model: Optional[Union[SeverityScorer, str]] = None,
+                 severity_threshold: float = SEVERITY_THRESHOLD,
+                 rules_path: Optional[str] = None):
         self.region = region.lower()
-        self.compiled_patterns = [re.compile(p, re.IGNORECASE) for p in CRISIS_PATTERNS]
+        self.rules_path = rules_path
+        self.rules = CrisisRules.defaults()
+        self._rules_mtime = None   # mtime of the file the current rules came from
+        self._failed_mtime = None  # mtime of the last file that failed to load
+        self._watcher = None
+        self._stop_watching = threading.Event()
+        if rules_path:
+            self.reload_rules()
+        if isinstance(severity_model, str):
+            severity_model = SeverityScorer.load(severity_model)
+        self.severity_model = severity_model
+        self.severity_threshold = severity_threshold
+    
+    @property
+    def compiled_patterns(self):
+        return self.rules.compiled_patterns
+    
+    def reload_rules(self) -> bool:
+        """
+        Rebuild rules from rules_path if it changed, then swap them in atomically.
+        Returns True if new rules were installed. A broken file keeps the old rules,
+        and is not read again until it changes.
+        """
+        try:
+            mtime = os.stat(self.rules_path).st_mtime_ns
+        except (OSError, TypeError):
+            return False
+        if mtime in (self._rules_mtime, self._failed_mtime):
+            return False
+        try:
+            rules = CrisisRules.from_file(self.rules_path)
+        except Exception as e:
+            self._failed_mtime = mtime
+            print(f"⚠️  Could not load crisis rules from {self.rules_path}, keeping current rules: {e}")
+            return False
+        self._rules_mtime = mtime
+        self._failed_mtime = None
+        self.rules = rules  # single reference swap; in-flight calls keep their snapshot
+        return True
+    
+    def start_watching(self, interval: float = RULES_RELOAD_INTERVAL):
+        """Poll rules_path in a background thread and hot-swap rules when the file changes."""
+        if self._watcher is not None or not self.rules_path or interval <= 0:
+            return
+        self._stop_watching.clear()
+        
+        def watch():
+            while not self._stop_watching.wait(interval):
+                try:
+                    self.reload_rules()
+                except Exception as e:  # never let one bad poll stop hot reloading
+                    print(f"⚠️  Crisis rules watcher error: {e}")
+        
+        self._watcher = threading.Thread(target=watch, name="crisis-rules-watcher", daemon=True)
+        self._watcher.start()
+    
+    def stop_watching(self):
+        self._stop_watching.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
     
     def detect(self, text: str) -> Tuple[bool, CrisisLevel, str]:
         """
         Detect crisis in text.
         
+        Rules run first. If a severity model is loaded, it may escalate the rule
+        level (never lower it) when it is at least severity_threshold confident.
+        
         Returns:
             (is_crisis, crisis_level, explanation)
         """
+        return self._detect(text, self.rules)
+    
+    def _detect(self, text: str, rules: CrisisRules) -> Tuple[bool, CrisisLevel, str]:
+        is_crisis, level, explanation = self._detect_rules(text, rules)
+        if self.severity_model is None or level == CrisisLevel.CRITICAL:
+            return is_crisis, level, explanation
+        
+        ml_level, confidence = self.severity_model.predict(text)
+        if ml_level.value > level.value and confidence >= self.severity_threshold:
+            return True, ml_level, f"{explanation}; escalated by severity model ({confidence:.2f})"
+        return is_crisis, level, explanation
+    
+    def detect_rules(self, text: str) -> Tuple[bool, CrisisLevel, str]:
+        """Keyword and pattern rules only."""
+        return self._detect_rules(text, self.rules)
+    
+    def _detect_rules(self, text: str, rules: CrisisRules) -> Tuple[bool, CrisisLevel, str]:
         text_lower = text.lower()
         
         # Check critical keywords first
-        for keyword in CRITICAL_KEYWORDS:
+        for keyword in rules.critical_keywords:
             if keyword in text_lower:
                 return True, CrisisLevel.CRITICAL, f"Critical keyword detected: '{keyword}'"
         
         # Check patterns
-        for pattern in self.compiled_patterns:
+        for pattern in rules.compiled_patterns:
             if pattern.search(text):
                 return True, CrisisLevel.HIGH, f"Crisis pattern detected"
         
         # Check concerning keywords
-        concern_count = 0
-        for keyword in CONCERNING_KEYWORDS:
-            if keyword in text_lower:
-                concern_count += 1
+        concern_count = len(self._concerning_keywords(text_lower, rules))
         
         if concern_count >= 2:
             return True, CrisisLevel.MEDIUM, f"Multiple concerning keywords detected ({concern_count})"
@@ -104,60 +464,59 @@ class CrisisDetector:
         
         return False, CrisisLevel.NONE, "No crisis indicators detected"
     
-    def get_crisis_message(self, level: CrisisLevel) -> str:
-        """Generate appropriate crisis response based on severity level."""
-        helpline = HELPLINES.get(self.region, HELPLINES["international"])
-        
-        base_message = "I'm really sorry you're feeling this way. "
-        
-        if level == CrisisLevel.CRITICAL or level == CrisisLevel.HIGH:
-            message = (
-                f"{base_message}Your safety is the top priority. "
-                f"Please reach out for immediate help:\n\n"
-            )
-            if "number" in helpline:
-                message += f"📞 {helpline['name']}: {helpline['number']} ({helpline['hours']})\n"
-            if "url" in helpline:
-                message += f"🌐 {helpline['url']}\n"
-            message += (
-                f"\n🚨 If you're in immediate danger, please call emergency services (112 in India, 911 in US).\n\n"
-                f"Would you like me to provide additional resources or help you connect with someone?"
-            )
-        
-        elif level == CrisisLevel.MEDIUM:
-            message = (
-                f"{base_message}It sounds like you're going through a really difficult time. "
-                f"You don't have to face this alone. Consider reaching out:\n\n"
-            )
-            if "number" in helpline:
-                message += f"📞 {helpline['name']}: {helpline['number']}\n\n"
-            message += "Would you like to talk about what's troubling you?"
+    def concerning_keywords(self, text_lower: str) -> List[str]:
+        return self._concerning_keywords(text_lower, self.rules)
+    
+    @staticmethod
+    def _concerning_keywords(text_lower: str, rules: CrisisRules) -> List[str]:
+        return [keyword for keyword in rules.concerning_keywords if keyword in text_lower]
+    
+    def detect_in_session(self, text: str, state: SessionCrisisState) -> Tuple[bool, CrisisLevel, str]:
+        """
+        Detect crisis in text, taking the session's earlier turns into account.
         
-        else:  # LOW
-            message = (
-                f"{base_message}I'm here to listen. If things feel overwhelming, "
-                f"remember that support is available:\n\n"
-            )
-            if "number" in helpline:
-                message += f"📞 {helpline['name']}: {helpline['number']}\n\n"
-            message += "What's been on your mind?"
+        Updates state in place. The accumulated session risk can raise the level
+        of a message that itself carries a concern signal; a message with no
+        signal is never flagged because of history alone.
+        """
+        rules = self.rules
+        is_crisis, level, explanation = self._detect(text, rules)
+        state.update(level, self._concerning_keywords(text.lower(), rules))
         
-        return message
+        session_level = state.escalation_level()
+        if is_crisis and session_level.value > level.value:
+            recent = ", ".join(sorted(state.signals)) or "earlier messages"
+            explanation = (f"{explanation}; escalated across {state.turns} turns "
+                           f"(session risk {state.score:.1f}; signals: {recent})")
+            return True, session_level, explanation
+        return is_crisis, level, explanation
+    
+    def get_crisis_message(self, level: CrisisLevel) -> str:
+        """Return the prerendered crisis response for this region and severity level."""
+        return self.rules.message(self.region, level)
     
     def get_helpline_info(self) -> Dict:
         """Get helpline information for the current region."""
-        return HELPLINES.get(self.region, HELPLINES["international"])
+        return self.rules.helpline(self.region)
 
 
-# Singleton instance
-_detector = None
+# Singleton instances, one per region
+_detectors = {}
+_detectors_lock = threading.Lock()
 
 def get_detector(region: str = "india") -> CrisisDetector:
-    """Get or create crisis detector instance."""
-    global _detector
-    if _detector is None:
-        _detector = CrisisDetector(region)
-    return _detector
+    """
+    Get or create the crisis detector for a region (with the severity model, if
+    one has been trained). Detectors watch CRISIS_RULES_PATH and hot-reload it.
+    """
+    region = region.lower()
+    with _detectors_lock:
+        if region not in _detectors:
+            model = SEVERITY_MODEL_PATH if os.path.exists(SEVERITY_MODEL_PATH) else None
+            detector = CrisisDetector(region, severity_model=model, rules_path=CRISIS_RULES_PATH)
+            detector.start_watching()
+            _detectors[region] = detector
+        return _detectors[region]
 
 
 if __name__ == "__main__":
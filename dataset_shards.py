@@ -0,0 +1,113 @@
+# dataset_shards.py
+"""
+Sharded on-disk format for the counseling corpus.
+
+download_dataset.py writes a directory of compressed shards plus a manifest:
+
+    dataset/mental_health_counseling/
+        manifest.json            # format, per-shard row counts and sha256 checksums, "complete" flag
+        shard-00000.parquet      # zstd-compressed Parquet, or
+        shard-00000.jsonl.gz     # gzip-compressed newline-delimited JSON
+
+Readers stream records shard by shard, so nothing requires the whole corpus in memory.
+"""
+
+import os
+import gzip
+import json
+import hashlib
+from typing import Dict, Iterator, List, Optional
+
+MANIFEST_NAME = "manifest.json"
+FORMATS = {"parquet": ".parquet", "jsonl": ".jsonl.gz"}
+
+
+def shard_name(index: int, fmt: str) -> str:
+    return f"shard-{index:05d}{FORMATS[fmt]}"
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(directory: str) -> Optional[Dict]:
+    path = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(directory: str, manifest: Dict):
+    """Write the manifest atomically so an interrupted run never leaves it half-written."""
+    path = os.path.join(directory, MANIFEST_NAME)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, path)
+
+
+def shard_is_valid(directory: str, entry: Dict) -> bool:
+    """A shard is valid if its file exists and matches the manifest checksum."""
+    path = os.path.join(directory, entry["file"])
+    return os.path.exists(path) and file_sha256(path) == entry["sha256"]
+
+
+def write_shard(directory: str, index: int, records: List[Dict], fmt: str = "parquet") -> Dict:
+    """Write one shard (via a temp file + rename) and return its manifest entry."""
+    name = shard_name(index, fmt)
+    path = os.path.join(directory, name)
+    tmp = path + ".tmp"
+    if fmt == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        pq.write_table(pa.Table.from_pylist(records), tmp, compression="zstd")
+    elif fmt == "jsonl":
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    else:
+        raise ValueError(f"Unknown shard format: {fmt} (expected one of {sorted(FORMATS)})")
+    os.replace(tmp, path)
+    return {"file": name, "rows": len(records), "sha256": file_sha256(path)}
+
+
+def remove_stale_shards(directory: str, keep: List[Dict]) -> List[str]:
+    """Delete shard files not listed in keep (left over from a run with another format or shard size)."""
+    keep_files = {entry["file"] for entry in keep}
+    removed = []
+    for name in sorted(os.listdir(directory)):
+        is_shard = name.startswith("shard-") and any(name.endswith(ext) or name.endswith(ext + ".tmp")
+                                                      for ext in FORMATS.values())
+        if is_shard and name not in keep_files:
+            os.remove(os.path.join(directory, name))
+            removed.append(name)
+    return removed
+
+
+def iter_shard(path: str, batch_size: int = 1000) -> Iterator[Dict]:
+    """Yield the records of a single shard lazily."""
+    if path.endswith(FORMATS["parquet"]):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+            yield from batch.to_pylist()
+    elif path.endswith(FORMATS["jsonl"]):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        raise ValueError(f"Unrecognised shard file: {path}")
+
+
+def iter_records(directory: str) -> Iterator[Dict]:
+    """Yield every record of a sharded dataset, in shard order."""
+    manifest = load_manifest(directory)
+    if manifest is None:
+        raise FileNotFoundError(f"No {MANIFEST_NAME} in {directory}; run: python download_dataset.py")
+    for entry in manifest["shards"]:
+        yield from iter_shard(os.path.join(directory, entry["file"]))
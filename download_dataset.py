@@ -1,44 +1,92 @@
 """
 Download mental health counseling dataset and save locally
+
+Writes compressed shards plus a manifest (row counts, checksums) to
+./dataset/mental_health_counseling/. Shards that are already present and
+match the manifest are skipped, so an interrupted download resumes.
+
+Run:
+    python download_dataset.py
+    python download_dataset.py --format jsonl --shard-size 500
 """
 import os
+import argparse
 from datasets import load_dataset
-import json
-
-print("=" * 60)
-print("Downloading Mental Health Counseling Dataset...")
-print("=" * 60)
-
-# Create dataset directory
-os.makedirs("./dataset", exist_ok=True)
-
-# Download from HuggingFace
-print("\nDownloading from HuggingFace...")
-dataset = load_dataset("Amod/mental_health_counseling_conversations")
-
-print(f"✅ Downloaded {len(dataset['train'])} conversations!")
-
-# Save as JSON for easy access
-output_file = "./dataset/mental_health_counseling.json"
-print(f"\nSaving to {output_file}...")
-
-# Convert to list of dictionaries
-data_list = []
-for example in dataset['train']:
-    data_list.append({
-        'context': example['Context'],
-        'response': example['Response']
-    })
-
-# Save as JSON
-with open(output_file, 'w', encoding='utf-8') as f:
-    json.dump(data_list, f, indent=2, ensure_ascii=False)
-
-print(f"✅ Saved {len(data_list)} conversations to dataset folder!")
-print("\nDataset info:")
-print(f"  - File: {output_file}")
-print(f"  - Size: {len(data_list)} question-answer pairs")
-print(f"  - Format: JSON with 'context' and 'response' keys")
-print("\n" + "=" * 60)
-print("Dataset download complete!")
-print("=" * 60)
+from dataset_shards import (FORMATS, load_manifest, remove_stale_shards, save_manifest,
+                            shard_is_valid, shard_name, write_shard)
+
+DATASET_NAME = "Amod/mental_health_counseling_conversations"
+OUTPUT_DIR = "./dataset/mental_health_counseling"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download the counseling dataset as sharded files.")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="parquet")
+    parser.add_argument("--shard-size", type=int, default=1000, help="rows per shard")
+    parser.add_argument("--out", default=OUTPUT_DIR)
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("Downloading Mental Health Counseling Dataset...")
+    print("=" * 60)
+
+    # Create dataset directory
+    os.makedirs(args.out, exist_ok=True)
+
+    # Download from HuggingFace
+    print("\nDownloading from HuggingFace...")
+    dataset = load_dataset(DATASET_NAME)["train"]
+
+    print(f"✅ Downloaded {len(dataset)} conversations!")
+
+    # Only reuse shards written with the same layout
+    layout = {"source": DATASET_NAME, "format": args.format, "shard_size": args.shard_size}
+    manifest = load_manifest(args.out)
+    if manifest is None or any(manifest.get(k) != v for k, v in layout.items()):
+        manifest = {**layout, "shards": []}
+    existing = {entry["file"]: entry for entry in manifest["shards"]}
+
+    print(f"\nSaving {args.format} shards to {args.out}...")
+    shards = []
+    written = skipped = 0
+    for index, start in enumerate(range(0, len(dataset), args.shard_size)):
+        end = min(start + args.shard_size, len(dataset))
+        entry = existing.get(shard_name(index, args.format))
+        if entry and entry["rows"] == end - start and shard_is_valid(args.out, entry):
+            shards.append(entry)
+            skipped += 1
+            continue
+
+        # Convert to list of dictionaries
+        chunk = dataset.select(range(start, end))
+        records = [
+            {"context": example["Context"], "response": example["Response"]}
+            for example in chunk
+        ]
+        shards.append(write_shard(args.out, index, records, args.format))
+        written += 1
+        # persist progress after every shard so a crash loses at most one shard;
+        # "complete" stays False until every shard is written, so readers refuse a partial export
+        save_manifest(args.out, {**manifest, "shards": shards, "total_rows": sum(s["rows"] for s in shards),
+                                 "complete": False})
+        print(f"  - {shards[-1]['file']}: {shards[-1]['rows']} rows")
+
+    manifest = {**manifest, "shards": shards, "total_rows": sum(s["rows"] for s in shards)}
+    manifest["complete"] = manifest["total_rows"] == len(dataset)
+    save_manifest(args.out, manifest)
+    # shards beyond the new count (or in another format) would otherwise linger next to the manifest
+    removed = remove_stale_shards(args.out, shards)
+
+    print(f"✅ Saved {manifest['total_rows']} conversations to dataset folder!")
+    print("\nDataset info:")
+    print(f"  - Directory: {args.out}")
+    print(f"  - Shards: {len(shards)} ({written} written, {skipped} already valid, {len(removed)} stale removed)")
+    print(f"  - Size: {manifest['total_rows']} question-answer pairs")
+    print(f"  - Format: {args.format} with 'context' and 'response' keys")
+    print("\n" + "=" * 60)
+    print("Dataset download complete!")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
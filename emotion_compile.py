@@ -0,0 +1,215 @@
+# emotion_compile.py
+"""
+Static-shape emotion classifier: inputs are padded to a few fixed sequence-length
+buckets so each bucket can run a TorchScript-traced or torch.compile'd graph.
+
+- "trace":   one frozen torch.jit.trace per bucket (batch size stays dynamic)
+- "compile": torch.compile(dynamic=False), one specialised graph per bucket/batch shape;
+  the batch is padded up to a power-of-two batch bucket (up to max_batch_size), so
+  only a handful of batch shapes ever reach the graph
+- inputs longer than the largest bucket fall back to the eager model
+
+Graphs are built for every length and batch bucket in warmup(), so no request
+(single, micro-batched or /chat/batch) pays for compilation.
+app.py enables this with EMOTION_COMPILE=trace (or compile).
+
+Latency comparison against eager mode:
+    python emotion_compile.py
+    python emotion_compile.py --model ./models/emotion_detector_small --modes trace compile
+"""
+
+import os
+import time
+import argparse
+import statistics
+from typing import Dict, List, Optional
+
+import torch
+
+LENGTH_BUCKETS = (16, 32, 64, 128)
+COMPILE_MODES = ("eager", "trace", "compile")
+
+
+class LogitsOnly(torch.nn.Module):
+    """Tensor-in, tensor-out wrapper so the HF model can be traced."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask, return_dict=False)[0]
+
+
+def batch_buckets(max_batch_size: int) -> tuple:
+    """Powers of two below max_batch_size, plus max_batch_size itself."""
+    sizes = []
+    size = 1
+    while size < max_batch_size:
+        sizes.append(size)
+        size *= 2
+    return tuple(sizes) + (max(1, max_batch_size),)
+
+
+def bucket_for(length: int, buckets=LENGTH_BUCKETS) -> Optional[int]:
+    """Smallest bucket that fits length tokens, or None if it is longer than all of them."""
+    for bucket in buckets:
+        if length <= bucket:
+            return bucket
+    return None
+
+
+class BucketedEmotionModel:
+    def __init__(self, model, tokenizer, mode: str = "trace", buckets=LENGTH_BUCKETS, device="cpu",
+                 max_batch_size: int = 64):
+        if mode not in ("trace", "compile"):
+            raise ValueError(f"Unknown compile mode: {mode} (expected 'trace' or 'compile')")
+        self.model = model.eval()
+        self.tokenizer = tokenizer
+        self.mode = mode
+        self.buckets = tuple(sorted(buckets))
+        self.device = device
+        # traced graphs take any batch size; compiled ones are specialised to each batch bucket
+        self.batch_buckets = batch_buckets(max_batch_size) if mode == "compile" else (1,)
+        self.graphs: Dict[int, torch.nn.Module] = {}
+        self._compiled = None
+        if mode == "compile":
+            # every shape is a recompile of the same forward; let all of them stay compiled
+            config = torch._dynamo.config
+            name = "recompile_limit" if hasattr(config, "recompile_limit") else "cache_size_limit"
+            setattr(config, name, max(getattr(config, name), len(self.buckets) * len(self.batch_buckets)))
+            self._compiled = torch.compile(LogitsOnly(self.model), dynamic=False)
+
+    def _pad(self, ids: List[List[int]], length: int):
+        batch = self.tokenizer.pad({"input_ids": ids}, padding="max_length", max_length=length,
+                                   return_tensors="pt")
+        return batch["input_ids"].to(self.device), batch["attention_mask"].to(self.device)
+
+    def _graph(self, bucket: int):
+        if bucket not in self.graphs:
+            if self.mode == "trace":
+                example = self._pad([[self.tokenizer.cls_token_id or 0]], bucket)
+                with torch.no_grad():
+                    traced = torch.jit.trace(LogitsOnly(self.model), example, check_trace=False)
+                self.graphs[bucket] = torch.jit.freeze(traced.eval())
+            else:
+                self.graphs[bucket] = self._compiled
+        return self.graphs[bucket]
+
+    def warmup(self, batch_sizes=None):
+        """Build (and run once) the graph for every bucket and batch size (default: every batch bucket)."""
+        for bucket in self.buckets:
+            graph = self._graph(bucket)
+            for size in batch_sizes or self.batch_buckets:
+                input_ids, attention_mask = self._pad([[self.tokenizer.cls_token_id or 0]] * size, bucket)
+                with torch.no_grad():
+                    graph(input_ids, attention_mask)
+
+    def logits(self, texts: List[str]) -> torch.Tensor:
+        """Logits for texts in input order; each text runs in the smallest bucket that fits it."""
+        ids = self.tokenizer(texts, truncation=True)["input_ids"]
+        groups: Dict[Optional[int], List[int]] = {}
+        for i, seq in enumerate(ids):
+            groups.setdefault(bucket_for(len(seq), self.buckets), []).append(i)
+
+        out = [None] * len(texts)
+        with torch.no_grad():
+            for bucket, indices in groups.items():
+                rows = [ids[i] for i in indices]
+                if bucket is None:
+                    input_ids, attention_mask = self._pad(rows, max(len(r) for r in rows))
+                    logits = self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+                else:
+                    logits = self._bucketed_logits(rows, bucket)
+                for i, row in zip(indices, logits):
+                    out[i] = row
+        return torch.stack(out)
+
+
+    def _bucketed_logits(self, rows: List[List[int]], bucket: int) -> torch.Tensor:
+        """Run rows through the bucket's graph, padding the batch to a warmed-up batch bucket."""
+        if self.mode != "compile":
+            return self._graph(bucket)(*self._pad(rows, bucket))
+        largest = self.batch_buckets[-1]
+        chunks = []
+        for start in range(0, len(rows), largest):
+            chunk = rows[start:start + largest]
+            size = next(b for b in self.batch_buckets if b >= len(chunk))
+            filler = [[self.tokenizer.cls_token_id or 0]] * (size - len(chunk))
+            chunks.append(self._graph(bucket)(*self._pad(chunk + filler, bucket))[:len(chunk)])
+        return torch.cat(chunks)
+
+
+def eager_logits(model, tokenizer, texts, device="cpu"):
+    """What app.detect_emotions does without compilation: pad to the longest input."""
+    inputs = tokenizer(texts, return_tensors="pt", truncation=True, padding=True).to(device)
+    with torch.no_grad():
+        return model(**inputs).logits
+
+
+def text_of_length(tokenizer, n_tokens: int) -> str:
+    """A message that tokenizes to roughly n_tokens (including special tokens)."""
+    words = "i have been feeling really tired and anxious about everything lately".split()
+    text = ""
+    i = 0
+    while len(tokenizer(text + words[i % len(words)])["input_ids"]) <= n_tokens:
+        text += words[i % len(words)] + " "
+        i += 1
+    return text.strip()
+
+
+def time_ms(fn, repeats):
+    fn()
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        times.append(1000 * (time.perf_counter() - t0))
+    return statistics.median(times)
+
+
+def main():
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+    parser = argparse.ArgumentParser(description="Compare bucketed compiled emotion inference with eager mode.")
+    parser.add_argument("--model", default=os.getenv("EMOTION_MODEL_DIR", "./models/emotion_detector"))
+    parser.add_argument("--modes", nargs="+", choices=COMPILE_MODES[1:], default=["trace", "compile"])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 16])
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModelForSequenceClassification.from_pretrained(args.model).eval()
+    # lengths that land just above the middle of each bucket, so eager pads less than the bucket does
+    lengths = [max(4, b - b // 4) for b in LENGTH_BUCKETS]
+    samples = {n: text_of_length(tokenizer, n) for n in lengths}
+
+    print("=" * 70)
+    print(f"Emotion model latency: {args.model}")
+    print("=" * 70)
+
+    runners = {"eager": lambda texts: eager_logits(model, tokenizer, texts)}
+    for mode in args.modes:
+        bucketed = BucketedEmotionModel(model, tokenizer, mode=mode, max_batch_size=max(args.batch_sizes))
+        t0 = time.perf_counter()
+        bucketed.warmup()
+        print(f"{mode} warm-up: {time.perf_counter() - t0:.1f}s for {len(LENGTH_BUCKETS)} buckets")
+        # check the bucketed outputs against eager before timing them
+        texts = list(samples.values())
+        diff = (bucketed.logits(texts) - eager_logits(model, tokenizer, texts)).abs().max().item()
+        print(f"{mode} max |logit diff| vs eager: {diff:.2e}")
+        runners[mode] = bucketed.logits
+
+    print(f"\n{'tokens':>7}{'batch':>7}" + "".join(f"{name + ' ms':>14}" for name in runners)
+          + "".join(f"{'speedup ' + name:>18}" for name in runners if name != "eager"))
+    for n, text in samples.items():
+        for size in args.batch_sizes:
+            texts = [text] * size
+            ms = {name: time_ms(lambda: fn(texts), args.repeats) for name, fn in runners.items()}
+            print(f"{n:>7}{size:>7}" + "".join(f"{ms[name]:>14.2f}" for name in runners)
+                  + "".join(f"{ms['eager'] / ms[name]:>17.2f}x" for name in runners if name != "eager"))
+    print("=" * 70)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,19 +3,41 @@
 Fine-tune DialoGPT to respond with emotion+context conditioning.
 Saves model/tokenizer to ./models/response_model
 
+Data modes (--mode):
+    pad    every prompt padded to MAX_LENGTH (original behaviour)
+    group  no up-front padding; batches of similar length, padded per batch
+    pack   prompts joined with EOS into full MAX_LENGTH-token blocks
+
 Run:
     python fine_tune_response.py
+    python fine_tune.py --mode pack
+    python fine_tune.py --compare-modes --epochs 1   # tokens/sec + epoch time for all modes
+
+The corpus (shards from download_dataset.py, or the legacy JSON file) is
+streamed into a memory-mapped Arrow cache under ./dataset/cache,
+keyed by tokenizer, PROMPT_FORMAT_VERSION and data mode; reruns skip tokenization.
 """
 
 import os
-from datasets import load_dataset
+import json
+import time
+import hashlib
+import argparse
+from datasets import load_dataset, Dataset
 from transformers import (AutoTokenizer, AutoModelForCausalLM, Trainer, TrainingArguments)
-from transformers import DataCollatorForLanguageModeling
+from transformers import DataCollatorForLanguageModeling, TrainerCallback, default_data_collator
 import math
+import dataset_shards
+import model_registry
 
 MODEL_NAME = "microsoft/DialoGPT-small"
 OUT_DIR = "./models/response_model"
 MAX_LENGTH = 128
+DATA_MODES = ("pad", "group", "pack")
+DATASET_DIR = "./dataset/mental_health_counseling"          # sharded export from download_dataset.py
+LEGACY_DATASET_FILE = "./dataset/mental_health_counseling.json"  # single JSON array from older downloads
+TOKENIZED_CACHE_DIR = "./dataset/cache"
+PROMPT_FORMAT_VERSION = 1
 
 def build_prompt(example):
     # Handle different dataset formats
@@ -104,88 +126,271 @@ def create_synthetic_dataset():
         "context": [d["context"] for d in synthetic_data]
     })
 
-def main():
-    os.makedirs(OUT_DIR, exist_ok=True)
-    
-    print("=" * 70)
-    print("Loading REAL Mental Health Counseling Dataset from local file...")
-    print("=" * 70)
-    
-    # Check if dataset file exists
-    dataset_file = "./dataset/mental_health_counseling.json"
-    if not os.path.exists(dataset_file):
-        print("\n❌ ERROR: Dataset file not found!")
-        print(f"   Expected: {dataset_file}")
-        print("\n➜ Please run first: python download_dataset.py")
-        print("=" * 70)
-        return
-    
-    # Load from local JSON file
-    import json
-    with open(dataset_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    print(f"✅ Loaded {len(data)} real counseling conversations!")
-    
-    # Split into train/validation (90/10)
-    split_idx = int(len(data) * 0.9)
-    train_data = data[:split_idx]
-    val_data = data[split_idx:]
-    
-    print(f"\nTraining set: {len(train_data)} examples")
-    print(f"Validation set: {len(val_data)} examples")
-    
-    # Convert to training prompts
-    print("\nConverting to training format...")
-    train_prompts = []
-    for example in train_data:
-        context = example['context']
-        response = example['response']
-        # Simple prompt format for mental health conversations
-        prompt = f"User: {context}\nBot: {response}"
-        train_prompts.append(prompt)
-    
-    val_prompts = []
-    for example in val_data:
-        context = example['context']
-        response = example['response']
-        prompt = f"User: {context}\nBot: {response}"
-        val_prompts.append(prompt)
-    
-    print(f"✅ Created {len(train_prompts)} training prompts!")
+def pack_examples(input_ids_list, eos_token_id, pad_token_id, block_size=MAX_LENGTH):
+    """
+    Concatenate tokenized examples, each terminated by EOS, into block_size blocks.
 
-    print("Loading tokenizer & model...")
+    Labels mirror input_ids except that the first token of every example that
+    follows an EOS is masked (-100): it can't be predicted from an unrelated
+    previous example. The trailing partial block is padded and its padding masked.
+    """
+    stream = []
+    for ids in input_ids_list:
+        stream.extend(ids)
+        stream.append(eos_token_id)
+
+    blocks = {"input_ids": [], "attention_mask": [], "labels": []}
+    for start in range(0, len(stream), block_size):
+        ids = stream[start:start + block_size]
+        labels = list(ids)
+        for i in range(1, len(ids)):
+            if ids[i - 1] == eos_token_id:
+                labels[i] = -100
+        n_pad = block_size - len(ids)
+        blocks["input_ids"].append(ids + [pad_token_id] * n_pad)
+        blocks["attention_mask"].append([1] * len(ids) + [0] * n_pad)
+        blocks["labels"].append(labels + [-100] * n_pad)
+    return blocks
+
+
+def tokenize_fn(tokenizer, mode="pad"):
+    """Return a batched map function turning {"prompt": [...]} into model inputs for the given data mode."""
+    if mode == "pad":
+        def fn(batch):
+            return tokenizer(batch["prompt"], truncation=True, padding="max_length", max_length=MAX_LENGTH)
+    elif mode == "group":
+        # padded per batch by the collator; group_by_length keeps batches tight
+        def fn(batch):
+            return tokenizer(batch["prompt"], truncation=True, max_length=MAX_LENGTH)
+    elif mode == "pack":
+        # leave room for the EOS separator appended to every example;
+        # packing happens per map batch, so only one partial block per batch is padded
+        def fn(batch):
+            ids = tokenizer(batch["prompt"], truncation=True, max_length=MAX_LENGTH - 1)["input_ids"]
+            return pack_examples(ids, tokenizer.eos_token_id, tokenizer.pad_token_id)
+    else:
+        raise ValueError(f"Unknown data mode: {mode} (expected one of {DATA_MODES})")
+    return fn
+
+
+def collator_for(mode, tokenizer):
+    if mode == "pack":
+        return default_data_collator  # labels are already masked
+    return DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False)
+
+
+def iter_json_array(path, chunk_size=1 << 20):
+    """Yield the objects of a top-level JSON array one at a time without loading the whole file."""
+    decoder = json.JSONDecoder()
+    buf = ""
+    started = False
+    with open(path, "r", encoding="utf-8") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            buf += chunk
+            pos = 0
+            while True:
+                while pos < len(buf) and (buf[pos].isspace() or buf[pos] in ",]" or (buf[pos] == "[" and not started)):
+                    started = started or buf[pos] == "["
+                    pos += 1
+                if pos >= len(buf):
+                    break
+                try:
+                    obj, end = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    if not chunk:
+                        raise
+                    break  # object continues in the next chunk
+                yield obj
+                pos = end
+            buf = buf[pos:]
+            if not chunk:
+                return
+
+
+def format_prompt(example):
+    # Simple prompt format for mental health conversations.
+    # Bump PROMPT_FORMAT_VERSION whenever this changes so cached tokenizations are rebuilt.
+    return f"User: {example['context']}\nBot: {example['response']}"
+
+
+def dataset_source():
+    """Prefer a complete sharded export; fall back to the legacy single JSON file. None if neither exists."""
+    manifest = dataset_shards.load_manifest(DATASET_DIR)
+    if manifest is not None:
+        if manifest.get("complete"):
+            return DATASET_DIR
+        # an interrupted download: training on it would silently use part of the corpus
+        print(f"⚠️  {DATASET_DIR} holds a partial download ({manifest.get('total_rows', 0)} rows); "
+              "run python download_dataset.py again to finish it")
+    if os.path.exists(LEGACY_DATASET_FILE):
+        return LEGACY_DATASET_FILE
+    return None
+
+
+def iter_records(source):
+    """Stream raw {"context", "response"} records from a shard directory or a JSON array file."""
+    if os.path.isdir(source):
+        return dataset_shards.iter_records(source)
+    return iter_json_array(source)
+
+
+def source_fingerprint(source):
+    """Changes whenever the underlying data does: shard checksums, or size/mtime for a single file."""
+    if os.path.isdir(source):
+        manifest = dataset_shards.load_manifest(source)
+        parts = [os.path.abspath(source)] + [shard["sha256"] for shard in manifest["shards"]]
+    else:
+        stat = os.stat(source)
+        parts = [os.path.abspath(source), stat.st_size, int(stat.st_mtime)]
+    # a string, not a list: datasets would treat a list in gen_kwargs as generator shards
+    return hashlib.sha1(json.dumps(parts).encode()).hexdigest()
+
+
+def iter_prompts(source, fingerprint=None):
+    # fingerprint only feeds the datasets cache hash so changed data invalidates the raw Arrow table
+    for example in iter_records(source):
+        yield {"prompt": format_prompt(example)}
+
+
+def cache_key(tokenizer, mode, source):
+    """Key for the tokenized cache: tokenizer, prompt format version, data mode and source data."""
+    key = {
+        "tokenizer": tokenizer.name_or_path,
+        "vocab_size": len(tokenizer),
+        "pad_token": tokenizer.pad_token,
+        "prompt_format": PROMPT_FORMAT_VERSION,
+        "max_length": MAX_LENGTH,
+        "mode": mode,
+        "source": source_fingerprint(source),
+    }
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def load_tokenized_splits(tokenizer, mode="pad", source=None, val_fraction=0.1):
+    """
+    Return memory-mapped (train, validation) datasets for the given data mode.
+
+    The corpus (shards or JSON array) is streamed record by record into an on-disk Arrow table and
+    tokenized into Arrow files under TOKENIZED_CACHE_DIR/<cache key>/. Reruns with
+    the same tokenizer, prompt format and mode map those files straight back in.
+    """
+    source = source or dataset_source()
+    cache_dir = os.path.join(TOKENIZED_CACHE_DIR, cache_key(tokenizer, mode, source))
+    paths = {split: os.path.join(cache_dir, f"{split}.arrow") for split in ("train", "validation")}
+    if all(os.path.exists(path) for path in paths.values()):
+        print(f"✅ Using cached tokenized dataset: {cache_dir}")
+        return Dataset.from_file(paths["train"]), Dataset.from_file(paths["validation"])
+
+    os.makedirs(cache_dir, exist_ok=True)
+    print(f"Streaming {source} into Arrow...")
+    raw = Dataset.from_generator(
+        iter_prompts,
+        gen_kwargs={"source": source, "fingerprint": source_fingerprint(source)},
+        cache_dir=os.path.join(TOKENIZED_CACHE_DIR, "raw"),
+    )
+    print(f"✅ Loaded {len(raw)} real counseling conversations!")
+
+    # Split into train/validation (90/10), preserving file order
+    split_idx = int(len(raw) * (1 - val_fraction))
+    splits = {"train": raw.select(range(split_idx)), "validation": raw.select(range(split_idx, len(raw)))}
+    print(f"\nTraining set: {len(splits['train'])} examples")
+    print(f"Validation set: {len(splits['validation'])} examples")
+
+    print(f"Tokenizing (mode: {mode}) into {cache_dir}...")
+    fn = tokenize_fn(tokenizer, mode)
+    tokenized = {}
+    for split, ds in splits.items():
+        tokenized[split] = ds.map(fn, batched=True, remove_columns=ds.column_names,
+                                  cache_file_name=paths[split], desc=f"Tokenizing {split}")
+    return tokenized["train"], tokenized["validation"]
+
+
+def count_tokens(dataset, batch_size=1000):
+    """Sum attention masks batch by batch so the column never has to fit in memory."""
+    total = 0
+    for batch in dataset.iter(batch_size=batch_size):
+        total += sum(sum(mask) for mask in batch["attention_mask"])
+    return total
+
+
+class ThroughputCallback(TrainerCallback):
+    """Records wall-clock time per epoch and real (non-pad) training tokens/sec."""
+
+    def __init__(self, tokens_per_epoch):
+        self.tokens_per_epoch = tokens_per_epoch
+        self.epoch_times = []
+        self._start = None
+
+    def on_epoch_begin(self, args, state, control, **kwargs):
+        self._start = time.perf_counter()
+
+    def on_epoch_end(self, args, state, control, **kwargs):
+        elapsed = time.perf_counter() - self._start
+        self.epoch_times.append(elapsed)
+        print(f"\n⏱  Epoch {len(self.epoch_times)}: {elapsed:.1f}s, "
+              f"{self.tokens_per_epoch / elapsed:.0f} tokens/sec")
+
+    def summary(self):
+        mean_epoch = sum(self.epoch_times) / len(self.epoch_times) if self.epoch_times else float("nan")
+        return {
+            "epoch_seconds": mean_epoch,
+            "tokens_per_sec": self.tokens_per_epoch / mean_epoch if self.epoch_times else float("nan"),
+        }
+
+
+def load_tokenizer():
     tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
     # ensure tokenizer has pad token
     if tokenizer.pad_token is None:
         tokenizer.add_special_tokens({"pad_token": "[PAD]"})
+    return tokenizer
+
+
+def load_tokenizer_and_model():
+    tokenizer = load_tokenizer()
     model = AutoModelForCausalLM.from_pretrained(MODEL_NAME)
     model.resize_token_embeddings(len(tokenizer))
+    return tokenizer, model
 
-    print("Tokenizing...")
-    train_enc = tokenizer(train_prompts, truncation=True, padding=True, max_length=MAX_LENGTH)
-    val_enc = tokenizer(val_prompts, truncation=True, padding=True, max_length=MAX_LENGTH)
 
-    # convert to dataset objects (datasets.Dataset)
-    from datasets import Dataset
-    train_dataset = Dataset.from_dict(train_enc)
-    val_dataset = Dataset.from_dict(val_enc)
+def train(source=None, mode="pad", epochs=3, output_dir="./runs/response",
+          learning_rate=5e-5, batch_size=4, eval_steps=500, max_train_examples=None,
+          callbacks=None, save_checkpoints=True):
+    """
+    Fine-tune a fresh copy of MODEL_NAME with the given data mode. Returns (trainer, tokenizer, throughput).
 
-    data_collator = DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False)
+    max_train_examples keeps only the first N training sequences (used by hyperparameter search).
+    """
+    print("Loading tokenizer & model...")
+    tokenizer, model = load_tokenizer_and_model()
+
+    train_dataset, val_dataset = load_tokenized_splits(tokenizer, mode, source)
+    if max_train_examples:
+        train_dataset = train_dataset.select(range(min(max_train_examples, len(train_dataset))))
+    data_collator = collator_for(mode, tokenizer)
+
+    real_tokens = count_tokens(train_dataset)
+    positions = real_tokens if mode == "group" else len(train_dataset) * len(train_dataset[0]["input_ids"])
+    print(f"  - {len(train_dataset)} training sequences, {real_tokens} real tokens, "
+          f"~{real_tokens / max(positions, 1):.0%} of processed positions are real tokens")
+    throughput = ThroughputCallback(real_tokens)
 
     training_args = TrainingArguments(
-        output_dir="./runs/response",
+        output_dir=output_dir,
         overwrite_output_dir=True,
-        num_train_epochs=3,
-        per_device_train_batch_size=4,
+        num_train_epochs=epochs,
+        per_device_train_batch_size=batch_size,
         per_device_eval_batch_size=8,
-        eval_steps=500,
+        eval_steps=eval_steps,
         eval_strategy="steps",
+        save_strategy="steps" if save_checkpoints else "no",
         save_steps=1000,
         save_total_limit=2,
-        learning_rate=5e-5,
+        learning_rate=learning_rate,
         logging_steps=100,
         fp16=False,
+        group_by_length=(mode == "group"),
     )
 
     trainer = Trainer(
@@ -194,34 +399,93 @@ def main():
         train_dataset=train_dataset,
         eval_dataset=val_dataset,
         data_collator=data_collator,
+        callbacks=[throughput] + list(callbacks or []),
     )
 
+    trainer.train()
+    return trainer, tokenizer, throughput.summary()
+
+
+def compare_modes(source=None, epochs=1):
+    """Train once per data mode and print tokens/sec and wall-clock per epoch side by side."""
+    results = {}
+    for mode in DATA_MODES:
+        print("\n" + "=" * 70)
+        print(f"Benchmarking data mode: {mode}")
+        print("=" * 70)
+        _, _, results[mode] = train(source, mode, epochs, f"./runs/response_{mode}")
+
+    print("\n" + "=" * 70)
+    print(f"{'mode':<8}{'tokens/sec':>14}{'sec/epoch':>12}")
+    for mode, r in results.items():
+        print(f"{mode:<8}{r['tokens_per_sec']:>14.0f}{r['epoch_seconds']:>12.1f}")
+    print("=" * 70)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Fine-tune the response model.")
+    parser.add_argument("--mode", choices=DATA_MODES, default="pad",
+                        help="how training sequences are padded/packed")
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--lr", type=float, default=5e-5, help="learning rate")
+    parser.add_argument("--batch-size", type=int, default=4, help="train batch size")
+    parser.add_argument("--no-register", action="store_true",
+                        help="don't add the saved model to the model registry")
+    parser.add_argument("--compare-modes", action="store_true",
+                        help="train once per data mode and report tokens/sec and time per epoch")
+    args = parser.parse_args()
+
+    os.makedirs(OUT_DIR, exist_ok=True)
+    
+    print("=" * 70)
+    print("Loading REAL Mental Health Counseling Dataset from local file...")
+    print("=" * 70)
+    
+    source = dataset_source()
+    if source is None:
+        print("\n❌ ERROR: Dataset file not found!")
+        print(f"   Expected: {DATASET_DIR}/ (or legacy {LEGACY_DATASET_FILE})")
+        print("\n➜ Please run first: python download_dataset.py")
+        print("=" * 70)
+        return
+
+    if args.compare_modes:
+        compare_modes(source, args.epochs)
+        return
+
     print("\n" + "=" * 70)
     print("Starting Training on REAL Mental Health Data...")
     print("=" * 70)
     print("Training Details:")
     print(f"  - Dataset: Amod/mental_health_counseling_conversations")
-    print(f"  - Training examples: {len(train_prompts)}")
-    print(f"  - Validation examples: {len(val_prompts)}")
-    print(f"  - Epochs: 3")
+    print(f"  - Epochs: {args.epochs}")
+    print(f"  - Data mode: {args.mode}")
     print(f"  - Model: {MODEL_NAME}")
     print(f"\nThis will take approximately 30-60 minutes...")
     print("You'll see much better responses than synthetic data!")
     print("=" * 70 + "\n")
     
-    trainer.train()
+    trainer, tokenizer, throughput = train(source, args.mode, args.epochs,
+                                           learning_rate=args.lr, batch_size=args.batch_size)
     
     print("\n" + "=" * 70)
     print("✅ Training Complete!")
     print("=" * 70)
+    print(f"Throughput: {throughput['tokens_per_sec']:.0f} tokens/sec, "
+          f"{throughput['epoch_seconds']:.1f}s per epoch")
     print(f"Saving model to: {OUT_DIR}")
     
     trainer.save_model(OUT_DIR)
     tokenizer.save_pretrained(OUT_DIR)
     
     print("\n✅ Model saved successfully!")
+    if not args.no_register:
+        version = model_registry.register("response", OUT_DIR, metadata={"mode": args.mode, "epochs": args.epochs})
+        print(f"Registered as response model {version} (now active)")
     print("\nNext steps:")
-    print("  1. Restart your backend server")
+    print("  1. Swap it into the running server (no restart needed):")
+    print("     curl -X POST localhost:8000/admin/models/response/activate -H \"X-Admin-Token: $ADMIN_TOKEN\" "
+          "-H 'Content-Type: application/json' -d '{}'")
     print("  2. Test the chatbot")
     print("  3. Responses should be MUCH better now!")
     print("=" * 70)
@@ -36,6 +36,9 @@ function App() {
   const [sessionId] = useState(() => `session_${Date.now()}_${Math.random().toString(36).substr(2, 9)}`)
   const [showDisclaimer, setShowDisclaimer] = useState(true)
   const messagesEndRef = useRef(null)
+  const socketRef = useRef(null)
+  const pendingRef = useRef(new Map())  // message id -> { resolve, reject }
+  const nextIdRef = useRef(1)
 
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' })
@@ -55,6 +58,73 @@ function App() {
     }])
   }, [])
 
+  // Persistent chat channel (/ws/chat); messages fall back to POST /chat while it is down
+  useEffect(() => {
+    let closed = false
+    let retryDelay = 1000
+    let retryTimer = null
+
+    const connect = () => {
+      const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws'
+      const socket = new WebSocket(`${protocol}://${window.location.host}/ws/chat?session_id=${encodeURIComponent(sessionId)}`)
+
+      socket.onopen = () => {
+        retryDelay = 1000
+      }
+      socket.onmessage = (event) => {
+        const frame = JSON.parse(event.data)
+        if (frame.type === 'ping') {
+          socket.send(JSON.stringify({ type: 'pong' }))
+          return
+        }
+        const pending = pendingRef.current.get(frame.id)
+        if (!pending) return
+        pendingRef.current.delete(frame.id)
+        if (frame.type === 'reply') {
+          pending.resolve(frame)
+        } else {
+          pending.reject(new Error(frame.detail))
+        }
+      }
+      socket.onclose = () => {
+        if (socketRef.current !== socket) return
+        socketRef.current = null
+        pendingRef.current.forEach(({ reject }) => reject(new Error('Connection closed')))
+        pendingRef.current.clear()
+        if (!closed) {
+          // reconnect with exponential backoff
+          retryTimer = setTimeout(connect, retryDelay)
+          retryDelay = Math.min(retryDelay * 2, 30000)
+        }
+      }
+      socketRef.current = socket
+    }
+
+    connect()
+    return () => {
+      closed = true
+      clearTimeout(retryTimer)
+      const socket = socketRef.current
+      socketRef.current = null
+      socket?.close()
+    }
+  }, [sessionId])
+
+  const requestReply = (text) => {
+    const socket = socketRef.current
+    if (!socket || socket.readyState !== WebSocket.OPEN) {
+      return axios.post('/chat', {
+        session_id: sessionId,
+        message: text
+      }).then(response => response.data)
+    }
+    return new Promise((resolve, reject) => {
+      const id = nextIdRef.current++
+      pendingRef.current.set(id, { resolve, reject })
+      socket.send(JSON.stringify({ type: 'message', id, message: text }))
+    })
+  }
+
   const sendMessage = async () => {
     if (!inputText.trim() || isLoading) return
 
@@ -69,16 +139,13 @@ function App() {
     setIsLoading(true)
 
     try {
-      const response = await axios.post('/chat', {
-        session_id: sessionId,
-        message: inputText
-      })
+      const reply = await requestReply(inputText)
 
       const botMessage = {
         type: 'bot',
-        text: response.data.response,
-        emotion: response.data.emotion,
-        crisis: response.data.crisis,
+        text: reply.response,
+        emotion: reply.emotion,
+        crisis: reply.crisis,
         timestamp: new Date()
       }
 
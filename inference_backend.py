@@ -0,0 +1,152 @@
+# inference_backend.py
+"""
+Inference backends: what app.py needs from a model runtime.
+
+app.py serves emotion detection and reply generation through one backend,
+chosen at startup with INFERENCE_BACKEND:
+
+- "torch": the transformers models (see torch_backend.py); the default
+- "fake": deterministic keyword emotions and template replies, with optional
+  artificial latency; needs no model files and doesn't import torch, so the
+  API tests and serving benchmarks start in about a second:
+
+      INFERENCE_BACKEND=fake FAKE_BACKEND_LATENCY_MS=20 FAKE_BACKEND_PER_TOKEN_MS=0.1 uvicorn app:app
+
+A backend loads model versions into model_registry.LoadedModel objects (so the
+registry, hot swaps and draining work the same for every backend) and runs
+batched forward passes on them.
+"""
+
+import os
+import abc
+import time
+import zlib
+from typing import Dict, List
+
+from model_registry import LoadedModel
+
+BACKENDS = ("torch", "fake")
+
+# If emotion model labels are unknown, use common order for dair-ai/emotion
+EMOTION_LABELS = ["anger", "fear", "joy", "love", "sadness", "surprise"]
+
+
+class InferenceBackend(abc.ABC):
+    """
+    Interface implemented by every backend. Texts and prompts always come in
+    batches; the caller splits them to the configured batch sizes.
+    """
+
+    name = "base"
+
+    @abc.abstractmethod
+    def load(self, kind: str, version: str, path: str) -> LoadedModel:
+        """Load and warm up one version of a model kind ("emotion" or "response")."""
+
+    @abc.abstractmethod
+    def emotion_probabilities(self, loaded: LoadedModel, texts: List[str]) -> List[List[float]]:
+        """Per-text probabilities over EMOTION_LABELS (in that order)."""
+
+    @abc.abstractmethod
+    def generate(self, loaded: LoadedModel, prompts: List[str], candidates: int, max_new_tokens: int,
+                 **sampling) -> List[str]:
+        """candidates replies per prompt, grouped per prompt: all of prompt 0's first, then prompt 1's, ..."""
+
+    @abc.abstractmethod
+    def count_tokens(self, loaded: LoadedModel, text: str) -> int:
+        """Prompt length in tokens, for scheduling estimates."""
+
+    def memory_mb(self, loaded: LoadedModel) -> float:
+        return 0.0
+
+
+# Fake emotion lexicon: any of these words votes for its label
+FAKE_EMOTION_WORDS = {
+    "anger": ("angry", "furious", "mad", "annoyed", "hate", "frustrated", "irritated"),
+    "fear": ("scared", "afraid", "anxious", "nervous", "worried", "panic", "terrified"),
+    "joy": ("happy", "great", "excited", "glad", "wonderful", "amazing", "good", "calm"),
+    "love": ("love", "grateful", "thankful", "caring", "adore"),
+    "sadness": ("sad", "down", "lonely", "depressed", "cry", "miss", "hurt", "tired"),
+    "surprise": ("surprised", "wow", "unexpected", "shocked", "suddenly"),
+}
+FAKE_REPLIES = [
+    "That sounds like a lot to carry. What has been on your mind the most?",
+    "Thank you for sharing that with me. How are you feeling right now?",
+    "I'm glad you told me. Would you like to talk more about it?",
+    "It makes sense to feel that way. What would help you a little today?",
+]
+
+
+class FakeBackend(InferenceBackend):
+    """
+    Deterministic stand-in for the models: the same input always gives the same
+    emotion and reply. To imitate model cost in serving-layer benchmarks, each
+    call sleeps latency_ms, plus per_item_ms for every text or generated reply,
+    plus per_token_ms for every prompt token (whitespace-separated word).
+    """
+
+    name = "fake"
+
+    def __init__(self, latency_ms: float = 0.0, per_item_ms: float = 0.0, per_token_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.per_item_ms = per_item_ms
+        self.per_token_ms = per_token_ms
+
+    def _work(self, items: int, tokens: int = 0):
+        delay = (self.latency_ms + self.per_item_ms * items + self.per_token_ms * tokens) / 1000
+        if delay > 0:
+            time.sleep(delay)
+
+    def load(self, kind: str, version: str, path: str) -> LoadedModel:
+        return LoadedModel(kind, version, tokenizer=None, model={"backend": self.name, "path": path},
+                           timings={"load": 0.0, "warmup": 0.0})
+
+    def emotion_probabilities(self, loaded: LoadedModel, texts: List[str]) -> List[List[float]]:
+        self._work(len(texts))
+        probs = []
+        for text in texts:
+            words = "".join(c if c.isalpha() else " " for c in text.lower()).split()
+            votes = [0.1 + sum(w in FAKE_EMOTION_WORDS[label] for w in words) for label in EMOTION_LABELS]
+            if max(votes) == 0.1:
+                # no lexicon word: a stable pseudo-random label
+                votes[zlib.crc32(text.encode("utf-8")) % len(EMOTION_LABELS)] += 0.5
+            total = sum(votes)
+            probs.append([v / total for v in votes])
+        return probs
+
+    def generate(self, loaded: LoadedModel, prompts: List[str], candidates: int, max_new_tokens: int,
+                 **sampling) -> List[str]:
+        self._work(len(prompts) * candidates, sum(len(p.split()) for p in prompts))
+        return [FAKE_REPLIES[zlib.crc32(f"{prompt}|{c}".encode("utf-8")) % len(FAKE_REPLIES)]
+                for prompt in prompts for c in range(candidates)]
+
+    def count_tokens(self, loaded: LoadedModel, text: str) -> int:
+        return len(text.split())
+
+
+def create_backend(name: str, **options) -> InferenceBackend:
+    """Backend by name; options go to its constructor. torch is only imported for the torch backend."""
+    if name == "torch":
+        from torch_backend import TorchBackend
+        return TorchBackend(**options)
+    if name == "fake":
+        return FakeBackend(**options)
+    raise ValueError(f"Unknown inference backend: {name} (expected one of {BACKENDS})")
+
+
+def backend_options(name: str) -> Dict:
+    """Constructor options for a backend from the environment."""
+    if name == "torch":
+        return {
+            "emotion_compile": os.getenv("EMOTION_COMPILE", "eager"),  # eager | trace | compile (see emotion_compile.py)
+            # fp32 | bf16 per model (see precision.py); emotion bf16 also needs a passed evaluate.py accuracy gate
+            "emotion_precision": os.getenv("EMOTION_PRECISION", "fp32"),
+            "response_precision": os.getenv("RESPONSE_PRECISION", "fp32"),
+            # Strict offline mode: only local safetensors artifacts (see prepare_artifacts.py), never the network
+            "offline": os.getenv("MODEL_OFFLINE", "0") == "1",
+        }
+    if name == "fake":
+        return {"latency_ms": float(os.getenv("FAKE_BACKEND_LATENCY_MS", "0")),
+                "per_item_ms": float(os.getenv("FAKE_BACKEND_PER_ITEM_MS", "0")),
+                "per_token_ms": float(os.getenv("FAKE_BACKEND_PER_TOKEN_MS", "0"))}
+    return {}
@@ -0,0 +1,182 @@
+# model_registry.py
+"""
+Versioned model registry and zero-downtime model swapping.
+
+Layout (under ./models/registry by default, or MODEL_REGISTRY_DIR):
+
+    models/registry/
+        registry.json            # versions per kind and which one is active
+        emotion/v0001/           # save_pretrained() output, copied in by register()
+        response/v0001/
+
+train_emotion.py and fine_tune.py register every model they save. The API serves
+each kind through a ModelSlot: a new version is loaded and warmed up off the
+request path, swapped in with one reference assignment, and the old version is
+released once the requests still using it have finished.
+"""
+
+import os
+import json
+import time
+import shutil
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", "./models/registry")
+INDEX_NAME = "registry.json"
+KINDS = ("emotion", "response")
+
+
+def index_path(root: str = REGISTRY_DIR) -> str:
+    return os.path.join(root, INDEX_NAME)
+
+
+def load_index(root: str = REGISTRY_DIR) -> Dict:
+    path = index_path(root)
+    if not os.path.exists(path):
+        return {kind: {"active": None, "versions": {}} for kind in KINDS}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_index(index: Dict, root: str = REGISTRY_DIR):
+    """Write the index atomically so readers never see it half-written."""
+    os.makedirs(root, exist_ok=True)
+    path = index_path(root)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _check_kind(kind: str):
+    if kind not in KINDS:
+        raise ValueError(f"Unknown model kind: {kind} (expected one of {KINDS})")
+
+
+def register(kind: str, source_dir: str, root: str = REGISTRY_DIR, activate: bool = True,
+             metadata: Optional[Dict] = None) -> str:
+    """Copy a saved model directory into the registry as the next version; returns the version id."""
+    _check_kind(kind)
+    index = load_index(root)
+    entry = index.setdefault(kind, {"active": None, "versions": {}})
+    version = f"v{len(entry['versions']) + 1:04d}"
+    target = os.path.join(root, kind, version)
+    tmp = target + ".tmp"
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    shutil.copytree(source_dir, tmp)
+    os.replace(tmp, target)
+
+    entry["versions"][version] = {
+        "path": os.path.join(kind, version),
+        "source": source_dir,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        **(metadata or {}),
+    }
+    if activate:
+        entry["active"] = version
+    save_index(index, root)
+    return version
+
+
+def activate(kind: str, version: str, root: str = REGISTRY_DIR):
+    _check_kind(kind)
+    index = load_index(root)
+    if version not in index.get(kind, {}).get("versions", {}):
+        raise KeyError(f"No {kind} model version {version} in {root}")
+    index[kind]["active"] = version
+    save_index(index, root)
+
+
+def versions(kind: str, root: str = REGISTRY_DIR) -> List[str]:
+    return sorted(load_index(root).get(kind, {}).get("versions", {}))
+
+
+def version_path(kind: str, version: str, root: str = REGISTRY_DIR) -> str:
+    entry = load_index(root).get(kind, {}).get("versions", {}).get(version)
+    if entry is None:
+        raise KeyError(f"No {kind} model version {version} in {root}")
+    return os.path.join(root, entry["path"])
+
+
+def active(kind: str, root: str = REGISTRY_DIR) -> Optional[Tuple[str, str]]:
+    """(version, path) of the active version of a kind, or None if nothing is registered."""
+    version = load_index(root).get(kind, {}).get("active")
+    if version is None:
+        return None
+    return version, version_path(kind, version, root)
+
+
+def resolve_source(kind: str, explicit_dir: Optional[str], default_dir: str, default_name: str,
+                   root: str = REGISTRY_DIR) -> Tuple[str, str]:
+    """
+    (version, path) to serve for a kind: an explicitly configured directory, else the
+    registry's active version, else default_dir if it exists, else the hub model name.
+    """
+    if not explicit_dir:
+        registered = active(kind, root)
+        if registered is not None:
+            return registered
+    path = explicit_dir or default_dir
+    if os.path.isdir(path):
+        return os.path.basename(os.path.normpath(path)), path
+    return default_name, default_name
+
+
+class LoadedModel:
+    """A loaded, warmed-up model version and the number of requests currently using it."""
+
+    def __init__(self, kind: str, version: str, tokenizer, model, compiled=None,
+                 timings: Optional[Dict[str, float]] = None, precision: str = "fp32"):
+        self.kind = kind
+        self.version = version
+        self.tokenizer = tokenizer
+        self.model = model
+        self.compiled = compiled
+        self.timings = timings or {}  # seconds spent loading and warming up
+        self.precision = precision
+        self.in_flight = 0
+
+    def release(self):
+        self.tokenizer = self.model = self.compiled = None
+
+
+class ModelSlot:
+    """
+    Holds the serving version of one model kind.
+
+    Requests take the current version with use(); swap() installs a new one for
+    all later requests, and drain() waits for the old one's requests to finish.
+    """
+
+    def __init__(self, loaded: LoadedModel):
+        self._current = loaded
+        self._cond = threading.Condition()
+
+    @property
+    def current(self) -> LoadedModel:
+        return self._current
+
+    @contextmanager
+    def use(self):
+        with self._cond:
+            loaded = self._current
+            loaded.in_flight += 1
+        try:
+            yield loaded
+        finally:
+            with self._cond:
+                loaded.in_flight -= 1
+                self._cond.notify_all()
+
+    def swap(self, loaded: LoadedModel) -> LoadedModel:
+        with self._cond:
+            old, self._current = self._current, loaded
+        return old
+
+    def drain(self, loaded: LoadedModel, timeout: Optional[float] = None) -> bool:
+        """Wait until no request is using loaded; True if it drained within timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: loaded.in_flight == 0, timeout)
@@ -0,0 +1,87 @@
+# precision.py
+"""
+Inference precision modes for the API models.
+
+- "fp32": default
+- "bf16": weights cast to bfloat16 (half the memory) and forward passes under CPU
+  autocast, so precision-sensitive ops stay in fp32; fast on CPUs with native bf16
+  matmul (AVX512-BF16 / AMX)
+
+A precision mode for the emotion model is only enabled once it has passed the
+accuracy gate in evaluate.py (python evaluate.py --precision-gate bf16), which
+records the result in models/precision_gate.json.
+"""
+
+import os
+import json
+import time
+from contextlib import nullcontext
+from typing import Dict, Optional
+
+import torch
+
+PRECISIONS = ("fp32", "bf16")
+GATE_PATH = os.getenv("PRECISION_GATE_PATH", "./models/precision_gate.json")
+DEFAULT_MAX_ACCURACY_DROP = 0.01  # absolute accuracy a precision mode may lose vs fp32
+
+
+def check_precision(precision: str):
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision: {precision} (expected one of {PRECISIONS})")
+
+
+def native_bf16_supported() -> bool:
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def apply_precision(model, precision: str):
+    """Cast model weights for precision (in place); returns the model."""
+    check_precision(precision)
+    if precision == "bf16":
+        model.to(torch.bfloat16)
+    return model
+
+
+def autocast(precision: str, device_type: str = "cpu"):
+    """Context manager for forward passes at precision."""
+    check_precision(precision)
+    if precision == "bf16":
+        return torch.autocast(device_type=device_type, dtype=torch.bfloat16)
+    return nullcontext()
+
+
+def model_memory_mb(model) -> float:
+    """Size of the model's parameters and buffers in MB."""
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors) / (1024 * 1024)
+
+
+def load_gate(path: str = GATE_PATH) -> Dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def record_gate(kind: str, precision: str, model_path: str, result: Dict, path: str = GATE_PATH):
+    gate = load_gate(path)
+    gate.setdefault(kind, {})[precision] = {"model": model_path, "checked_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                                            **result}
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(gate, f, indent=2)
+    os.replace(tmp, path)
+
+
+def gate_allows(kind: str, precision: str, model_path: Optional[str] = None, path: str = GATE_PATH) -> bool:
+    """fp32 is always allowed; other modes need a passed gate (for this model path, if given)."""
+    if precision == "fp32":
+        return True
+    entry = load_gate(path).get(kind, {}).get(precision)
+    if not entry or not entry.get("passed"):
+        return False
+    return model_path is None or os.path.normpath(entry["model"]) == os.path.normpath(model_path)
@@ -0,0 +1,147 @@
+# prepare_artifacts.py
+"""
+Prepare fast-start model artifacts for app.py.
+
+For each model (emotion, response) this loads whatever the server would serve
+(registry active version, local directory or hub fallback), fixes it up once and
+writes the final form:
+
+- weights as memory-mappable safetensors
+- the response tokenizer's pad token added and the embeddings already resized,
+  so the server never calls resize_token_embeddings at boot
+- a prepared.json marker recording the source
+
+The result is registered as a new active version (or written to --out). Serve it
+with MODEL_OFFLINE=1 to load only local safetensors and never touch the network.
+
+Run:
+    python prepare_artifacts.py
+    python prepare_artifacts.py --bench-startup     # import / load / warm-up times, generic vs prepared
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+import model_registry
+
+SOURCES = {
+    # kind: (env var, default dir, hub fallback) -- same as app.py
+    "emotion": ("EMOTION_MODEL_DIR", "./models/emotion_detector", "bert-base-uncased"),
+    "response": ("RESPONSE_MODEL_DIR", "./models/response_model", "microsoft/DialoGPT-small"),
+}
+MARKER_NAME = "prepared.json"
+
+
+def prepare(kind: str, source: str, out_dir: str) -> dict:
+    """Load source once, bake in the pad token, and save tokenizer + safetensors weights to out_dir."""
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification, AutoModelForCausalLM
+
+    model_cls = AutoModelForSequenceClassification if kind == "emotion" else AutoModelForCausalLM
+    tokenizer = AutoTokenizer.from_pretrained(source)
+    model = model_cls.from_pretrained(source)
+    resized = False
+    if kind == "response" and tokenizer.pad_token is None:
+        tokenizer.add_special_tokens({"pad_token": "[PAD]"})
+        model.resize_token_embeddings(len(tokenizer))
+        resized = True
+    if tokenizer.pad_token_id is not None:
+        model.config.pad_token_id = tokenizer.pad_token_id
+
+    os.makedirs(out_dir, exist_ok=True)
+    model.save_pretrained(out_dir, safe_serialization=True)
+    tokenizer.save_pretrained(out_dir)
+    marker = {
+        "kind": kind,
+        "source": source,
+        "pad_token_id": tokenizer.pad_token_id,
+        "resized_embeddings": resized,
+        "prepared_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(os.path.join(out_dir, MARKER_NAME), "w", encoding="utf-8") as f:
+        json.dump(marker, f, indent=2)
+    return marker
+
+
+def startup_timings(env: dict) -> dict:
+    """Import app.py in a fresh interpreter and return its STARTUP_TIMINGS."""
+    code = "import json, app; print('STARTUP_TIMINGS ' + json.dumps(app.STARTUP_TIMINGS))"
+    result = subprocess.run([sys.executable, "-c", code], env={**os.environ, **env},
+                            capture_output=True, text=True, check=True)
+    for line in result.stdout.splitlines():
+        if line.startswith("STARTUP_TIMINGS "):
+            return json.loads(line.split(" ", 1)[1])
+    raise RuntimeError(f"app.py did not report startup timings:\n{result.stdout}\n{result.stderr}")
+
+
+def bench_startup(generic: dict, prepared: dict, runs: int = 3):
+    """Best-of-runs startup phases for the generic sources vs the prepared artifacts."""
+    configs = {
+        "generic": {"MODEL_OFFLINE": "0", "EMOTION_MODEL_DIR": generic["emotion"],
+                    "RESPONSE_MODEL_DIR": generic["response"]},
+        "prepared": {"MODEL_OFFLINE": "1", "EMOTION_MODEL_DIR": prepared["emotion"],
+                     "RESPONSE_MODEL_DIR": prepared["response"]},
+    }
+    print("\n" + "=" * 60)
+    print("STARTUP BENCHMARK (best of %d, seconds)" % runs)
+    print("=" * 60)
+    print(f"{'':<10}{'import':>10}{'load':>10}{'warm-up':>10}{'total':>10}")
+    results = {}
+    for name, env in configs.items():
+        timings = [startup_timings(env) for _ in range(runs)]
+        best = {phase: min(t[phase] for t in timings) for phase in ("import", "load", "warmup")}
+        results[name] = best
+        print(f"{name:<10}{best['import']:>10.2f}{best['load']:>10.2f}{best['warmup']:>10.2f}"
+              f"{sum(best.values()):>10.2f}")
+    print("=" * 60)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write fast-start safetensors artifacts for app.py.")
+    parser.add_argument("--kinds", nargs="+", choices=sorted(SOURCES), default=sorted(SOURCES))
+    parser.add_argument("--out", default=None,
+                        help="write <out>/<kind> directories instead of registering new versions")
+    parser.add_argument("--bench-startup", action="store_true",
+                        help="afterwards, compare app.py startup on the original vs prepared models")
+    parser.add_argument("--runs", type=int, default=3, help="startup benchmark runs per config")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("Preparing model artifacts...")
+    print("=" * 60)
+
+    generic, prepared = {}, {}
+    for kind in args.kinds:
+        env_name, default_dir, default_name = SOURCES[kind]
+        _, source = model_registry.resolve_source(kind, os.getenv(env_name), default_dir, default_name)
+        generic[kind] = source
+        if args.out:
+            target = os.path.join(args.out, kind)
+            marker = prepare(kind, source, target)
+            prepared[kind] = target
+            print(f"✅ {kind}: {source} -> {target}")
+        else:
+            with tempfile.TemporaryDirectory() as tmp:
+                marker = prepare(kind, source, tmp)
+                version = model_registry.register(kind, tmp, metadata={"prepared": True, "prepared_from": source})
+            prepared[kind] = model_registry.version_path(kind, version)
+            print(f"✅ {kind}: {source} -> registered as {version} (now active)")
+        if marker["resized_embeddings"]:
+            print(f"   - added pad token (id {marker['pad_token_id']}) and resized embeddings")
+
+    print("\nServe with: MODEL_OFFLINE=1 uvicorn app:app")
+    if args.bench_startup:
+        if set(args.kinds) != set(SOURCES):
+            print("⚠️  --bench-startup needs both models prepared; skipping")
+        else:
+            bench_startup(generic, prepared, args.runs)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
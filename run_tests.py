@@ -8,6 +8,8 @@ Usage:
     python run_tests.py --unit       # Run only unit tests
     python run_tests.py --integration # Run only integration tests
     python run_tests.py --coverage   # Run with coverage report
+    python run_tests.py --bench      # Run micro-benchmarks against benchmarks/baseline.json
+    python run_tests.py --bench --tolerance=0.3  # Allow 30% slowdown before failing
 """
 
 import sys
@@ -52,6 +54,15 @@ def run_tests(test_type="all", coverage=False):
         return 1
 
 
+def run_benchmarks(tolerance=None):
+    """Run the micro-benchmarks and compare them with the stored baselines."""
+    cmd = [sys.executable, "-m", "benchmarks.microbench"]
+    if tolerance is not None:
+        cmd.extend(["--tolerance", tolerance])
+    result = subprocess.run(cmd, check=False, cwd=Path(__file__).parent)
+    return result.returncode
+
+
 def main():
     """Main entry point."""
     args = sys.argv[1:]
@@ -71,6 +82,18 @@ def main():
         print(__doc__)
         return 0
     
+    if "--bench" in args:
+        tolerance = next((a.split("=", 1)[1] for a in args if a.startswith("--tolerance=")), None)
+        return_code = run_benchmarks(tolerance)
+        print()
+        print("=" * 70)
+        if return_code == 0:
+            print("✓ NO PERFORMANCE REGRESSIONS")
+        else:
+            print("✗ PERFORMANCE REGRESSIONS FOUND")
+        print("=" * 70)
+        return return_code
+    
     return_code = run_tests(test_type, coverage)
     
     print()
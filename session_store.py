@@ -0,0 +1,313 @@
+# session_store.py
+"""
+Durable conversation memory: an append-only turn log plus compacted snapshots.
+
+    data/sessions/
+        turns-000007.log     # JSON line per turn, appended by the API; fsynced in batches
+        sessions.snap        # compacted snapshot, read through mmap
+
+- append() writes a turn to the current log; a background thread fsyncs it every
+  fsync_interval seconds, so a crash loses at most that window.
+- compact() starts a new log, then merges the previous snapshot with the finished
+  logs into a new snapshot (written to a temp file and renamed), and deletes those
+  logs. Every snapshot records the last log generation it covers, so recovery never
+  replays a turn twice, wherever a crash happens.
+- On startup only the snapshot's index is read (the file is memory-mapped); a
+  session's turns are decoded the first time it is used. Logs newer than the
+  snapshot are replayed, and older ones (left behind by a crash between writing a
+  snapshot and deleting its logs) are deleted. Every restored session is trimmed
+  to max_turns.
+
+Snapshot layout: MAGIC, covered log generation (u64), one JSON turn list per
+session, a JSON index {session_id: [offset, length]}, then the index offset and
+length (u64 each) and MAGIC again.
+
+Restore benchmark:
+    python session_store.py --bench 200000
+"""
+
+import os
+import re
+import json
+import mmap
+import time
+import struct
+import argparse
+import tempfile
+import threading
+from typing import Dict, List, Optional
+
+MAGIC = b"MMSESS1\n"
+U64 = struct.Struct("<Q")
+SNAPSHOT_NAME = "sessions.snap"
+LOG_PATTERN = re.compile(r"^turns-(\d{6})\.log$")
+
+
+def log_name(generation: int) -> str:
+    return f"turns-{generation:06d}.log"
+
+
+class SessionSnapshot:
+    """Read-only, memory-mapped view of a snapshot file."""
+
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC or self._mm[-len(MAGIC):] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a session snapshot")
+        self.generation = U64.unpack_from(self._mm, len(MAGIC))[0]
+        footer = len(self._mm) - len(MAGIC) - 2 * U64.size
+        index_offset, index_length = U64.unpack_from(self._mm, footer)[0], U64.unpack_from(self._mm, footer + U64.size)[0]
+        self.index: Dict[str, List[int]] = json.loads(self._mm[index_offset:index_offset + index_length])
+
+    @classmethod
+    def empty(cls):
+        snapshot = cls.__new__(cls)
+        snapshot._file = snapshot._mm = None
+        snapshot.generation = 0
+        snapshot.index = {}
+        return snapshot
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, session_id):
+        return session_id in self.index
+
+    def raw(self, session_id: str) -> Optional[bytes]:
+        entry = self.index.get(session_id)
+        if entry is None:
+            return None
+        offset, length = entry
+        return self._mm[offset:offset + length]
+
+    def get(self, session_id: str) -> Optional[List[dict]]:
+        blob = self.raw(session_id)
+        return None if blob is None else json.loads(blob)
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._file.close()
+            self._mm = self._file = None
+
+
+def write_snapshot(path: str, generation: int, blobs):
+    """Write (session_id, json bytes) pairs as a snapshot, atomically."""
+    directory = os.path.dirname(path) or "."
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    index = {}
+    with os.fdopen(fd, "wb") as f:
+        f.write(MAGIC)
+        f.write(U64.pack(generation))
+        offset = len(MAGIC) + U64.size
+        for session_id, blob in blobs:
+            f.write(blob)
+            index[session_id] = [offset, len(blob)]
+            offset += len(blob)
+        index_bytes = json.dumps(index, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        f.write(index_bytes)
+        f.write(U64.pack(offset))
+        f.write(U64.pack(len(index_bytes)))
+        f.write(MAGIC)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def read_log(path: str):
+    """Yield (session_id, turn) from a log, stopping at a torn last line."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                return  # partially written line from a crash
+            yield record["s"], {"user": record["u"], "bot": record["b"]}
+
+
+class SessionStore:
+    def __init__(self, directory: str, max_turns: int, fsync_interval: float = 0.1):
+        self.directory = directory
+        self.max_turns = max_turns
+        self.fsync_interval = fsync_interval
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()          # log file and snapshot reference
+        self._compact_lock = threading.Lock()  # one compaction at a time
+        self._dirty = False
+        self._closed = threading.Event()
+        self.snapshot = SessionSnapshot.empty()
+        self.generation = 0
+        self._log = None
+
+    def _snapshot_path(self) -> str:
+        return os.path.join(self.directory, SNAPSHOT_NAME)
+
+    def _log_generations(self) -> List[int]:
+        return sorted(int(m.group(1)) for m in map(LOG_PATTERN.match, os.listdir(self.directory)) if m)
+
+    def restore(self) -> Dict[str, List[dict]]:
+        """
+        Open the snapshot (index only) and replay newer logs. Returns the sessions
+        touched by those logs, already merged with their snapshot turns; all other
+        snapshot sessions are loaded on demand with load(). Logs the snapshot
+        already covers are deleted.
+        """
+        if os.path.exists(self._snapshot_path()):
+            self.snapshot = SessionSnapshot(self._snapshot_path())
+        sessions: Dict[str, List[dict]] = {}
+        all_generations = self._log_generations()
+        for generation in all_generations:
+            if generation <= self.snapshot.generation:
+                os.remove(os.path.join(self.directory, log_name(generation)))
+        generations = [g for g in all_generations if g > self.snapshot.generation]
+        for generation in generations:
+            for session_id, turn in read_log(os.path.join(self.directory, log_name(generation))):
+                turns = sessions.get(session_id)
+                if turns is None:
+                    turns = sessions[session_id] = self.snapshot.get(session_id) or []
+                turns.append(turn)
+                if len(turns) > self.max_turns:
+                    del turns[:-self.max_turns]
+        # new turns go to a fresh log, after everything already on disk
+        self.generation = max(generations + [self.snapshot.generation]) + 1
+        self._log = open(os.path.join(self.directory, log_name(self.generation)), "a", encoding="utf-8")
+        return sessions
+
+    def load(self, session_id: str) -> Optional[List[dict]]:
+        """A session's snapshot turns (trimmed to max_turns), or None."""
+        with self._lock:
+            turns = self.snapshot.get(session_id)
+        return None if turns is None else turns[-self.max_turns:]
+
+    def __len__(self):
+        return len(self.snapshot)
+
+    def append(self, session_id: str, user_text: str, bot_text: str):
+        line = json.dumps({"s": session_id, "u": user_text, "b": bot_text}, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._log.write(line)
+            self._dirty = True
+
+    def flush(self):
+        """Write buffered turns and fsync the log."""
+        with self._lock:
+            if not self._dirty or self._log is None:
+                return
+            self._log.flush()
+            os.fsync(self._log.fileno())
+            self._dirty = False
+
+    def compact(self):
+        """Merge the snapshot and all finished logs into a new snapshot."""
+        with self._compact_lock:
+            with self._lock:
+                # rotate: later appends go to a new log that this compaction doesn't touch
+                self._log.flush()
+                os.fsync(self._log.fileno())
+                self._log.close()
+                self._dirty = False
+                covered = self.generation
+                self.generation += 1
+                self._log = open(os.path.join(self.directory, log_name(self.generation)), "a", encoding="utf-8")
+                old = self.snapshot
+            logs = [g for g in self._log_generations() if old.generation < g <= covered]
+
+            changed: Dict[str, List[dict]] = {}
+            for generation in logs:
+                for session_id, turn in read_log(os.path.join(self.directory, log_name(generation))):
+                    turns = changed.get(session_id)
+                    if turns is None:
+                        turns = changed[session_id] = old.get(session_id) or []
+                    turns.append(turn)
+                    if len(turns) > self.max_turns:
+                        del turns[:-self.max_turns]
+
+            def blobs():
+                for session_id in old.index:
+                    if session_id not in changed:
+                        yield session_id, old.raw(session_id)  # unchanged: copy bytes without decoding
+                for session_id, turns in changed.items():
+                    yield session_id, json.dumps(turns, ensure_ascii=False).encode("utf-8")
+
+            write_snapshot(self._snapshot_path(), covered, blobs())
+            snapshot = SessionSnapshot(self._snapshot_path())
+            with self._lock:
+                self.snapshot = snapshot
+                old.close()
+            for generation in logs:
+                os.remove(os.path.join(self.directory, log_name(generation)))
+            return len(snapshot)
+
+    def start(self, compact_interval: float = 0.0):
+        """Background fsync every fsync_interval, and compaction every compact_interval seconds (0 = never)."""
+
+        def flusher():
+            while not self._closed.wait(self.fsync_interval):
+                self.flush()
+
+        def compactor():
+            while not self._closed.wait(compact_interval):
+                try:
+                    self.compact()
+                except Exception as e:  # never let one bad run stop compaction for good
+                    print(f"⚠️  Session compaction failed: {e}")
+
+        threading.Thread(target=flusher, name="session-fsync", daemon=True).start()
+        if compact_interval > 0:
+            threading.Thread(target=compactor, name="session-compact", daemon=True).start()
+
+    def close(self):
+        self._closed.set()
+        self.flush()
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+            self.snapshot.close()
+
+
+def bench(n_sessions: int, turns_per_session: int, max_turns: int):
+    """Write n_sessions through the log, compact, and time a cold restore."""
+    with tempfile.TemporaryDirectory() as directory:
+        store = SessionStore(directory, max_turns)
+        store.restore()
+        t0 = time.perf_counter()
+        for i in range(n_sessions):
+            for t in range(turns_per_session):
+                store.append(f"session-{i}", f"message {t} from user {i}", f"reply {t} to user {i}")
+        store.flush()
+        t1 = time.perf_counter()
+        store.compact()
+        t2 = time.perf_counter()
+        store.close()
+        size_mb = os.path.getsize(os.path.join(directory, SNAPSHOT_NAME)) / (1024 * 1024)
+
+        restored = SessionStore(directory, max_turns)
+        t3 = time.perf_counter()
+        pending = restored.restore()
+        t4 = time.perf_counter()
+        turns = restored.load(f"session-{n_sessions - 1}")
+        restored.close()
+
+    print("=" * 60)
+    print(f"{n_sessions} sessions x {turns_per_session} turns (keeping {max_turns})")
+    print("=" * 60)
+    print(f"Append + fsync: {t1 - t0:.2f}s ({n_sessions * turns_per_session / (t1 - t0):.0f} turns/sec)")
+    print(f"Compaction:     {t2 - t1:.2f}s -> {size_mb:.1f} MB snapshot")
+    print(f"Cold restore:   {t4 - t3:.2f}s ({len(restored)} sessions indexed, {len(pending)} replayed)")
+    print(f"Sample session: {len(turns)} turns")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark session snapshot restore.")
+    parser.add_argument("--bench", type=int, default=200_000, metavar="SESSIONS")
+    parser.add_argument("--turns", type=int, default=6, help="turns written per session")
+    parser.add_argument("--max-turns", type=int, default=5, help="turns kept per session (MAX_MEMORY)")
+    args = parser.parse_args()
+    bench(args.bench, args.turns, args.max_turns)
+
+
+if __name__ == "__main__":
+    main()
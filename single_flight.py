@@ -0,0 +1,58 @@
+# single_flight.py
+"""
+In-flight request coalescing ("single flight").
+
+While a call for a key is running, later callers with the same key wait for its
+result instead of doing the work again. Nothing is cached: once the call
+finishes, the next caller starts a fresh one.
+"""
+
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, Hashable
+
+
+def normalize_text(text: str) -> str:
+    """Coalescing key for a message: surrounding and repeated whitespace doesn't change the result."""
+    return " ".join(text.split())
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Hashable, Future] = {}
+        self.calls = 0       # every do() call
+        self.executions = 0  # calls that actually ran fn
+
+    def do(self, key: Hashable, fn: Callable):
+        """Return fn(), sharing the result (or exception) with concurrent callers of the same key."""
+        with self._lock:
+            self.calls += 1
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+                self.executions += 1
+        if not leader:
+            return future.result()
+
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+        return future.result()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            calls, executions = self.calls, self.executions
+        coalesced = calls - executions
+        return {
+            "calls": calls,
+            "executions": executions,
+            "coalesced": coalesced,
+            "coalescing_ratio": coalesced / calls if calls else 0.0,
+        }
@@ -1,13 +1,22 @@
 # tests/test_api.py
 """
 Integration tests for FastAPI endpoints.
+
+These run against the deterministic fake inference backend, so they need no
+model files; to test the real models, run with INFERENCE_BACKEND=torch.
 """
 
+import os
+import time
 import pytest
 from fastapi.testclient import TestClient
+
+os.environ.setdefault("INFERENCE_BACKEND", "fake")
+os.environ.setdefault("ADMIN_TOKEN", "test-admin-token")
 from app import app
 
 client = TestClient(app)
+ADMIN_HEADERS = {"X-Admin-Token": os.environ["ADMIN_TOKEN"]}
 
 
 class TestHealthEndpoint:
@@ -178,6 +187,53 @@ class TestChatEndpoint:
         # Session 2 should not have access to session 1's context
 
 
+class TestChatBatchEndpoint:
+    """Test bulk /chat/batch endpoint."""
+    
+    def test_batch_returns_one_response_per_item_in_order(self):
+        """Test that every item gets a response, in request order."""
+        items = [
+            {"session_id": "batch_a", "message": "I had a long day"},
+            {"session_id": "batch_b", "message": "I want to kill myself"},
+            {"session_id": "batch_c", "message": "I'm excited about my trip"},
+        ]
+        response = client.post("/chat/batch", json=items)
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert [d["session_id"] for d in data] == ["batch_a", "batch_b", "batch_c"]
+        assert data[1]["crisis"] is True
+        assert data[1]["emotion"] == "crisis"
+        for d in (data[0], data[2]):
+            assert d["crisis"] is False
+            assert isinstance(d["response"], str) and len(d["response"]) > 0
+    
+    def test_batch_updates_memory_in_order(self):
+        """Test that repeated sessions in one batch are stored in request order."""
+        from app import CONVERSATION_MEMORY
+        
+        items = [
+            {"session_id": "batch_memory", "message": "first message"},
+            {"session_id": "batch_other", "message": "unrelated"},
+            {"session_id": "batch_memory", "message": "second message"},
+        ]
+        response = client.post("/chat/batch", json=items)
+        
+        assert response.status_code == 200
+        turns = CONVERSATION_MEMORY["batch_memory"]
+        assert [t["user"] for t in turns] == ["first message", "second message"]
+        assert [t["bot"] for t in turns] == [response.json()[0]["response"], response.json()[2]["response"]]
+    
+    def test_batch_rejects_empty_message(self):
+        """Test that an empty message anywhere in the batch is rejected."""
+        items = [
+            {"session_id": "batch_empty", "message": "hello"},
+            {"session_id": "batch_empty", "message": "   "},
+        ]
+        response = client.post("/chat/batch", json=items)
+        assert response.status_code == 400
+
+
 class TestResponseQuality:
     """Test response quality and appropriateness."""
     
@@ -208,6 +264,672 @@ class TestResponseQuality:
         assert response.status_code == 200
         data = response.json()
         assert isinstance(data["response"], str)
+    
+    @staticmethod
+    def fixed_emotions(monkeypatch, labels):
+        """Make the reply classifier return a one-hot emotion per reply text (backend-independent)."""
+        import app as app_module
+        
+        def probabilities(texts):
+            return [[1.0 if label == labels.get(text) else 0.0 for label in app_module.EMOTION_LABELS]
+                    for text in texts]
+        monkeypatch.setattr(app_module, "emotion_probabilities", probabilities)
+    
+    def test_repetition_score(self):
+        """Test that repeated trigrams raise the repetition score."""
+        from app import repetition_score
+        
+        assert repetition_score("") == 0.0
+        assert repetition_score("too short") == 0.0
+        assert repetition_score("I hear you and I am here for you") == 0.0
+        assert repetition_score("I am here I am here I am here") > 0.5
+    
+    def test_empty_candidates_fall_back(self, monkeypatch):
+        """Test that an empty candidate loses to any text, and all-empty gives the fallback reply."""
+        from app import pick_best_replies, FALLBACK_REPLY
+        
+        self.fixed_emotions(monkeypatch, {"I am sorry to hear that.": "anger"})
+        assert pick_best_replies([["", "I am sorry to hear that."]], ["sadness"]) == ["I am sorry to hear that."]
+        assert pick_best_replies([["", ""]], ["sadness"]) == [FALLBACK_REPLY]
+    
+    def test_repeated_reply_is_penalised(self, monkeypatch):
+        """Test that with equal tone, the less repetitive candidate wins."""
+        from app import pick_best_replies
+        
+        looping = "we can talk we can talk we can talk we can talk"
+        varied = "we can talk about it whenever you are ready"
+        self.fixed_emotions(monkeypatch, {looping: "love", varied: "love"})
+        assert pick_best_replies([[looping, varied]], ["sadness"]) == [varied]
+    
+    def test_reply_tone_follows_user_emotion(self, monkeypatch):
+        """Test that the chosen reply depends on the user's emotion via REPLY_TONE_WEIGHTS."""
+        from app import pick_best_replies
+        
+        warm, cheerful, harsh = "that must be hard for you", "that is great news", "that is your problem"
+        self.fixed_emotions(monkeypatch, {warm: "love", cheerful: "joy", harsh: "anger"})
+        candidates = [[harsh, cheerful, warm], [harsh, warm, cheerful], [harsh, cheerful]]
+        assert pick_best_replies(candidates, ["sadness", "joy", "unknown"]) == [warm, cheerful, cheerful]
+
+
+
+class TestModelHotSwap:
+    """Test model registry and zero-downtime swaps."""
+    
+    def wait_for_swap(self, kind, timeout=60):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            status = client.get("/admin/models", headers=ADMIN_HEADERS).json()[kind]
+            if status["state"] in ("idle", "failed"):
+                return status
+            time.sleep(0.1)
+        raise AssertionError(f"{kind} swap did not finish")
+    
+    def test_activate_swaps_emotion_model(self, tmp_path, monkeypatch):
+        """Test that a registered version is served after activation, and shown in responses."""
+        import app as app_module
+        import model_registry
+        
+        saved = tmp_path / "saved"
+        if app_module.BACKEND.name == "torch":
+            app_module.EMOTION.current.model.save_pretrained(saved)
+            app_module.EMOTION.current.tokenizer.save_pretrained(saved)
+        else:
+            saved.mkdir()  # the fake backend loads nothing from disk
+        registry = tmp_path / "registry"
+        version = model_registry.register("emotion", str(saved), root=str(registry), activate=False)
+        monkeypatch.setattr(app_module, "MODEL_REGISTRY_DIR", str(registry))
+        old = app_module.EMOTION.current
+        
+        response = client.post("/admin/models/emotion/activate", json={"version": version}, headers=ADMIN_HEADERS)
+        assert response.status_code == 202
+        status = self.wait_for_swap("emotion")
+        
+        assert status["serving"] == version and status["error"] is None
+        assert old.model is None  # old version released after draining
+        data = client.post("/chat", json={"session_id": "swap_test", "message": "I had a calm day"}).json()
+        assert data["model_versions"]["emotion"] == version
+        assert client.get("/metrics").json()["models"]["emotion"]["version"] == version
+    
+    def test_unknown_version_is_rejected(self, tmp_path, monkeypatch):
+        """Test that activating a missing version fails without touching the serving model."""
+        import app as app_module
+        
+        monkeypatch.setattr(app_module, "MODEL_REGISTRY_DIR", str(tmp_path))
+        serving = app_module.EMOTION.current.version
+        response = client.post("/admin/models/emotion/activate", json={"version": "v9999"}, headers=ADMIN_HEADERS)
+        assert response.status_code == 404
+        assert app_module.EMOTION.current.version == serving
+    
+    def test_admin_endpoints_need_a_configured_token(self, monkeypatch):
+        """Test that /admin is refused without ADMIN_TOKEN, or with the wrong token."""
+        import app as app_module
+        
+        assert client.get("/admin/models", headers={"X-Admin-Token": "wrong"}).status_code == 403
+        assert client.get("/admin/models").status_code == 403
+        monkeypatch.setattr(app_module, "ADMIN_TOKEN", None)
+        assert client.get("/admin/models", headers=ADMIN_HEADERS).status_code == 403
+        assert client.post("/admin/models/emotion/activate", json={}).status_code == 403
+    
+    def test_failed_version_is_not_retried_until_registry_changes(self, tmp_path, monkeypatch):
+        """Test that the registry watcher skips a version that failed to load."""
+        import app as app_module
+        import model_registry
+        
+        saved = tmp_path / "saved"
+        saved.mkdir()
+        registry = tmp_path / "registry"
+        model_registry.register("emotion", str(saved), root=str(registry))
+        version = model_registry.register("emotion", str(saved), root=str(registry))  # not the serving one
+        monkeypatch.setattr(app_module, "MODEL_REGISTRY_DIR", str(registry))
+        monkeypatch.setattr(app_module, "start_swap", lambda kind, version, path: True)
+        monkeypatch.setattr(app_module, "FAILED_SWAPS", {
+            "emotion": (model_registry.active("emotion", str(registry)), app_module.registry_stamp())})
+        
+        assert "emotion" not in app_module.check_registry()
+        assert "emotion" not in app_module.check_registry()
+        time.sleep(0.01)
+        model_registry.activate("emotion", version, str(registry))  # registry rewritten: try again
+        assert "emotion" in app_module.check_registry()
+    
+    def test_swap_waits_for_in_flight_requests(self):
+        """Test that a swapped-out version is only drained once its requests finish."""
+        from model_registry import LoadedModel, ModelSlot
+        
+        old, new = LoadedModel("emotion", "v1", None, "old"), LoadedModel("emotion", "v2", None, "new")
+        slot = ModelSlot(old)
+        with slot.use() as in_use:
+            assert slot.swap(new) is old
+            assert slot.current is new and in_use is old
+            assert slot.drain(old, timeout=0.05) is False
+        assert slot.drain(old, timeout=0.05) is True
+
+
+class TestEmotionCoalescing:
+    """Test single-flight coalescing of identical emotion requests."""
+    
+    def test_concurrent_identical_messages_share_one_model_call(self, monkeypatch):
+        """Test that concurrent callers with the same text run the model once."""
+        import threading
+        import app as app_module
+        from single_flight import SingleFlight
+        
+        calls = []
+        
+        def slow_detect(texts):
+            calls.append(texts)
+            time.sleep(0.3)
+            return ["joy"] * len(texts)
+        
+        monkeypatch.setattr(app_module, "detect_emotions", slow_detect)
+        monkeypatch.setattr(app_module, "EMOTION_FLIGHTS", SingleFlight())
+        results = []
+        threads = [
+            threading.Thread(target=lambda t=text: results.append(app_module.detect_emotion(t)))
+            for text in ["I feel great", "  I feel   great "] * 4
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        
+        assert results == ["joy"] * 8
+        assert len(calls) == 1
+        stats = app_module.EMOTION_FLIGHTS.stats()
+        assert stats["calls"] == 8 and stats["executions"] == 1
+        assert stats["coalescing_ratio"] == 7 / 8
+    
+    def test_errors_reach_every_waiting_caller(self):
+        """Test that a failed call is reported to its followers and not cached."""
+        import threading
+        from single_flight import SingleFlight
+        
+        flights = SingleFlight()
+        started = threading.Event()
+        
+        def failing():
+            started.set()
+            time.sleep(0.2)
+            raise RuntimeError("model error")
+        
+        errors = []
+        
+        def call():
+            try:
+                flights.do("same", failing)
+            except RuntimeError as e:
+                errors.append(str(e))
+        
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait()
+        follower = threading.Thread(target=call)
+        follower.start()
+        leader.join()
+        follower.join()
+        
+        assert errors == ["model error", "model error"]
+        assert flights.do("same", lambda: "ok") == "ok"
+
+
+class TestAdmissionControl:
+    """Test rate limiting and the model concurrency cap."""
+    
+    def test_session_rate_limit_returns_429_but_never_blocks_crisis(self, monkeypatch):
+        """Test that a looping session is limited while its crisis messages still get through."""
+        import app as app_module
+        from admission import RateLimiter
+        
+        monkeypatch.setattr(app_module, "SESSION_LIMITER", RateLimiter(rate=0.01, burst=1))
+        first = client.post("/chat", json={"session_id": "limited", "message": "hello there"})
+        second = client.post("/chat", json={"session_id": "limited", "message": "hello again"})
+        crisis = client.post("/chat", json={"session_id": "limited", "message": "I want to kill myself"})
+        other = client.post("/chat", json={"session_id": "not_limited", "message": "hello there"})
+        
+        assert first.status_code == 200
+        assert second.status_code == 429
+        assert int(second.headers["Retry-After"]) >= 1
+        assert crisis.status_code == 200 and crisis.json()["crisis"] is True
+        assert other.status_code == 200
+    
+    def test_crisis_item_does_not_exempt_the_rest_of_a_batch(self, monkeypatch):
+        """Test that a crisis item is answered while the batch's other items are still rate limited."""
+        import app as app_module
+        from admission import RateLimiter
+        
+        monkeypatch.setattr(app_module, "SESSION_LIMITER", RateLimiter(rate=0.01, burst=1))
+        assert client.post("/chat", json={"session_id": "batch_limited", "message": "hello"}).status_code == 200
+        
+        response = client.post("/chat/batch", json=[
+            {"session_id": "batch_limited", "message": "tell me a story"},
+            {"session_id": "batch_limited", "message": "I want to kill myself"},
+            {"session_id": "batch_limited", "message": "and another one"},
+        ])
+        assert response.status_code == 200
+        items = response.json()
+        assert items[1]["crisis"] is True and items[1]["status"] is None
+        assert [items[0]["status"], items[2]["status"]] == [429, 429]
+        assert items[0]["retry_after"] > 0
+        turns = app_module.CONVERSATION_MEMORY["batch_limited"]
+        assert [t["user"] for t in turns[-2:]] == ["hello", "I want to kill myself"]
+        
+        no_crisis = client.post("/chat/batch", json=[{"session_id": "batch_limited", "message": "hi"}])
+        assert no_crisis.status_code == 429
+    
+    def test_refused_message_does_not_touch_crisis_state(self, monkeypatch):
+        """Test that a 429'd message (and its retry) is counted once in the session's crisis risk."""
+        import app as app_module
+        from admission import RateLimiter
+        
+        monkeypatch.setattr(app_module, "SESSION_LIMITER", RateLimiter(rate=0.01, burst=1))
+        client.post("/chat", json={"session_id": "retrying", "message": "hello there"})
+        turns = app_module.CRISIS_STATE["retrying"].turns
+        for _ in range(3):
+            assert client.post("/chat", json={"session_id": "retrying", "message": "hello again"}).status_code == 429
+        assert app_module.CRISIS_STATE["retrying"].turns == turns
+        
+        crisis = client.post("/chat/batch", json=[{"session_id": "retrying", "message": "I feel hopeless"},
+                                                  {"session_id": "retrying", "message": "hello"}])
+        assert crisis.status_code == 200 and crisis.json()[0]["crisis"] is True
+        assert crisis.json()[1]["status"] == 429
+        assert app_module.CRISIS_STATE["retrying"].turns == turns + 1  # only the answered crisis item
+    
+    def test_crisis_state_is_bounded(self, monkeypatch):
+        """Test that per-session crisis state keeps only the most recently active sessions."""
+        import app as app_module
+        from collections import OrderedDict
+        
+        monkeypatch.setattr(app_module, "CRISIS_STATE", OrderedDict())
+        monkeypatch.setattr(app_module, "CRISIS_STATE_MAX_SESSIONS", 3)
+        for i in range(5):
+            app_module.detect_crisis("I feel hopeless", f"crisis-lru-{i}")
+        app_module.detect_crisis("still here", "crisis-lru-2")
+        app_module.detect_crisis("hello", "crisis-lru-5")
+        
+        assert list(app_module.CRISIS_STATE) == ["crisis-lru-4", "crisis-lru-2", "crisis-lru-5"]
+        assert app_module.CRISIS_STATE["crisis-lru-2"].turns == 2
+    
+    def test_busy_model_slots_return_429(self, monkeypatch):
+        """Test that requests over the concurrency cap are turned away after the queue timeout."""
+        import app as app_module
+        from admission import ConcurrencyLimiter
+        
+        limiter = ConcurrencyLimiter(1, timeout=0.05)
+        monkeypatch.setattr(app_module, "MODEL_WORK", limiter)
+        with limiter.slot():
+            response = client.post("/chat", json={"session_id": "busy", "message": "hello there"})
+        assert response.status_code == 429
+        assert "Retry-After" in response.headers
+    
+    def run_queued(self, limiter, jobs):
+        """Hold the only slot, queue jobs (name, cost, priority) in order, release, and return run order."""
+        import threading
+        
+        order = []
+        
+        def job(name, cost, priority):
+            with limiter.slot(cost, priority):
+                order.append(name)
+        
+        with limiter.slot():
+            threads = []
+            for spec in jobs:
+                threads.append(threading.Thread(target=job, args=spec))
+                threads[-1].start()
+                time.sleep(0.05)  # make arrival order deterministic
+        for t in threads:
+            t.join()
+        return order
+    
+    def test_generation_cost_holds_the_response_model(self, monkeypatch):
+        """Test that cost estimates count tokens on a model held in use, so a swap can't release it mid-count."""
+        import app as app_module
+        
+        seen = []
+        real_count = app_module.BACKEND.count_tokens
+        
+        def counting(loaded, text):
+            tokens = real_count(loaded, text)
+            seen.append((loaded.in_flight, tokens))
+            return tokens
+        
+        monkeypatch.setattr(app_module.BACKEND, "count_tokens", counting)
+        cost = app_module.generation_cost("hello there", "")
+        assert len(seen) == 1 and seen[0][0] >= 1
+        assert cost == seen[0][1] + app_module.MAX_NEW_TOKENS * app_module.RESPONSE_CANDIDATES
+    
+    def test_queued_work_runs_shortest_job_first(self):
+        """Test that cheaper and higher-priority jobs overtake a long job, but FIFO keeps arrival order."""
+        from admission import ConcurrencyLimiter
+        
+        jobs = [("long", 700, "returning"), ("short", 120, "returning"), ("first", 400, "first_turn")]
+        assert self.run_queued(ConcurrencyLimiter(1, aging=0), jobs) == ["short", "first", "long"]
+        assert self.run_queued(ConcurrencyLimiter(1, policy="fifo"), jobs) == ["long", "short", "first"]
+    
+    def test_aging_prevents_starvation(self):
+        """Test that a long job that has waited long enough runs before newer short ones."""
+        from admission import ConcurrencyLimiter
+        
+        jobs = [("long", 700, "returning"), ("short", 120, "returning")]
+        # 0.05s head start * 20000 tokens/s of aging outweighs the 580-token cost difference
+        assert self.run_queued(ConcurrencyLimiter(1, aging=20000), jobs) == ["long", "short"]
+    
+    def test_bucket_storage_is_bounded(self):
+        """Test that the limiter forgets the least recently seen keys past max_keys."""
+        from admission import RateLimiter
+        
+        limiter = RateLimiter(rate=1.0, burst=2, max_keys=100)
+        for i in range(1000):
+            limiter.try_acquire(f"session-{i}", now=0.0)
+        assert limiter.stats()["tracked_keys"] == 100
+        
+        assert limiter.try_acquire("a", now=0.0) == (True, 0.0)
+        assert limiter.try_acquire("a", now=0.0) == (True, 0.0)
+        allowed, retry_after = limiter.try_acquire("a", now=0.0)
+        assert not allowed and retry_after == 1.0
+        assert limiter.try_acquire("a", now=1.0)[0] is True
+
+
+class TestSessionPersistence:
+    """Test durable conversation memory (session_store.py)."""
+    
+    def write_turns(self, store, session_id, n):
+        for i in range(n):
+            store.append(session_id, f"message {i}", f"reply {i}")
+    
+    def test_log_is_replayed_after_crash(self, tmp_path):
+        """Test that fsynced turns survive without a clean shutdown, trimmed to max_turns."""
+        from session_store import SessionStore
+        
+        store = SessionStore(str(tmp_path), max_turns=3)
+        store.restore()
+        self.write_turns(store, "crashed", 5)
+        store.flush()  # what the background fsync does; then the process dies
+        with open(store._log.name, "a", encoding="utf-8") as f:
+            f.write('{"s": "crashed", "u": "torn')  # half-written last line
+        
+        sessions = SessionStore(str(tmp_path), max_turns=3).restore()
+        assert [t["user"] for t in sessions["crashed"]] == ["message 2", "message 3", "message 4"]
+    
+    def test_snapshot_restores_lazily_and_log_applies_on_top(self, tmp_path):
+        """Test that compacted sessions load on first use and newer logged turns are added after them."""
+        from session_store import SessionStore
+        
+        store = SessionStore(str(tmp_path), max_turns=5)
+        store.restore()
+        for i in range(100):
+            self.write_turns(store, f"session-{i}", 2)
+        assert store.compact() == 100
+        self.write_turns(store, "session-7", 4)
+        store.close()
+        
+        restored = SessionStore(str(tmp_path), max_turns=5)
+        sessions = restored.restore()
+        assert len(restored) == 100 and list(sessions) == ["session-7"]
+        assert [t["user"] for t in sessions["session-7"]] == ["message 1", "message 0", "message 1",
+                                                                "message 2", "message 3"]
+        assert restored.load("session-42") == [{"user": "message 0", "bot": "reply 0"},
+                                               {"user": "message 1", "bot": "reply 1"}]
+        assert restored.load("unknown") is None
+        # a smaller window on restore still applies to snapshot sessions
+        restored.close()
+        narrow = SessionStore(str(tmp_path), max_turns=1)
+        narrow.restore()
+        assert narrow.load("session-42") == [{"user": "message 1", "bot": "reply 1"}]
+        narrow.close()
+    
+    def test_logs_already_in_snapshot_are_not_replayed(self, tmp_path):
+        """Test that a crash between writing the snapshot and deleting its logs doesn't duplicate turns."""
+        import shutil
+        from session_store import SessionStore
+        
+        store = SessionStore(str(tmp_path), max_turns=5)
+        store.restore()
+        self.write_turns(store, "s", 2)
+        store.flush()
+        leftover = store._log.name
+        shutil.copy(leftover, str(tmp_path / "copy"))
+        store.compact()
+        store.close()
+        shutil.copy(str(tmp_path / "copy"), leftover)  # log not yet deleted when the crash happened
+        
+        restored = SessionStore(str(tmp_path), max_turns=5)
+        assert restored.restore() == {}
+        assert len(restored.load("s")) == 2
+        assert not os.path.exists(leftover)  # covered by the snapshot, so cleaned up
+        restored.close()
+    
+    def test_compactor_survives_a_failed_compaction(self, tmp_path, monkeypatch):
+        """Test that an unexpected error in one compaction doesn't stop the background compactor."""
+        from session_store import SessionStore
+        
+        store = SessionStore(str(tmp_path), max_turns=3)
+        store.restore()
+        calls = []
+        
+        def failing_compact():
+            calls.append(1)
+            raise ValueError("corrupt session record")
+        
+        monkeypatch.setattr(store, "compact", failing_compact)
+        store.start(compact_interval=0.01)
+        deadline = time.time() + 2
+        while len(calls) < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        store.close()
+        assert len(calls) >= 3
+    
+    def test_chat_continues_a_restored_session(self, tmp_path, monkeypatch):
+        """Test that the API uses a snapshot session's turns as context and logs new ones."""
+        import app as app_module
+        from session_store import SessionStore
+        
+        store = SessionStore(str(tmp_path), max_turns=app_module.MAX_MEMORY)
+        store.restore()
+        store.append("restored_session", "My dog is called Biscuit", "What a lovely name!")
+        store.compact()
+        monkeypatch.setattr(app_module, "SESSION_STORE", store)
+        
+        assert "Biscuit" in app_module.get_context("restored_session")
+        response = client.post("/chat", json={"session_id": "restored_session", "message": "I miss him"})
+        assert response.status_code == 200
+        store.close()
+        
+        sessions = SessionStore(str(tmp_path), max_turns=app_module.MAX_MEMORY).restore()
+        assert [t["user"] for t in sessions["restored_session"]] == ["My dog is called Biscuit", "I miss him"]
+
+
+
+class TestWebSocketChat:
+    """Test the /ws/chat channel."""
+    
+    def test_messages_get_replies_in_order(self):
+        """Test that replies come back with their ids over one connection, and update memory."""
+        from app import CONVERSATION_MEMORY
+        
+        with client.websocket_connect("/ws/chat?session_id=ws_session") as ws:
+            ws.send_json({"type": "ping"})
+            assert ws.receive_json() == {"type": "pong"}
+            ws.send_json({"type": "message", "id": 1, "message": "I had a good day"})
+            ws.send_json({"type": "message", "id": 2, "message": "   "})
+            ws.send_json({"type": "message", "id": 3, "message": "Thanks for listening"})
+            frames = [ws.receive_json() for _ in range(3)]
+        
+        errors = [f for f in frames if f["type"] == "error"]
+        replies = [f for f in frames if f["type"] == "reply"]
+        assert [(e["id"], e["status"]) for e in errors] == [(2, 400)]
+        assert [r["id"] for r in replies] == [1, 3]
+        assert all(r["session_id"] == "ws_session" and r["response"] for r in replies)
+        turns = CONVERSATION_MEMORY["ws_session"]
+        assert [t["user"] for t in turns[-2:]] == ["I had a good day", "Thanks for listening"]
+    
+    def test_full_queue_refuses_messages_but_not_crisis(self, monkeypatch):
+        """Test backpressure: messages beyond WS_MAX_PENDING get 429 frames, crisis messages still get a reply."""
+        import app as app_module
+        
+        real_chat_reply = app_module.chat_reply
+        
+        def slow_chat_reply(session_id, text, ip):
+            time.sleep(0.3)
+            return real_chat_reply(session_id, text, ip)
+        
+        monkeypatch.setattr(app_module, "WS_MAX_PENDING", 1)
+        monkeypatch.setattr(app_module, "chat_reply", slow_chat_reply)
+        with client.websocket_connect("/ws/chat?session_id=ws_busy") as ws:
+            for i in range(3):
+                ws.send_json({"type": "message", "id": i, "message": f"Message number {i}"})
+            ws.send_json({"type": "message", "id": "crisis", "message": "I want to kill myself"})
+            frames = [ws.receive_json() for _ in range(4)]
+        
+        refused = [f["id"] for f in frames if f["type"] == "error"]
+        assert len(refused) >= 1 and all(f["status"] == 429 for f in frames if f["type"] == "error")
+        crisis = [f for f in frames if f["id"] == "crisis"]
+        assert crisis[0]["type"] == "reply" and crisis[0]["crisis"] is True
+    
+    def test_failed_and_oversized_messages_keep_the_connection(self, monkeypatch):
+        """Test that an error answering one message becomes a 500 frame, and long messages a 413."""
+        import app as app_module
+        
+        real_chat_reply = app_module.chat_reply
+        
+        def flaky_chat_reply(session_id, text, ip):
+            if text == "break":
+                raise RuntimeError("model exploded")
+            return real_chat_reply(session_id, text, ip)
+        
+        monkeypatch.setattr(app_module, "chat_reply", flaky_chat_reply)
+        monkeypatch.setattr(app_module, "WS_MAX_MESSAGE_CHARS", 50)
+        with client.websocket_connect("/ws/chat?session_id=ws_errors") as ws:
+            ws.send_json({"type": "message", "id": 1, "message": "break"})
+            ws.send_json({"type": "message", "id": 2, "message": "x" * 51})
+            ws.send_json({"type": "message", "id": 3, "message": "Still there?"})
+            frames = [ws.receive_json() for _ in range(3)]
+        
+        by_id = {f["id"]: f for f in frames}
+        assert by_id[1]["type"] == "error" and by_id[1]["status"] == 500
+        assert by_id[2]["type"] == "error" and by_id[2]["status"] == 413
+        assert by_id[3]["type"] == "reply"
+    
+    def test_heartbeat_pings_and_closes_idle_connections(self, monkeypatch):
+        """Test that the server pings, and closes a connection that never answers."""
+        import app as app_module
+        from starlette.websockets import WebSocketDisconnect
+        
+        monkeypatch.setattr(app_module, "WS_HEARTBEAT_INTERVAL", 0.05)
+        monkeypatch.setattr(app_module, "WS_IDLE_TIMEOUT", 0.2)
+        with client.websocket_connect("/ws/chat?session_id=ws_idle") as ws:
+            assert ws.receive_json() == {"type": "ping"}
+            with pytest.raises(WebSocketDisconnect) as closed:
+                while True:
+                    ws.receive_json()
+        assert closed.value.code == 1001
+
+
+
+class TestInferenceBackend:
+    """Test the inference backend interface and the fake backend."""
+    
+    def test_fake_backend_is_deterministic(self):
+        """Test that the fake backend gives the same emotions and replies for the same inputs."""
+        from inference_backend import EMOTION_LABELS, FakeBackend
+        
+        backend = FakeBackend()
+        emotion = backend.load("emotion", "v1", "unused")
+        response = backend.load("response", "v1", "unused")
+        texts = ["I feel sad and lonely", "no lexicon words here"]
+        probs = backend.emotion_probabilities(emotion, texts)
+        assert probs == backend.emotion_probabilities(emotion, texts)
+        assert all(len(p) == len(EMOTION_LABELS) and abs(sum(p) - 1) < 1e-9 for p in probs)
+        assert EMOTION_LABELS[max(range(len(probs[0])), key=probs[0].__getitem__)] == "sadness"
+        
+        replies = backend.generate(response, ["prompt a", "prompt b"], candidates=3, max_new_tokens=80)
+        assert len(replies) == 6 and all(replies)
+        assert replies == backend.generate(response, ["prompt a", "prompt b"], candidates=3, max_new_tokens=80)
+    
+    def test_fake_backend_latency_is_configurable(self):
+        """Test that calls take the configured fixed plus per-item time."""
+        from inference_backend import create_backend
+        
+        backend = create_backend("fake", latency_ms=20, per_item_ms=10)
+        emotion = backend.load("emotion", "v1", "unused")
+        start = time.perf_counter()
+        backend.emotion_probabilities(emotion, ["a", "b", "c"])
+        assert time.perf_counter() - start >= 0.05
+        with pytest.raises(ValueError):
+            create_backend("onnx")
+    
+    def test_backend_must_implement_interface(self):
+        """Test that a backend missing an interface method can't be instantiated."""
+        from inference_backend import InferenceBackend
+        
+        class NoGenerate(InferenceBackend):
+            def load(self, kind, version, path):
+                return None
+            
+            def emotion_probabilities(self, loaded, texts):
+                return []
+            
+            def count_tokens(self, loaded, text):
+                return 0
+        
+        with pytest.raises(TypeError):
+            InferenceBackend()
+        with pytest.raises(TypeError):
+            NoGenerate()
+    
+    def test_metrics_report_backend(self):
+        """Test that /metrics names the serving backend."""
+        import app as app_module
+        
+        assert client.get("/metrics").json()["backend"] == app_module.BACKEND.name
+
+
+class TestBatchInference:
+    """Tests for offline batch inference (batch_infer.py)"""
+    
+    def test_bad_lines_become_error_records(self):
+        """Test that invalid JSON and non-object lines are written as errors and the chunk still completes."""
+        import json
+        import app as app_module
+        import batch_infer
+        
+        batch_infer._app = app_module
+        lines = ['{"message": "I feel happy today", "id": 1}\n', '{not json\n', '\n',
+                 '[1, 2]\n', '{"message": "thanks for listening", "id": 2}\n']
+        consumed, out = batch_infer.process_chunk(lines)
+        records = [json.loads(line) for line in out]
+        
+        assert consumed == len(lines)
+        assert len(records) == 4
+        assert records[0]["id"] == 1 and records[0]["response"]
+        assert records[1]["error"].startswith("invalid JSON") and records[1]["line"] == "{not json"
+        assert records[2]["error"].startswith("expected a JSON object")
+        assert records[3]["id"] == 2 and records[3]["response"]
+
+
+class TestBenchmarkBaselines:
+    """Tests for the micro-benchmark regression gate"""
+    
+    def test_compare_flags_only_beyond_tolerance(self):
+        """Test that slowdowns and allocation growth count only beyond the tolerance."""
+        from benchmarks.microbench import compare
+        
+        baseline = {"a": {"time_us": 10.0, "relative_time": 1.0, "peak_kb": 100.0}}
+        within = {"a": {"time_us": 12.0, "relative_time": 1.2, "peak_kb": 120.0}}
+        slower = {"a": {"time_us": 15.0, "relative_time": 1.5, "peak_kb": 100.0}}
+        bigger = {"a": {"time_us": 10.0, "relative_time": 1.0, "peak_kb": 200.0}}
+        
+        assert compare(within, baseline, 0.25)["regressions"] == {}
+        assert "a" in compare(slower, baseline, 0.25)["regressions"]
+        assert "a" in compare(bigger, baseline, 0.25)["regressions"]
+        assert compare(slower, baseline, 0.6)["regressions"] == {}
+    
+    def test_compare_reports_missing_baselines(self):
+        """Test that benchmarks without a stored baseline are reported, not failed."""
+        from benchmarks.microbench import compare, load_baseline
+        
+        verdict = compare({"new": {"time_us": 1.0, "relative_time": 1.0, "peak_kb": 1.0}}, {}, 0.25)
+        assert verdict == {"regressions": {}, "missing": ["new"]}
+        assert load_baseline()["results"]  # the committed baseline is readable
 
 
 if __name__ == "__main__":
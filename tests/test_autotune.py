@@ -0,0 +1,69 @@
+# tests/test_autotune.py
+"""
+Tests for picking the inference profile from autotune benchmark results.
+These use hand-made result rows, so no models or benchmarks are run.
+"""
+
+import pytest
+
+from autotune import best_batch, choose_profile
+
+
+def row(model, threads, batch, latency_ms, interop=1):
+    return {"model": model, "threads": threads, "interop": interop, "batch_size": batch,
+            "latency_ms": latency_ms, "items_per_sec": 1000 * batch / latency_ms}
+
+
+class TestBestBatch:
+    """Test batch size selection."""
+
+    def test_highest_throughput_wins(self):
+        """Test that the batch with the most items/sec is chosen."""
+        rows = [row("emotion", 4, 1, 10), row("emotion", 4, 8, 40), row("emotion", 4, 32, 400)]
+        assert best_batch(rows)["batch_size"] == 8
+
+    def test_latency_cap(self):
+        """Test that batches over the cap are skipped, unless every batch is over it."""
+        rows = [row("emotion", 4, 1, 10), row("emotion", 4, 8, 40), row("emotion", 4, 64, 200)]
+        assert best_batch(rows)["batch_size"] == 64
+        assert best_batch(rows, max_latency_ms=50)["batch_size"] == 8
+        assert best_batch(rows, max_latency_ms=5)["batch_size"] == 64
+
+
+class TestChooseProfile:
+    """Test thread setting selection."""
+
+    def test_lowest_cost_per_message(self):
+        """Test that the thread setting with the cheapest classify + reply per message is chosen."""
+        results = [
+            row("emotion", 2, 8, 40), row("generation", 2, 4, 2000),
+            row("emotion", 4, 8, 20), row("generation", 4, 4, 1600),
+            row("emotion", 8, 8, 10), row("generation", 8, 4, 2400),
+        ]
+        profile = choose_profile(results)
+        assert (profile["num_threads"], profile["num_interop_threads"]) == (4, 1)
+        assert profile["emotion_batch_size"] == 8 and profile["generation_batch_size"] == 4
+        assert profile["ms_per_message"] == pytest.approx(20 / 8 + 1600 / 4)
+
+    def test_interop_settings_compared_separately(self):
+        """Test that the same thread count with different interop values are distinct candidates."""
+        results = [
+            row("emotion", 4, 8, 20, interop=1), row("generation", 4, 4, 1600, interop=1),
+            row("emotion", 4, 8, 20, interop=2), row("generation", 4, 4, 1200, interop=2),
+        ]
+        assert choose_profile(results)["num_interop_threads"] == 2
+
+    def test_latency_cap_applies_to_both_models(self):
+        """Test that the per-batch latency cap limits both batch sizes."""
+        results = [
+            row("emotion", 4, 8, 20), row("emotion", 4, 64, 100),
+            row("generation", 4, 1, 80), row("generation", 4, 8, 400),
+        ]
+        uncapped = choose_profile(results)
+        assert (uncapped["emotion_batch_size"], uncapped["generation_batch_size"]) == (64, 8)
+        capped = choose_profile(results, max_latency_ms=90)
+        assert (capped["emotion_batch_size"], capped["generation_batch_size"]) == (8, 1)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
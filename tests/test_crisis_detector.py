@@ -3,8 +3,11 @@
 Unit tests for crisis detection module.
 """
 
+import os
+import json
 import pytest
-from crisis_detector import CrisisDetector, CrisisLevel, get_detector
+from crisis_detector import (CrisisDetector, CrisisLevel, CrisisRules, CrisisRulesError, SessionCrisisState,
+                             HELPLINES, SeverityScorer, get_detector)
 
 
 class TestCrisisDetector:
@@ -87,6 +90,13 @@ class TestCrisisDetector:
         # Should return same instance
         assert detector1 is detector2
     
+    def test_get_detector_respects_region(self):
+        """Test that each region gets its own detector and helplines."""
+        us = get_detector("us")
+        assert us is get_detector("US")
+        assert us is not get_detector("india")
+        assert us.get_helpline_info()["number"] == "988"
+    
     def test_different_regions(self):
         """Test helpline info for different regions."""
         regions = ["india", "us", "uk", "international"]
@@ -131,5 +141,191 @@ class TestCrisisDetector:
         assert len(false_negatives) == 0, f"CRITICAL: Missed crisis messages: {false_negatives}"
 
 
+
+class TestSeverityScorer:
+    """Test suite for the optional ML severity scorer."""
+    
+    def setup_method(self):
+        """Train a tiny scorer on a handful of labeled messages."""
+        texts = [
+            "I had a nice day", "work was fine today", "I love my cat",
+            "nobody would notice if I disappeared forever", "no one would notice if I vanished",
+            "I am going to take my own life tonight", "tonight I take my own life",
+        ]
+        labels = [0, 0, 0, 3, 3, 4, 4]
+        self.scorer = SeverityScorer.fit(texts, labels, n_features=1 << 12, epochs=50)
+    
+    def test_predict_returns_level_and_probability(self):
+        """Test that predictions are CrisisLevel values with valid probabilities."""
+        level, confidence = self.scorer.predict("nobody would notice if I disappeared")
+        assert isinstance(level, CrisisLevel)
+        assert 0.0 <= confidence <= 1.0
+        
+        probs = self.scorer.predict_proba_batch(["hello", "take my own life", ""])
+        assert probs.shape == (3, len(CrisisLevel))
+        assert abs(probs.sum(axis=1) - 1.0).max() < 1e-5
+    
+    def test_model_escalates_missed_message(self):
+        """Test that a confident model escalates a message the rules miss."""
+        text = "nobody would notice if I disappeared forever"
+        _, rule_level, _ = CrisisDetector(region="india").detect(text)
+        assert rule_level.value < CrisisLevel.HIGH.value
+        
+        detector = CrisisDetector(region="india", severity_model=self.scorer, severity_threshold=0.5)
+        is_crisis, level, explanation = detector.detect(text)
+        assert is_crisis is True
+        assert level.value >= CrisisLevel.HIGH.value
+        assert "severity model" in explanation
+    
+    def test_model_never_lowers_rule_level(self):
+        """Test that the model can only escalate, never de-escalate."""
+        detector = CrisisDetector(region="india", severity_model=self.scorer, severity_threshold=0.0)
+        for text in ["I want to kill myself", "I feel worthless and hopeless", "I feel hopeless"]:
+            _, rule_level, _ = detector.detect_rules(text)
+            _, level, _ = detector.detect(text)
+            assert level.value >= rule_level.value
+    
+    def test_save_and_load(self, tmp_path):
+        """Test that a saved scorer loads with identical predictions."""
+        path = str(tmp_path / "severity.npz")
+        self.scorer.save(path)
+        
+        detector = CrisisDetector(region="india", severity_model=path)
+        text = "no one would notice if I vanished"
+        assert (detector.severity_model.predict_proba(text) == self.scorer.predict_proba(text)).all()
+
+
+
+class TestSessionCrisisState:
+    """Test suite for multi-turn crisis detection."""
+    
+    def setup_method(self):
+        """Setup test fixtures."""
+        self.detector = CrisisDetector(region="india")
+    
+    def test_risk_builds_across_turns(self):
+        """Test that concern spread over several turns escalates the level."""
+        state = SessionCrisisState()
+        
+        _, first, _ = self.detector.detect_in_session("I'm such a burden to my family", state)
+        is_crisis, second, explanation = self.detector.detect_in_session(
+            "nobody would notice if I disappeared", state
+        )
+        
+        assert first == CrisisLevel.LOW
+        assert self.detector.detect("nobody would notice if I disappeared")[1] == CrisisLevel.LOW
+        assert is_crisis is True
+        assert second.value > CrisisLevel.LOW.value
+        assert "burden" in explanation and "disappear" in explanation
+    
+    def test_history_alone_never_flags_benign_message(self):
+        """Test that a message without any signal is not flagged because of earlier turns."""
+        state = SessionCrisisState()
+        self.detector.detect_in_session("I feel worthless and hopeless", state)
+        self.detector.detect_in_session("everyone hates me, nobody cares", state)
+        
+        is_crisis, level, _ = self.detector.detect_in_session("thanks, talking helps a bit", state)
+        assert is_crisis is False
+        assert level == CrisisLevel.NONE
+    
+    def test_risk_decays(self):
+        """Test that old signals fade after benign turns."""
+        state = SessionCrisisState()
+        self.detector.detect_in_session("I feel hopeless", state)
+        for _ in range(6):
+            self.detector.detect_in_session("I went for a walk today", state)
+        
+        _, level, _ = self.detector.detect_in_session("everything feels pointless", state)
+        assert level == CrisisLevel.LOW
+        assert "hopeless" not in state.signals
+    
+    def test_sessions_are_independent(self):
+        """Test that one session's state does not affect another."""
+        risky, fresh = SessionCrisisState(), SessionCrisisState()
+        self.detector.detect_in_session("I feel worthless and hopeless", risky)
+        self.detector.detect_in_session("I'm a burden, nobody cares", risky)
+        
+        _, level, _ = self.detector.detect_in_session("I feel hopeless", fresh)
+        assert level == CrisisLevel.LOW
+
+
+
+class TestCrisisRulesReload:
+    """Test suite for hot-reloadable rule files."""
+    
+    def write_rules(self, path, rules, mtime):
+        path.write_text(json.dumps(rules), encoding="utf-8")
+        os.utime(path, (mtime, mtime))
+    
+    def test_reload_swaps_rules(self, tmp_path):
+        """Test that a changed rule file replaces lexicons and helplines."""
+        path = tmp_path / "rules.json"
+        self.write_rules(path, {"critical_keywords": ["kill myself"]}, 1000)
+        detector = CrisisDetector("india", rules_path=str(path))
+        assert detector.detect("I want to vanish forever")[1] == CrisisLevel.NONE
+        
+        self.write_rules(path, {
+            "critical_keywords": ["vanish forever"],
+            "helplines": {"india": {"name": "Test Line", "number": "12345", "hours": "24/7"}},
+        }, 2000)
+        assert detector.reload_rules() is True
+        assert detector.detect("I want to vanish forever")[1] == CrisisLevel.CRITICAL
+        assert "Test Line" in detector.get_crisis_message(CrisisLevel.HIGH)
+        # unchanged file is not rebuilt
+        assert detector.reload_rules() is False
+    
+    def test_bad_file_keeps_previous_rules(self, tmp_path):
+        """Test that an invalid rule file never replaces working rules."""
+        path = tmp_path / "rules.json"
+        self.write_rules(path, {"critical_keywords": ["vanish forever"]}, 1000)
+        detector = CrisisDetector("india", rules_path=str(path))
+        rules = detector.rules
+        
+        path.write_text('{"patterns": ["(unclosed"]}', encoding="utf-8")
+        os.utime(path, (2000, 2000))
+        assert detector.reload_rules() is False
+        assert detector.rules is rules
+        assert detector.detect("I want to vanish forever")[1] == CrisisLevel.CRITICAL
+    
+    def test_wrong_shape_is_rejected_until_fixed(self, tmp_path, capsys):
+        """Test that valid JSON with the wrong shape is rejected once, and a later fix loads."""
+        path = tmp_path / "rules.json"
+        self.write_rules(path, ["not", "an", "object"], 1000)
+        detector = CrisisDetector("india", rules_path=str(path))  # bad file at startup: defaults
+        assert detector.rules.source == "defaults"
+        
+        self.write_rules(path, {"helplines": {"india": {"number": "12345"}}}, 2000)
+        with pytest.raises(CrisisRulesError):
+            CrisisRules.from_file(str(path))
+        assert detector.reload_rules() is False
+        capsys.readouterr()
+        assert detector.reload_rules() is False
+        assert "Could not load" not in capsys.readouterr().out  # same bad file isn't re-parsed
+        
+        self.write_rules(path, {"critical_keywords": ["vanish forever"]}, 3000)
+        assert detector.reload_rules() is True
+        assert detector.detect("I want to vanish forever")[1] == CrisisLevel.CRITICAL
+    
+    def test_helplines_merge_per_region(self, tmp_path):
+        """Test that a rule file listing one region keeps the default helplines of the others."""
+        path = tmp_path / "rules.json"
+        us = {"name": "988 Suicide & Crisis Lifeline", "number": "988", "hours": "24/7"}
+        self.write_rules(path, {"helplines": {"us": us}}, 1000)
+        rules = CrisisRules.from_file(str(path))
+        
+        assert rules.helpline("us") == us
+        assert rules.helpline("india") == HELPLINES["india"]
+        assert rules.helpline("uk") == HELPLINES["uk"]
+        assert "AASRA" in rules.message("india", CrisisLevel.HIGH)
+    
+    def test_messages_are_prerendered(self):
+        """Test that every region and level has a message ready."""
+        rules = CrisisRules.defaults()
+        for region in ["india", "us", "uk", "international"]:
+            for level in CrisisLevel:
+                assert rules.message(region, level)
+        assert rules.message("atlantis", CrisisLevel.HIGH) == rules.message("international", CrisisLevel.HIGH)
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
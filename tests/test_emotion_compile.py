@@ -0,0 +1,89 @@
+# tests/test_emotion_compile.py
+"""
+Tests for the static-shape emotion classifier (emotion_compile.py).
+
+The traced-vs-eager checks use a tiny randomly initialised BERT, so they need
+torch and transformers but no trained model files.
+"""
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from emotion_compile import BucketedEmotionModel, batch_buckets, bucket_for, eager_logits
+
+WORDS = ["i", "feel", "sad", "happy", "tired", "anxious", "today", "really", "so", "and"]
+
+
+@pytest.fixture(scope="module")
+def tiny_model(tmp_path_factory):
+    """A 2-layer BERT classifier with a 10-word vocabulary."""
+    vocab = tmp_path_factory.mktemp("tiny_bert") / "vocab.txt"
+    vocab.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + WORDS) + "\n")
+    tokenizer = transformers.BertTokenizerFast(vocab_file=str(vocab))
+    config = transformers.BertConfig(vocab_size=len(WORDS) + 5, hidden_size=32, num_hidden_layers=2,
+                                     num_attention_heads=2, intermediate_size=64, num_labels=6)
+    torch.manual_seed(0)
+    model = transformers.BertForSequenceClassification(config).eval()
+    return model, tokenizer
+
+
+class TestBuckets:
+    """Test the sequence-length and batch bucket helpers."""
+
+    def test_bucket_for_picks_smallest_fitting_bucket(self):
+        """Test that a length maps to the smallest bucket at least that long."""
+        assert bucket_for(1) == 16
+        assert bucket_for(16) == 16
+        assert bucket_for(17) == 32
+        assert bucket_for(128) == 128
+        assert bucket_for(5, buckets=(4, 8)) == 8
+
+    def test_bucket_for_too_long_is_none(self):
+        """Test that inputs longer than every bucket fall back (None)."""
+        assert bucket_for(129) is None
+        assert bucket_for(10, buckets=()) is None
+
+    def test_batch_buckets(self):
+        """Test powers of two up to and including the maximum batch size."""
+        assert batch_buckets(1) == (1,)
+        assert batch_buckets(8) == (1, 2, 4, 8)
+        assert batch_buckets(12) == (1, 2, 4, 8, 12)
+        assert batch_buckets(0) == (1,)
+
+
+class TestBucketedModel:
+    """Test that bucketed graphs give the same logits as the eager model."""
+
+    def texts(self, count):
+        # mixed lengths, so one batch spans several buckets
+        return [" ".join(WORDS[:(3 + 7 * i) % len(WORDS) + 1] * (1 + i % 4)) for i in range(count)]
+
+    @pytest.mark.parametrize("batch_size", [1, 3, 8, 17])
+    def test_trace_matches_eager(self, tiny_model, batch_size):
+        """Test traced outputs against eager ones at batch sizes other than the warm-up batch."""
+        model, tokenizer = tiny_model
+        bucketed = BucketedEmotionModel(model, tokenizer, mode="trace", buckets=(8, 16, 32, 64))
+        bucketed.warmup()
+        texts = self.texts(batch_size)
+        diff = (bucketed.logits(texts) - eager_logits(model, tokenizer, texts)).abs().max().item()
+        assert diff < 1e-4
+
+    def test_long_input_falls_back_to_eager(self, tiny_model):
+        """Test that inputs longer than the largest bucket still get logits."""
+        model, tokenizer = tiny_model
+        bucketed = BucketedEmotionModel(model, tokenizer, mode="trace", buckets=(8,))
+        texts = ["i feel sad", " ".join(WORDS * 2)]
+        diff = (bucketed.logits(texts) - eager_logits(model, tokenizer, texts)).abs().max().item()
+        assert diff < 1e-4
+
+    def test_unknown_mode_is_rejected(self, tiny_model):
+        """Test that only trace and compile modes are accepted."""
+        model, tokenizer = tiny_model
+        with pytest.raises(ValueError):
+            BucketedEmotionModel(model, tokenizer, mode="onnx")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
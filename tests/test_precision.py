@@ -0,0 +1,46 @@
+# tests/test_precision.py
+"""
+Tests for the precision gate record (precision.py) that decides whether app.py
+may run the emotion model at reduced precision.
+"""
+
+import pytest
+
+pytest.importorskip("torch")
+
+from precision import gate_allows, load_gate, record_gate
+
+
+class TestPrecisionGate:
+    """Test recording and checking the precision gate."""
+
+    def test_fp32_is_always_allowed(self, tmp_path):
+        """Test that fp32 needs no gate file."""
+        path = str(tmp_path / "gate.json")
+        assert gate_allows("emotion", "fp32", path=path)
+        assert not gate_allows("emotion", "bf16", path=path)
+
+    def test_passed_gate_allows_its_model(self, tmp_path):
+        """Test that a passed gate allows the precision for the checked model only."""
+        path = str(tmp_path / "gate.json")
+        record_gate("emotion", "bf16", "./models/emotion_detector", {"passed": True}, path=path)
+
+        assert gate_allows("emotion", "bf16", path=path)
+        assert gate_allows("emotion", "bf16", "models/emotion_detector", path=path)
+        assert not gate_allows("emotion", "bf16", "./models/emotion_detector_small", path=path)
+        assert not gate_allows("response", "bf16", path=path)
+
+    def test_failed_gate_refuses(self, tmp_path):
+        """Test that a failed check, or a later failed re-check, refuses the precision."""
+        path = str(tmp_path / "gate.json")
+        record_gate("emotion", "bf16", "./models/emotion_detector", {"passed": False}, path=path)
+        assert not gate_allows("emotion", "bf16", "./models/emotion_detector", path=path)
+
+        record_gate("emotion", "bf16", "./models/emotion_detector", {"passed": True}, path=path)
+        record_gate("emotion", "bf16", "./models/emotion_detector", {"passed": False}, path=path)
+        assert not gate_allows("emotion", "bf16", path=path)
+        assert load_gate(path)["emotion"]["bf16"]["checked_at"]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,156 @@
+# torch_backend.py
+"""
+The transformers inference backend (INFERENCE_BACKEND=torch, the default).
+
+Loads the emotion classifier and response generator from a local directory or
+the hub, applies the precision mode (precision.py) and optional static-shape
+compilation (emotion_compile.py), warms them up, and runs batched forward and
+generate passes for app.py.
+"""
+
+import os
+import time
+from typing import List, Optional
+
+import torch
+from transformers import AutoTokenizer, AutoModelForSequenceClassification, AutoModelForCausalLM
+
+from emotion_compile import BucketedEmotionModel
+from inference_backend import InferenceBackend
+from model_registry import LoadedModel
+from precision import apply_precision, autocast, gate_allows, native_bf16_supported, model_memory_mb
+
+
+def left_pad(sequences: List[List[int]], pad_id: int):
+    """Left-pad token id lists so a decoder-only model continues every prompt from the same position."""
+    width = max(len(seq) for seq in sequences)
+    input_ids = [[pad_id] * (width - len(seq)) + seq for seq in sequences]
+    attention_mask = [[0] * (width - len(seq)) + [1] * len(seq) for seq in sequences]
+    return torch.tensor(input_ids), torch.tensor(attention_mask)
+
+
+class TorchBackend(InferenceBackend):
+    name = "torch"
+
+    def __init__(self, emotion_compile: str = "eager", emotion_precision: str = "fp32",
+                 response_precision: str = "fp32", offline: bool = False, device: Optional[str] = None,
+                 emotion_batch_size: int = 64):
+        self.emotion_compile = emotion_compile
+        self.emotion_batch_size = emotion_batch_size  # largest batch the compiled model is warmed up for
+        self.precisions = {"emotion": emotion_precision, "response": response_precision}
+        self.offline = offline
+        self.device = torch.device(device or ("cuda" if torch.cuda.is_available() else "cpu"))
+
+    def pretrained_kwargs(self, model_name: str) -> dict:
+        """from_pretrained options; in offline mode, insist on a local safetensors directory."""
+        if not self.offline:
+            return {}
+        if not os.path.isdir(model_name) or not any(f.endswith(".safetensors") for f in os.listdir(model_name)):
+            raise RuntimeError(f"MODEL_OFFLINE=1 but {model_name} is not a local safetensors model directory; "
+                               f"run: python prepare_artifacts.py")
+        return {"local_files_only": True}
+
+    def load_emotion_model(self, model_name: str):
+        print("Loading emotion model:", model_name)
+        kwargs = self.pretrained_kwargs(model_name)
+        tokenizer = AutoTokenizer.from_pretrained(model_name, **kwargs)
+        model = AutoModelForSequenceClassification.from_pretrained(
+            model_name, use_safetensors=True if kwargs else None, **kwargs)
+        # if returned model outputs have different label order than expected, you'll need label mapping
+        return tokenizer, model
+
+    def load_response_model(self, model_name: str):
+        print("Loading response model:", model_name)
+        kwargs = self.pretrained_kwargs(model_name)
+        tokenizer = AutoTokenizer.from_pretrained(model_name, **kwargs)
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name, use_safetensors=True if kwargs else None, **kwargs)
+        # make sure tokenizer.pad_token is set (prepared artifacts already have it)
+        if tokenizer.pad_token is None:
+            tokenizer.add_special_tokens({"pad_token": "[PAD]"})
+            model.resize_token_embeddings(len(tokenizer))
+        return tokenizer, model
+
+    def model_precision(self, kind: str, path: str) -> str:
+        """The precision to run a model at: as configured, unless the accuracy gate hasn't passed it."""
+        requested = self.precisions[kind]
+        if requested != "fp32" and self.device.type == "cpu" and not native_bf16_supported():
+            print(f"⚠️  {requested} requested for the {kind} model, but this CPU has no native bf16 matmul")
+        if kind == "emotion" and not gate_allows(kind, requested, path):
+            print(f"⚠️  {requested} not enabled for the emotion model: no passed accuracy gate for {path} "
+                  f"(run: python evaluate.py --precision-gate {requested} --emotion-model {path}); using fp32")
+            return "fp32"
+        return requested
+
+    def load(self, kind: str, version: str, path: str) -> LoadedModel:
+        if kind == "emotion":
+            return self.build_emotion_model(version, path)
+        return self.build_response_model(version, path)
+
+    def build_emotion_model(self, version: str, path: str) -> LoadedModel:
+        """Load, compile (if enabled) and warm up one emotion model version."""
+        start = time.perf_counter()
+        tokenizer, model = self.load_emotion_model(path)
+        precision = self.model_precision("emotion", path)
+        apply_precision(model, precision).to(self.device).eval()
+        loaded_at = time.perf_counter()
+        compiled = None
+        # Optional static-shape emotion model: length buckets compiled up front, before serving
+        if self.emotion_compile != "eager":
+            print(f"Compiling emotion model ({self.emotion_compile}) for length and batch buckets...")
+            compiled = BucketedEmotionModel(model, tokenizer, mode=self.emotion_compile, device=self.device,
+                                            max_batch_size=self.emotion_batch_size)
+            compiled.warmup()
+        else:
+            with torch.no_grad(), autocast(precision, self.device.type):
+                model(**tokenizer(["warm-up"], return_tensors="pt").to(self.device))
+        timings = {"load": loaded_at - start, "warmup": time.perf_counter() - loaded_at}
+        return LoadedModel("emotion", version, tokenizer, model, compiled, timings, precision)
+
+    def build_response_model(self, version: str, path: str) -> LoadedModel:
+        """Load and warm up one response model version."""
+        start = time.perf_counter()
+        tokenizer, model = self.load_response_model(path)
+        precision = self.model_precision("response", path)
+        apply_precision(model, precision).to(self.device).eval()
+        loaded_at = time.perf_counter()
+        input_ids = tokenizer.encode("warm-up" + tokenizer.eos_token, return_tensors="pt").to(self.device)
+        with torch.no_grad(), autocast(precision, self.device.type):
+            model.generate(input_ids, max_new_tokens=2, pad_token_id=tokenizer.pad_token_id)
+        timings = {"load": loaded_at - start, "warmup": time.perf_counter() - loaded_at}
+        return LoadedModel("response", version, tokenizer, model, timings=timings, precision=precision)
+
+    def emotion_probabilities(self, loaded: LoadedModel, texts: List[str]) -> List[List[float]]:
+        if loaded.compiled is not None:
+            logits = loaded.compiled.logits(texts)
+        else:
+            inputs = loaded.tokenizer(texts, return_tensors="pt", truncation=True, padding=True).to(self.device)
+            with torch.no_grad(), autocast(loaded.precision, self.device.type):
+                logits = loaded.model(**inputs).logits
+        return torch.nn.functional.softmax(logits.float(), dim=-1).tolist()
+
+    def generate(self, loaded: LoadedModel, prompts: List[str], candidates: int, max_new_tokens: int,
+                 **sampling) -> List[str]:
+        tokenizer = loaded.tokenizer
+        encoded = [tokenizer.encode(p + tokenizer.eos_token) for p in prompts]
+        input_ids, attention_mask = left_pad(encoded, tokenizer.pad_token_id)
+        input_ids, attention_mask = input_ids.to(self.device), attention_mask.to(self.device)
+        with torch.no_grad(), autocast(loaded.precision, self.device.type):
+            out = loaded.model.generate(
+                input_ids,
+                attention_mask=attention_mask,
+                max_new_tokens=max_new_tokens,
+                pad_token_id=tokenizer.pad_token_id,
+                eos_token_id=tokenizer.eos_token_id,
+                num_return_sequences=candidates,
+                **sampling,
+            )
+        # rows come back grouped per prompt: candidates for item 0, then item 1, ...
+        # decode only the newly generated tokens
+        return [tokenizer.decode(row[input_ids.shape[-1]:], skip_special_tokens=True).strip() for row in out]
+
+    def count_tokens(self, loaded: LoadedModel, text: str) -> int:
+        return len(loaded.tokenizer.encode(text))
+
+    def memory_mb(self, loaded: LoadedModel) -> float:
+        return model_memory_mb(loaded.model) if loaded.model is not None else 0.0
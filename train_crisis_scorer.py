@@ -0,0 +1,178 @@
+# train_crisis_scorer.py
+"""
+Train the lightweight ML severity scorer used by CrisisDetector.
+
+Reads a labeled JSONL file ({"text": ..., "level": "NONE"|"LOW"|"MEDIUM"|"HIGH"|"CRITICAL"}
+or an integer level), trains a hashed n-gram linear model with NumPy, then:
+  - checks the model on its own against the evaluate.py crisis cases: its recall
+    on the crisis cases (--min-recall) and how often it would escalate a message
+    above its expected level (--max-false-escalation)
+  - only if that passes, saves it to ./models/crisis_severity.npz (picked up
+    automatically by get_detector), atomically, so a rejected model never goes live
+  - benchmarks scoring throughput (rules only vs rules + model)
+
+Run:
+    python train_crisis_scorer.py
+    python train_crisis_scorer.py --data my_labels.jsonl --bench-only
+"""
+
+import os
+import sys
+import json
+import tempfile
+import time
+import argparse
+from crisis_detector import (CrisisDetector, CrisisLevel, SeverityScorer,
+                             SEVERITY_MODEL_PATH, SEVERITY_THRESHOLD)
+
+DEFAULT_DATA = "./data/crisis_severity_seed.jsonl"
+
+BENCH_TEXTS = [
+    "I had a bad day at work",
+    "I feel worthless and hopeless",
+    "nobody would notice if I disappeared",
+    "I'm stressed about exams and my parents keep asking about grades " * 4,
+]
+
+
+def load_labeled(path):
+    texts, labels = [], []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            level = row["level"]
+            level = CrisisLevel[level.upper()] if isinstance(level, str) else CrisisLevel(int(level))
+            texts.append(row["text"])
+            labels.append(level.value)
+    return texts, labels
+
+
+def benchmark(scorer, n=20000):
+    """Per-message latency for the scorer alone and for detect() with and without it."""
+    texts = (BENCH_TEXTS * (n // len(BENCH_TEXTS) + 1))[:n]
+    rules = CrisisDetector("india")
+    with_model = CrisisDetector("india", severity_model=scorer)
+    results = {}
+    for name, fn in [("scorer.predict", scorer.predict),
+                     ("detect (rules)", rules.detect),
+                     ("detect (rules + model)", with_model.detect)]:
+        t0 = time.perf_counter()
+        for text in texts:
+            fn(text)
+        elapsed = time.perf_counter() - t0
+        results[name] = {"us_per_msg": 1e6 * elapsed / n, "msgs_per_sec": n / elapsed}
+
+    t0 = time.perf_counter()
+    for start in range(0, n, 256):
+        scorer.predict_proba_batch(texts[start:start + 256])
+    elapsed = time.perf_counter() - t0
+    results["scorer batch (256)"] = {"us_per_msg": 1e6 * elapsed / n, "msgs_per_sec": n / elapsed}
+
+    print("\n" + "=" * 60)
+    print("THROUGHPUT")
+    print("=" * 60)
+    for name, r in results.items():
+        print(f"{name:<26}{r['us_per_msg']:>10.1f} µs/msg{r['msgs_per_sec']:>12.0f} msgs/sec")
+    return results
+
+
+def model_check(scorer, threshold, min_recall, max_false_escalation):
+    """
+    Score the model on its own against the evaluate.py crisis cases. The model can
+    only ever escalate the rules' level, so comparing rules with rules + model can't
+    show a bad model; what matters is whether its confident predictions are right.
+
+    - recall: share of crisis cases the model itself flags (any level above NONE)
+      confidently enough (threshold) to act on
+    - false escalation: share of all cases where it confidently predicts a level
+      above the expected one (for non-crisis cases, any crisis level)
+    """
+    from evaluate import CRISIS_TEST_CASES
+
+    crisis_cases = [(text, level) for text, should_detect, level in CRISIS_TEST_CASES if should_detect]
+    flagged, escalated, missed = 0, [], []
+    for text, should_detect, expected in CRISIS_TEST_CASES:
+        level, confidence = scorer.predict(text)
+        if should_detect and level != CrisisLevel.NONE and confidence >= threshold:
+            flagged += 1
+        elif should_detect:
+            missed.append(text)
+        if confidence >= threshold and level.value > expected.value:
+            escalated.append(f"{text} -> {level.name} ({confidence:.2f})")
+    recall = flagged / len(crisis_cases)
+    false_escalation = len(escalated) / len(CRISIS_TEST_CASES)
+
+    print("\n" + "=" * 60)
+    print("SEVERITY MODEL CHECK (model alone)")
+    print("=" * 60)
+    print(f"Recall on crisis cases: {recall:.2%} (min {min_recall:.0%})")
+    for text in missed:
+        print(f"  ❌ missed: '{text}'")
+    print(f"False escalations:      {false_escalation:.2%} (max {max_false_escalation:.0%})")
+    for case in escalated:
+        print(f"  ⚠️  '{case}'")
+
+    # still worth knowing: what the combined detector misses
+    combined = CrisisDetector("india", severity_model=scorer, severity_threshold=threshold)
+    still_missed = [text for text, _ in crisis_cases if not combined.detect(text)[0]]
+    print(f"Missed by rules + model: {len(still_missed)}")
+    for text in still_missed:
+        print(f"  ❌ '{text}'")
+    return recall >= min_recall and false_escalation <= max_false_escalation
+
+
+def save_atomically(scorer, path):
+    """Write the model next to path and rename it into place, so readers never see a partial file."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".npz")
+    os.close(fd)
+    try:
+        scorer.save(tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the crisis severity scorer.")
+    parser.add_argument("--data", default=DEFAULT_DATA, help="labeled JSONL file")
+    parser.add_argument("--out", default=SEVERITY_MODEL_PATH)
+    parser.add_argument("--features", type=int, default=1 << 16, help="hashed feature buckets")
+    parser.add_argument("--epochs", type=int, default=30)
+    parser.add_argument("--threshold", type=float, default=SEVERITY_THRESHOLD,
+                        help="confidence needed for the model to escalate a level")
+    parser.add_argument("--min-recall", type=float, default=0.9,
+                        help="model-alone recall needed on the evaluation crisis cases")
+    parser.add_argument("--max-false-escalation", type=float, default=0.1,
+                        help="largest share of evaluation cases the model may over-escalate")
+    parser.add_argument("--bench-only", action="store_true", help="load --out instead of training")
+    args = parser.parse_args()
+
+    if args.bench_only:
+        scorer = SeverityScorer.load(args.out)
+    else:
+        texts, labels = load_labeled(args.data)
+        print(f"Training on {len(texts)} labeled messages from {args.data}...")
+        t0 = time.perf_counter()
+        scorer = SeverityScorer.fit(texts, labels, n_features=args.features, epochs=args.epochs)
+        print(f"Trained in {time.perf_counter() - t0:.2f}s")
+        train_acc = sum(scorer.predict(t)[0].value == y for t, y in zip(texts, labels)) / len(texts)
+        print(f"Training accuracy: {train_acc:.2%}")
+
+    if not model_check(scorer, args.threshold, args.min_recall, args.max_false_escalation):
+        print(f"\n❌ Severity model failed the check; {args.out} was not changed")
+        return 1
+    if not args.bench_only:
+        save_atomically(scorer, args.out)
+        print(f"\n✅ Saved severity model to {args.out}")
+    benchmark(scorer)
+    print("\n✓ Severity model passed the check")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
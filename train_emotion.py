@@ -2,59 +2,151 @@
 """
 Fine-tune a BERT-based emotion classifier on the dair-ai/emotion dataset.
 Saves model/tokenizer to ./models/emotion_detector
+
+Tokenized splits are persisted under ./dataset/cache and reused across runs;
+training batches are grouped by length to keep padding tight.
+
+With --distill, trains a compact student (fewer layers, smaller hidden size)
+against the fine-tuned teacher's logits instead, saves it to
+./models/emotion_detector_small and reports accuracy / latency / size for
+teacher and student. Point EMOTION_MODEL_DIR at the student to serve it.
+
 Run:
     python train_emotion.py
+    python train_emotion.py --distill
 """
 
 import os
-from datasets import load_dataset
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+from datasets import load_dataset, load_from_disk
 from transformers import (AutoTokenizer, AutoModelForSequenceClassification,
                           Trainer, TrainingArguments, DataCollatorWithPadding)
 import numpy as np
+import torch
+import torch.nn.functional as F
 from sklearn.metrics import accuracy_score
+import model_registry
 
 MODEL_NAME = "bert-base-uncased"
 OUT_DIR = "./models/emotion_detector"
 NUM_LABELS = 6  # dair-ai/emotion labels: anger, fear, joy, love, sadness, surprise
+TOKENIZED_CACHE_DIR = "./dataset/cache"
 
-def main():
-    os.makedirs(OUT_DIR, exist_ok=True)
+# Distillation defaults. The student shares bert-base-uncased's WordPiece vocab,
+# so teacher and student see identical token ids.
+STUDENT_MODEL_NAME = "google/bert_uncased_L-4_H-512_A-8"
+STUDENT_OUT_DIR = "./models/emotion_detector_small"
+DISTILL_TEMPERATURE = 2.0
+DISTILL_ALPHA = 0.5  # weight of the hard-label loss; (1 - alpha) goes to the soft-target loss
+
+
+def compute_metrics(eval_pred):
+    logits, labels = eval_pred
+    preds = np.argmax(logits, axis=-1)
+    acc = accuracy_score(labels, preds)
+    return {"accuracy": acc}
+
+
+def tokenize_dataset(ds, tokenizer, num_proc=None):
+    """
+    Tokenize every split, reusing a persisted copy from TOKENIZED_CACHE_DIR when one
+    exists for this tokenizer and dataset version. Adds a "length" column for the
+    length-grouped sampler. The cache is written to a temporary directory and
+    renamed into place, so a crash mid-write never leaves a half-written cache.
+    """
+    key = hashlib.sha1(json.dumps({
+        "tokenizer": tokenizer.name_or_path,
+        "vocab_size": len(tokenizer),
+        "splits": {name: split._fingerprint for name, split in ds.items()},
+    }, sort_keys=True).encode()).hexdigest()[:16]
+    cache_dir = os.path.join(TOKENIZED_CACHE_DIR, f"emotion-{key}")
+
+    if os.path.isdir(cache_dir):
+        print(f"Using cached tokenized dataset: {cache_dir}")
+        tokenized = load_from_disk(cache_dir)
+    else:
+        def preprocess(batch):
+            enc = tokenizer(batch["text"], truncation=True)
+            enc["length"] = [len(ids) for ids in enc["input_ids"]]
+            return enc
+
+        num_proc = num_proc or os.cpu_count()
+        print(f"Tokenizing with {num_proc} processes...")
+        tokenized = ds.map(preprocess, batched=True, num_proc=num_proc)
+        tokenized = tokenized.remove_columns(["text"])
+        tokenized = tokenized.rename_column("label", "labels")
+        os.makedirs(TOKENIZED_CACHE_DIR, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=TOKENIZED_CACHE_DIR, prefix=f".emotion-{key}-")
+        try:
+            tokenized.save_to_disk(tmp_dir)
+            os.replace(tmp_dir, cache_dir)
+            print(f"Saved tokenized dataset to {cache_dir}")
+        except OSError as e:
+            print(f"⚠️  Could not save tokenized dataset to {cache_dir}: {e}")
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    tokenized.set_format(type="torch")
+    return tokenized
+
+
+def report_throughput(train_result):
+    metrics = train_result.metrics
+    print(f"Training throughput: {metrics['train_samples_per_second']:.1f} samples/sec "
+          f"({metrics['train_runtime']:.0f}s)")
+
+
+def load_emotion_dataset(max_train_examples=None):
+    """dair-ai/emotion, with the train split subsampled deterministically if max_train_examples is set."""
     print("Loading dataset...")
     ds = load_dataset("dair-ai/emotion")
+    if max_train_examples:
+        ds["train"] = ds["train"].shuffle(seed=42).select(range(min(max_train_examples, len(ds["train"]))))
+    return ds
+
+
+def train_teacher(model_name=MODEL_NAME, learning_rate=2e-5, batch_size=16, epochs=3,
+                  out_dir=OUT_DIR, max_train_examples=None, callbacks=None, save=True,
+                  run_dir="./runs/emotion", num_proc=None):
+    """
+    Fine-tune model_name on dair-ai/emotion and return the Trainer.
+
+    max_train_examples subsamples the train split (used by hyperparameter search);
+    save=False skips checkpoints and the final save; num_proc caps tokenization
+    processes (default: all cores).
+    """
+    if save:
+        os.makedirs(out_dir, exist_ok=True)
+    ds = load_emotion_dataset(max_train_examples)
     label_names = ds["train"].features["label"].names
     print("Labels:", label_names)
 
     print("Loading tokenizer and model...")
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-    model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME, num_labels=NUM_LABELS)
-
-    def preprocess(batch):
-        return tokenizer(batch["text"], truncation=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForSequenceClassification.from_pretrained(model_name, num_labels=NUM_LABELS)
 
-    print("Tokenizing...")
-    tokenized = ds.map(preprocess, batched=True)
-    tokenized = tokenized.remove_columns(["text"])
-    tokenized = tokenized.rename_column("label", "labels")
-    tokenized.set_format(type="torch")
+    tokenized = tokenize_dataset(ds, tokenizer, num_proc=num_proc)
 
     data_collator = DataCollatorWithPadding(tokenizer=tokenizer)
 
-    def compute_metrics(eval_pred):
-        logits, labels = eval_pred
-        preds = np.argmax(logits, axis=-1)
-        acc = accuracy_score(labels, preds)
-        return {"accuracy": acc}
-
     training_args = TrainingArguments(
-        output_dir="./runs/emotion",
+        output_dir=run_dir,
         eval_strategy="epoch",
-        save_strategy="epoch",
-        num_train_epochs=3,
-        per_device_train_batch_size=16,
+        save_strategy="epoch" if save else "no",
+        num_train_epochs=epochs,
+        per_device_train_batch_size=batch_size,
         per_device_eval_batch_size=32,
-        learning_rate=2e-5,
+        learning_rate=learning_rate,
         weight_decay=0.01,
-        load_best_model_at_end=True,
+        group_by_length=True,
+        length_column_name="length",
+        load_best_model_at_end=save,
         metric_for_best_model="accuracy",
         push_to_hub=False,
         logging_steps=100
@@ -68,12 +160,203 @@ def main():
         tokenizer=tokenizer,
         data_collator=data_collator,
         compute_metrics=compute_metrics,
+        callbacks=callbacks,
+    )
+
+    report_throughput(trainer.train())
+    if save:
+        trainer.save_model(out_dir)
+        tokenizer.save_pretrained(out_dir)
+        print("Saved emotion model to", out_dir)
+    return trainer
+
+
+class DistillationTrainer(Trainer):
+    """Trainer that mixes hard-label cross-entropy with a KL term against precomputed teacher logits."""
+
+    def __init__(self, *args, temperature=DISTILL_TEMPERATURE, alpha=DISTILL_ALPHA, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.temperature = temperature
+        self.alpha = alpha
+
+    def compute_loss(self, model, inputs, return_outputs=False, **kwargs):
+        teacher_logits = inputs.pop("teacher_logits", None)
+        inputs.pop("length", None)  # only used by the length-grouped sampler
+        outputs = model(**inputs)
+        loss = outputs.loss
+        if teacher_logits is not None:
+            t = self.temperature
+            soft_loss = F.kl_div(
+                F.log_softmax(outputs.logits / t, dim=-1),
+                F.softmax(teacher_logits.to(outputs.logits.dtype) / t, dim=-1),
+                reduction="batchmean",
+            ) * (t * t)
+            loss = self.alpha * loss + (1.0 - self.alpha) * soft_loss
+        return (loss, outputs) if return_outputs else loss
+
+
+def teacher_logits_for(model, tokenized_split, collator, batch_size=64):
+    """Run the teacher once over a split so distillation epochs don't pay for teacher forwards."""
+    device = next(model.parameters()).device
+    model.eval()
+    loader = torch.utils.data.DataLoader(
+        tokenized_split.remove_columns(["labels", "length"]), batch_size=batch_size, collate_fn=collator
     )
+    chunks = []
+    with torch.no_grad():
+        for batch in loader:
+            batch = {k: v.to(device) for k, v in batch.items()}
+            chunks.append(model(**batch).logits.float().cpu())
+    return torch.cat(chunks).numpy()
+
+
+def model_size_mb(model):
+    return sum(p.numel() * p.element_size() for p in model.parameters()) / (1024 * 1024)
+
+
+def benchmark_model(model, tokenizer, texts, labels, latency_samples=200):
+    """Return accuracy on (texts, labels) plus single-message latency, mirroring /chat traffic."""
+    device = next(model.parameters()).device
+    model.eval()
+    preds = []
+    with torch.no_grad():
+        for start in range(0, len(texts), 64):
+            inputs = tokenizer(texts[start:start + 64], return_tensors="pt",
+                               truncation=True, padding=True).to(device)
+            preds.extend(torch.argmax(model(**inputs).logits, dim=-1).tolist())
+
+        sample = texts[:latency_samples]
+        for text in sample[:10]:  # warm-up
+            model(**tokenizer(text, return_tensors="pt", truncation=True).to(device))
+        t0 = time.perf_counter()
+        for text in sample:
+            model(**tokenizer(text, return_tensors="pt", truncation=True).to(device))
+        latency_ms = (time.perf_counter() - t0) * 1000 / len(sample)
+
+    return {
+        "accuracy": accuracy_score(labels, preds),
+        "latency_ms": latency_ms,
+        "params_m": sum(p.numel() for p in model.parameters()) / 1e6,
+        "size_mb": model_size_mb(model),
+    }
+
+
+def distill(teacher_dir=OUT_DIR, student_name=STUDENT_MODEL_NAME, out_dir=STUDENT_OUT_DIR,
+            temperature=DISTILL_TEMPERATURE, alpha=DISTILL_ALPHA, epochs=4):
+    """Train and save the student; returns the teacher/student benchmark rows, or None if nothing was saved."""
+    if not os.path.isdir(teacher_dir):
+        print(f"❌ Teacher model not found at {teacher_dir}")
+        print("➜ Train it first: python train_emotion.py")
+        return
+    os.makedirs(out_dir, exist_ok=True)
+
+    print("Loading dataset...")
+    ds = load_dataset("dair-ai/emotion")
+
+    print(f"Loading teacher from {teacher_dir}...")
+    tokenizer = AutoTokenizer.from_pretrained(teacher_dir)
+    teacher = AutoModelForSequenceClassification.from_pretrained(teacher_dir)
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    teacher.to(device)
+
+    print(f"Loading student {student_name}...")
+    student = AutoModelForSequenceClassification.from_pretrained(
+        student_name,
+        num_labels=NUM_LABELS,
+        id2label=teacher.config.id2label,
+        label2id=teacher.config.label2id,
+    )
+
+    tokenized = tokenize_dataset(ds, tokenizer)
+    data_collator = DataCollatorWithPadding(tokenizer=tokenizer)
+
+    print("Computing teacher logits...")
+    logits = teacher_logits_for(teacher, tokenized["train"], data_collator)
+    train_split = tokenized["train"].add_column("teacher_logits", logits.tolist())
+    train_split.set_format(type="torch")
+
+    training_args = TrainingArguments(
+        output_dir="./runs/emotion_distill",
+        eval_strategy="epoch",
+        save_strategy="epoch",
+        num_train_epochs=epochs,
+        per_device_train_batch_size=32,
+        per_device_eval_batch_size=64,
+        learning_rate=1e-4,
+        weight_decay=0.01,
+        group_by_length=True,
+        length_column_name="length",
+        load_best_model_at_end=True,
+        metric_for_best_model="accuracy",
+        push_to_hub=False,
+        logging_steps=100,
+        remove_unused_columns=False,
+    )
+
+    trainer = DistillationTrainer(
+        model=student,
+        args=training_args,
+        train_dataset=train_split,
+        eval_dataset=tokenized["validation"],
+        tokenizer=tokenizer,
+        data_collator=data_collator,
+        compute_metrics=compute_metrics,
+        temperature=temperature,
+        alpha=alpha,
+    )
+
+    report_throughput(trainer.train())
+    trainer.save_model(out_dir)
+    tokenizer.save_pretrained(out_dir)
+    print("Saved student emotion model to", out_dir)
+
+    print("\nBenchmarking teacher vs student on the test split...")
+    test_texts = list(ds["test"]["text"])
+    test_labels = list(ds["test"]["label"])
+    rows = [
+        ("teacher", benchmark_model(teacher, tokenizer, test_texts, test_labels)),
+        ("student", benchmark_model(trainer.model, tokenizer, test_texts, test_labels)),
+    ]
+    print("=" * 70)
+    print(f"{'model':<10}{'accuracy':>10}{'latency (ms)':>15}{'params (M)':>13}{'size (MB)':>12}")
+    for name, r in rows:
+        print(f"{name:<10}{r['accuracy']:>10.4f}{r['latency_ms']:>15.2f}{r['params_m']:>13.1f}{r['size_mb']:>12.1f}")
+    print("=" * 70)
+    print(f"To serve the student: EMOTION_MODEL_DIR={out_dir} uvicorn app:app")
+    return dict(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the emotion classifier.")
+    parser.add_argument("--distill", action="store_true",
+                        help="distill the fine-tuned teacher into a compact student")
+    parser.add_argument("--teacher", default=OUT_DIR, help="teacher model directory")
+    parser.add_argument("--student", default=STUDENT_MODEL_NAME, help="student model name or path")
+    parser.add_argument("--out", default=STUDENT_OUT_DIR, help="student output directory")
+    parser.add_argument("--temperature", type=float, default=DISTILL_TEMPERATURE)
+    parser.add_argument("--alpha", type=float, default=DISTILL_ALPHA)
+    parser.add_argument("--epochs", type=int, default=None,
+                        help="training epochs (default: 3, or 4 with --distill)")
+    parser.add_argument("--lr", type=float, default=2e-5, help="teacher learning rate")
+    parser.add_argument("--batch-size", type=int, default=16, help="teacher train batch size")
+    parser.add_argument("--no-register", action="store_true",
+                        help="don't add the saved model to the model registry")
+    args = parser.parse_args()
+
+    if args.distill:
+        if distill(args.teacher, args.student, args.out, args.temperature, args.alpha, args.epochs or 4) is None:
+            print("➜ No student was trained, so nothing was registered")
+            sys.exit(1)
+        saved = args.out
+    else:
+        train_teacher(learning_rate=args.lr, batch_size=args.batch_size, epochs=args.epochs or 3)
+        saved = OUT_DIR
 
-    trainer.train()
-    trainer.save_model(OUT_DIR)
-    tokenizer.save_pretrained(OUT_DIR)
-    print("Saved emotion model to", OUT_DIR)
+    if not args.no_register:
+        version = model_registry.register("emotion", saved, metadata={"distilled": args.distill})
+        print(f"Registered {saved} as emotion model {version} (now active)")
+        print(f"➜ Swap it into a running server: curl -X POST localhost:8000/admin/models/emotion/activate "
+              f"-H \"X-Admin-Token: $ADMIN_TOKEN\" -H 'Content-Type: application/json' -d '{{}}'")
 
 if __name__ == "__main__":
     main()
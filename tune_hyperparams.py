@@ -0,0 +1,254 @@
+# tune_hyperparams.py
+"""
+Optuna hyperparameter search for train_emotion.py and fine_tune.py.
+
+- trials run in parallel worker processes, each pinned to a share of the CPU cores
+- the training data is tokenized once, in the parent, before workers start; workers
+  only read the finished tokenized cache
+- every trial trains on a subsample of the data
+- intermediate eval metrics (accuracy / perplexity) are reported so bad trials are pruned early
+- the study lives in a local SQLite file, so an interrupted search resumes where it stopped
+- the objective can add inference latency, to find configs that are both good and fast:
+    emotion:  maximize  accuracy - latency_weight * latency_ms
+    response: minimize  perplexity + latency_weight * latency_ms
+
+Run:
+    python tune_hyperparams.py emotion --trials 20 --workers 4
+    python tune_hyperparams.py response --trials 12 --latency-weight 0.05
+"""
+
+import os
+import math
+import time
+import argparse
+import multiprocessing as mp
+
+import optuna
+import torch
+from transformers import TrainerCallback
+
+STORAGE = "sqlite:///runs/optuna.db"
+RUN_DIR = "./runs/optuna"
+
+LATENCY_PROMPTS = [
+    "User: I've been feeling anxious about work lately.\nBot:",
+    "User: I can't sleep and I keep overthinking everything.\nBot:",
+    "User: My friend stopped talking to me and I don't know why.\nBot:",
+    "User: I finally finished my thesis today!\nBot:",
+]
+
+
+class OptunaPruningCallback(TrainerCallback):
+    """Reports an eval metric to the trial after every evaluation and stops the run if Optuna prunes it."""
+
+    def __init__(self, trial, metric, transform=None):
+        self.trial = trial
+        self.metric = metric
+        self.transform = transform
+
+    def on_evaluate(self, args, state, control, metrics=None, **kwargs):
+        if not metrics or self.metric not in metrics:
+            return
+        value = metrics[self.metric]
+        if self.transform:
+            value = self.transform(value)
+        self.trial.report(value, step=state.global_step)
+        if self.trial.should_prune():
+            raise optuna.TrialPruned(f"{self.metric}={value:.4f} at step {state.global_step}")
+
+
+def make_pruner():
+    # pruners aren't persisted in the storage, so every process builds the same one
+    return optuna.pruners.MedianPruner(n_startup_trials=3, n_warmup_steps=1)
+
+
+def perplexity(eval_loss):
+    return math.exp(min(eval_loss, 20))
+
+
+def emotion_models():
+    import train_emotion
+    return [train_emotion.MODEL_NAME, train_emotion.STUDENT_MODEL_NAME]
+
+
+def emotion_objective(trial, args):
+    import train_emotion
+    from datasets import load_dataset
+
+    model_name = trial.suggest_categorical("model_name", emotion_models())
+    learning_rate = trial.suggest_float("learning_rate", 1e-5, 1e-4, log=True)
+    batch_size = trial.suggest_categorical("batch_size", [16, 32, 64])
+    epochs = trial.suggest_int("epochs", 1, 4)
+
+    trainer = train_emotion.train_teacher(
+        model_name=model_name,
+        learning_rate=learning_rate,
+        batch_size=batch_size,
+        epochs=epochs,
+        max_train_examples=args.subsample,
+        callbacks=[OptunaPruningCallback(trial, "eval_accuracy")],
+        save=False,
+        run_dir=os.path.join(RUN_DIR, "emotion", f"trial_{trial.number}"),
+        num_proc=args.num_proc,
+    )
+
+    val = load_dataset("dair-ai/emotion")["validation"]
+    result = train_emotion.benchmark_model(
+        trainer.model, trainer.tokenizer, list(val["text"]), list(val["label"]), latency_samples=100
+    )
+    trial.set_user_attr("accuracy", result["accuracy"])
+    trial.set_user_attr("latency_ms", result["latency_ms"])
+    return result["accuracy"] - args.latency_weight * result["latency_ms"]
+
+
+def generation_latency_ms(model, tokenizer, prompts, max_new_tokens=40):
+    """Mean time to generate one reply, using the same sampling setup as app.generate_response_with_tone."""
+    device = next(model.parameters()).device
+    model.eval()
+    timings = []
+    with torch.no_grad():
+        for i, prompt in enumerate(prompts):
+            input_ids = tokenizer.encode(prompt + tokenizer.eos_token, return_tensors="pt").to(device)
+            t0 = time.perf_counter()
+            model.generate(
+                input_ids,
+                max_new_tokens=max_new_tokens,
+                do_sample=True,
+                top_p=0.92,
+                top_k=50,
+                temperature=0.85,
+                pad_token_id=tokenizer.pad_token_id,
+                eos_token_id=tokenizer.eos_token_id,
+                no_repeat_ngram_size=3,
+                repetition_penalty=1.2,
+            )
+            if i > 0:  # first call is warm-up
+                timings.append(time.perf_counter() - t0)
+    return 1000 * sum(timings) / max(len(timings), 1)
+
+
+def response_objective(trial, args):
+    import fine_tune
+
+    mode = trial.suggest_categorical("mode", list(fine_tune.DATA_MODES))
+    learning_rate = trial.suggest_float("learning_rate", 1e-5, 2e-4, log=True)
+    batch_size = trial.suggest_categorical("batch_size", [2, 4, 8])
+    epochs = trial.suggest_int("epochs", 1, 3)
+
+    trainer, tokenizer, throughput = fine_tune.train(
+        fine_tune.dataset_source(),
+        mode,
+        epochs,
+        output_dir=os.path.join(RUN_DIR, "response", f"trial_{trial.number}"),
+        learning_rate=learning_rate,
+        batch_size=batch_size,
+        eval_steps=args.eval_steps,
+        max_train_examples=args.subsample,
+        callbacks=[OptunaPruningCallback(trial, "eval_loss", transform=perplexity)],
+        save_checkpoints=False,
+    )
+
+    ppl = perplexity(trainer.evaluate()["eval_loss"])
+    latency_ms = generation_latency_ms(trainer.model, tokenizer, LATENCY_PROMPTS)
+    trial.set_user_attr("perplexity", ppl)
+    trial.set_user_attr("latency_ms", latency_ms)
+    trial.set_user_attr("train_tokens_per_sec", throughput["tokens_per_sec"])
+    return ppl + args.latency_weight * latency_ms
+
+
+TASKS = {
+    "emotion": (emotion_objective, "maximize"),
+    "response": (response_objective, "minimize"),
+}
+
+
+def prepare_data(args):
+    """
+    Build the tokenized caches every trial will use, before any worker starts, so
+    parallel workers never tokenize (and write) the same cache at the same time.
+    """
+    if args.task == "emotion":
+        import train_emotion
+        from transformers import AutoTokenizer
+        ds = train_emotion.load_emotion_dataset(args.subsample)
+        for model_name in emotion_models():
+            train_emotion.tokenize_dataset(ds, AutoTokenizer.from_pretrained(model_name))
+    else:
+        import fine_tune
+        tokenizer = fine_tune.load_tokenizer()
+        for mode in fine_tune.DATA_MODES:
+            fine_tune.load_tokenized_splits(tokenizer, mode)
+
+
+def run_worker(args, threads):
+    """Worker process: attach to the shared study and run trials until the study-wide budget is used."""
+    torch.set_num_threads(threads)
+    objective, _ = TASKS[args.task]
+    study = optuna.load_study(study_name=args.study_name, storage=args.storage, pruner=make_pruner())
+    study.optimize(
+        lambda trial: objective(trial, args),
+        callbacks=[optuna.study.MaxTrialsCallback(
+            args.trials, states=(optuna.trial.TrialState.COMPLETE, optuna.trial.TrialState.PRUNED)
+        )],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel Optuna search for the MindMate training scripts.")
+    parser.add_argument("task", choices=sorted(TASKS))
+    parser.add_argument("--trials", type=int, default=20, help="total trials for the study (across resumes)")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 4),
+                        help="parallel trial processes; CPU cores are split evenly between them")
+    parser.add_argument("--subsample", type=int, default=2000, help="training examples per trial")
+    parser.add_argument("--latency-weight", type=float, default=0.0,
+                        help="weight of inference latency (ms) in the objective")
+    parser.add_argument("--eval-steps", type=int, default=50, help="response trials: steps between evals")
+    parser.add_argument("--storage", default=STORAGE)
+    parser.add_argument("--study-name", default=None, help="default: mindmate-<task>")
+    args = parser.parse_args()
+    args.study_name = args.study_name or f"mindmate-{args.task}"
+
+    os.makedirs(RUN_DIR, exist_ok=True)
+    _, direction = TASKS[args.task]
+    study = optuna.create_study(
+        study_name=args.study_name,
+        storage=args.storage,
+        direction=direction,
+        pruner=make_pruner(),
+        load_if_exists=True,
+    )
+    done = len([t for t in study.trials if t.state.is_finished()])
+
+    threads = max(1, (os.cpu_count() or 1) // args.workers)
+    args.num_proc = threads  # a worker's tokenization stays within its share of the cores
+    prepare_data(args)
+
+    print("=" * 70)
+    print(f"Study {args.study_name} ({direction}) in {args.storage}")
+    print(f"  - {done} finished trials so far, target {args.trials}")
+    print(f"  - {args.workers} workers x {threads} threads, {args.subsample} training examples per trial")
+    print("=" * 70)
+
+    ctx = mp.get_context("spawn")
+    workers = [ctx.Process(target=run_worker, args=(args, threads)) for _ in range(args.workers)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+    study = optuna.load_study(study_name=args.study_name, storage=args.storage)
+    states = [t.state for t in study.trials]
+    print("\n" + "=" * 70)
+    print(f"Completed: {states.count(optuna.trial.TrialState.COMPLETE)}  "
+          f"Pruned: {states.count(optuna.trial.TrialState.PRUNED)}  "
+          f"Failed: {states.count(optuna.trial.TrialState.FAIL)}")
+    if any(s == optuna.trial.TrialState.COMPLETE for s in states):
+        best = study.best_trial
+        print(f"Best value: {best.value:.4f} (trial {best.number})")
+        for name, value in {**best.params, **best.user_attrs}.items():
+            print(f"  - {name}: {value}")
+    print("=" * 70)
+
+
+if __name__ == "__main__":
+    main()